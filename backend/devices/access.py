@@ -0,0 +1,92 @@
+from collections import namedtuple
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from utils.cache import TTLCache
+from .models import Device
+
+
+class DeviceAccess(namedtuple('DeviceAccess', ['device_id', 'type_id', 'is_member'])):
+    """Type of a device and whether a given user is mapped to it."""
+
+    def allows(self, user):
+        return self.is_member or user.is_superuser
+
+
+# (user id, device id) -> DeviceAccess, invalidated by devices.signals
+device_access_cache = TTLCache(maxsize=settings.DEVICE_ACCESS_CACHE_SIZE, ttl=settings.DEVICE_ACCESS_CACHE_TTL)
+
+
+def get_device_access(request, device_id):
+    """
+    Resolve the access of `request.user` to the device with `device_id`.
+
+    Returns None when the device does not exist. Results are memoized on the
+    request and cached per process, and a cache miss costs a single query
+    that reads the device type id and checks the user mapping with EXISTS.
+
+    Users authenticated by a token carrying device claims (see
+    users.authentication) are checked against the claimed ids, so a cache
+    miss only reads the device type, cached once for all such users.
+    """
+    try:
+        device_id = int(device_id)
+    except (TypeError, ValueError):
+        return None
+
+    memo = getattr(request, '_device_access', None)
+    if memo is None:
+        memo = request._device_access = {}
+    if device_id in memo:
+        return memo[device_id]
+
+    claimed_device_ids = getattr(request.user, 'claimed_device_ids', None)
+    if claimed_device_ids is not None:
+        access = device_access_cache.get((None, device_id))
+        if access is None:
+            type_id = Device.objects.filter(pk=device_id).values_list('type_id', flat=True).first()
+            if type_id is not None:
+                access = DeviceAccess(device_id, type_id, False)
+                device_access_cache.set((None, device_id), access)
+        if access is not None:
+            access = access._replace(is_member=device_id in claimed_device_ids)
+        memo[device_id] = access
+        return access
+
+    access = user_device_access(request.user, device_id)
+    memo[device_id] = access
+    return access
+
+
+def user_device_access(user, device_id):
+    """
+    Access of `user` to the device with `device_id` by their stored device
+    mapping, ignoring device claims, or None when the device does not exist.
+    Cached per process like get_device_access(), which it backs.
+    """
+    access = device_access_cache.get((user.pk, device_id))
+    if access is None:
+        membership = Device.users.through.objects.filter(device_id=OuterRef('pk'), customuser_id=user.pk)
+        row = (
+            Device.objects.filter(pk=device_id)
+            .annotate(is_member=Exists(membership))
+            .values_list('type_id', 'is_member')
+            .first()
+        )
+        if row is not None:
+            access = DeviceAccess(device_id, *row)
+            device_access_cache.set((user.pk, device_id), access)
+    return access
+
+
+def scope_to_user_devices(queryset, user, device_lookup='device'):
+    """
+    Narrow `queryset` to the rows of devices mapped to `user`. `device_lookup`
+    is the path from the model to its device, empty for Device itself.
+    Claimed device ids, when the user has them, replace the users join.
+    """
+    claimed_device_ids = getattr(user, 'claimed_device_ids', None)
+    if claimed_device_ids is not None:
+        lookup = f'{device_lookup}_id__in' if device_lookup else 'id__in'
+        return queryset.filter(**{lookup: claimed_device_ids})
+    lookup = f'{device_lookup}__users' if device_lookup else 'users'
+    return queryset.filter(**{lookup: user})
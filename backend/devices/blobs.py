@@ -0,0 +1,129 @@
+from django.db import transaction
+from django.db.models import Max
+from .imaging import RENDITIONS
+from .models import Image, ImageBlob
+from .pyramids import pyramid_root, tile_names
+from .renditions import rendition_name
+from .similarity import image_hash_index
+from .storage import blob_name, delete_files, list_files, save_files
+from .uploads import file_sha256
+
+
+class _BlobReleased(Exception):
+    """A blob found before writing was deleted, with its last image, before it could be locked."""
+
+
+def create_images(device_id, files, locations):
+    """
+    Create one Image of `device_id` per uploaded file, at the matching
+    (lat, long) of `locations`, and return them in the same order.
+
+    Content is stored once per SHA-256: files whose bytes are already
+    stored only add a row pointing at the existing ImageBlob, and reuse its
+    renditions, dHash and tile pyramid. New content is written in parallel
+    before any row is locked. All or nothing: on failure no rows are kept
+    and the newly written files no blob points to are deleted.
+    """
+    hashes = [file_sha256(file) for file in files]
+    contents = {}
+    for digest, file in zip(hashes, files):
+        contents.setdefault(digest, file)
+    written = {}
+    try:
+        missing = set(contents) - set(ImageBlob.objects.filter(sha256__in=contents).values_list('sha256', flat=True))
+        while True:
+            new = [digest for digest in contents if digest in missing and digest not in written]
+            names = save_files([(blob_name(digest, contents[digest].name, contents[digest].content_type), contents[digest]) for digest in new])
+            written.update(zip(new, names))
+            try:
+                with transaction.atomic():
+                    # A concurrent upload of the same content may have won the race
+                    ImageBlob.objects.bulk_create(
+                        [ImageBlob(sha256=digest, file=name, size=contents[digest].size) for digest, name in written.items()],
+                        ignore_conflicts=True,
+                    )
+                    # Locked so the last image of a blob cannot be deleted, and
+                    # the blob with it, while new images are pointed at it
+                    blobs = {blob.sha256: blob for blob in ImageBlob.objects.select_for_update().filter(sha256__in=contents)}
+                    missing = set(contents) - set(blobs)
+                    if missing:
+                        raise _BlobReleased
+                    images = _insert_images(device_id, hashes, locations, blobs)
+                break
+            except _BlobReleased:
+                continue
+    except Exception:
+        _delete_unreferenced(written.values())
+        raise
+    # Content that a concurrent upload stored under another name
+    _delete_unreferenced(written.values())
+    # Duplicates are searchable at once, no rendering needed
+    transaction.on_commit(lambda: image_hash_index.observe(images))
+    return images
+
+
+def _insert_images(device_id, hashes, locations, blobs):
+    renditions, hashes_by_blob, pyramids = {}, {}, {}
+    for blob_id, stored, dhash, pyramid in Image.objects.filter(blob__in=blobs.values()).values_list('blob_id', 'renditions', 'dhash', 'pyramid'):
+        if stored:
+            renditions.setdefault(blob_id, {}).update(stored)
+        if dhash is not None:
+            hashes_by_blob.setdefault(blob_id, dhash)
+        if pyramid and pyramid.get('status') == 'ready':
+            pyramids.setdefault(blob_id, pyramid)
+
+    # Nobody else can add images of the locked blobs, so the rows after
+    # this id are ours, even where bulk_create does not return ids
+    last_id = Image.objects.filter(blob__in=blobs.values()).aggregate(last=Max('id'))['last'] or 0
+    Image.objects.bulk_create([
+        Image(
+            device_id=device_id,
+            blob=blobs[digest],
+            image_file=blobs[digest].file.name,
+            geo_location_lat=lat,
+            geo_location_long=long,
+            renditions=renditions.get(blobs[digest].pk, {}),
+            dhash=hashes_by_blob.get(blobs[digest].pk),
+            pyramid=pyramids.get(blobs[digest].pk),
+        )
+        for digest, (lat, long) in zip(hashes, locations)
+    ])
+    return list(Image.objects.filter(blob__in=blobs.values(), id__gt=last_id).order_by('id'))
+
+
+def _delete_unreferenced(names):
+    referenced = set(ImageBlob.objects.filter(file__in=names).values_list('file', flat=True))
+    delete_files([name for name in names if name not in referenced])
+
+
+def blob_files(name, image=None):
+    """
+    Storage names of a blob's file and of everything generated from it: the
+    renditions and tiles derived from `name`, plus any other names recorded
+    on `image`, the blob's last image.
+    """
+    names = {name, *(rendition_name(name, rendition) for rendition in RENDITIONS), *list_files(pyramid_root(name))}
+    if image is not None:
+        names.update((image.renditions or {}).values())
+        names.update(tile_names(image.pyramid))
+    return sorted(names)
+
+
+def _delete_blob_files(name, image):
+    # A new upload of the same content may have been stored under the same name since
+    if ImageBlob.objects.filter(file=name).exists():
+        return
+    delete_files(blob_files(name, image))
+
+
+def release_blob(image):
+    """Delete the blob of a deleted image, and its stored files, once no image refers to it."""
+    if image.blob_id is None:
+        return
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(pk=image.blob_id).first()
+        if blob is None or Image.objects.filter(blob_id=blob.pk).exists():
+            return
+        blob.delete()
+        name = blob.file.name
+        transaction.on_commit(lambda: _delete_blob_files(name, image))
@@ -0,0 +1,103 @@
+import re
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.http import http_date
+from .storage import DirectUploadUnavailable, object_metadata, read_object, signed_download_url
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def redirect_response(name):
+    """Redirect to a short-lived signed URL so storage serves the bytes itself."""
+    response = HttpResponseRedirect(signed_download_url(name))
+    # The signed URL expires, so the redirect must not outlive it in caches
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def _etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    weak = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == weak:
+            return True
+    return False
+
+
+def parse_range(header, size):
+    """
+    Inclusive (start, end) of a single `bytes=` range, None to serve the
+    whole file (no or unsupported header) and False when unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def proxy_response(request, image_file):
+    """
+    Stream a stored file through the app with ETag, If-None-Match and
+    single-range support. Storages that are not S3 compatible fall back to
+    a plain FileResponse.
+    """
+    try:
+        metadata = object_metadata(image_file.name)
+    except DirectUploadUnavailable:
+        try:
+            return FileResponse(image_file)
+        except FileNotFoundError:
+            raise Http404("Image not found.")
+    if metadata is None:
+        raise Http404("Image not found.")
+
+    size, etag = metadata['size'], metadata['etag']
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'Cache-Control': 'private, max-age=3600'}
+    if metadata['last_modified'] is not None:
+        headers['Last-Modified'] = http_date(metadata['last_modified'].timestamp())
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and _etag_matches(if_none_match, etag):
+        response = HttpResponse(status=304)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    byte_range = parse_range(request.headers.get('Range'), size)
+    # A Range bound to another version of the file is ignored
+    if_range = request.headers.get('If-Range')
+    if byte_range and if_range and if_range.strip() != etag:
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_object(image_file.name, start, end), status=206, content_type=metadata['content_type'])
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        response = StreamingHttpResponse(read_object(image_file.name), content_type=metadata['content_type'])
+        response['Content-Length'] = size
+    for header, value in headers.items():
+        response[header] = value
+    return response
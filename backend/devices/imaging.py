@@ -0,0 +1,222 @@
+"""
+Pillow helpers run in worker processes and threads. This module must not
+import Django so that spawned workers can load it without configuring the
+project.
+"""
+import io
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from PIL import Image as PILImage, ImageOps
+
+# Longest edge in pixels, Pillow format and file extension of each rendition
+RENDITIONS = {
+    'thumbnail': (320, 'JPEG', 'jpg'),
+    'medium': (1280, 'JPEG', 'jpg'),
+    'preview': (640, 'WEBP', 'webp'),
+}
+QUALITY = {'JPEG': 82, 'WEBP': 78}
+
+# EXIF tags
+GPS_IFD = 0x8825
+EXIF_IFD = 0x8769
+GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+DATETIME = 0x0132
+DATETIME_ORIGINAL = 0x9003
+OFFSET_TIME_ORIGINAL = 0x9011
+
+
+def dhash(image):
+    """
+    64-bit difference hash of a Pillow image: one bit per pair of
+    horizontally adjacent pixels of a 9x8 grayscale version, set when the
+    left one is brighter. Similar pictures differ in few bits.
+    """
+    pixels = list(image.convert('L').resize((9, 8), PILImage.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = value << 1 | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return value
+
+
+def render(data, renditions):
+    """
+    Encode the requested renditions of an image and compute its dHash.
+
+    Runs in a worker process, so it only takes and returns bytes and ints.
+    """
+    with PILImage.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'L'):
+            source = source.convert('RGB')
+        outputs = {}
+        for rendition in renditions:
+            size, image_format, _ = RENDITIONS[rendition]
+            resized = source.copy()
+            resized.thumbnail((size, size), PILImage.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, quality=QUALITY[image_format], optimize=True)
+            outputs[rendition] = buffer.getvalue()
+        return outputs, dhash(source)
+
+
+def _jpeg_exif(header):
+    # Walk the JPEG segments up to the image data looking for the APP1 Exif block
+    position = 2
+    while position + 4 <= len(header):
+        if header[position] != 0xFF:
+            return None
+        marker = header[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in (0xD9, 0xDA):
+            return None
+        length = int.from_bytes(header[position + 2:position + 4], 'big')
+        if marker == 0xE1 and header[position + 4:position + 10] == b'Exif\x00\x00':
+            return header[position + 4:position + 2 + length]
+        position += 2 + length
+    return None
+
+
+def _exif(header):
+    exif = PILImage.Exif()
+    if header[:2] == b'\xff\xd8':
+        block = _jpeg_exif(header)
+        if block:
+            exif.load(block)
+        return exif
+    # Other formats: Pillow only parses the header when opening
+    try:
+        with PILImage.open(io.BytesIO(header)) as image:
+            return image.getexif()
+    except Exception:
+        return exif
+
+
+def _degrees(value, ref):
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    degrees += minutes / 60 + seconds / 3600
+    if not math.isfinite(degrees):
+        return None
+    return -degrees if str(ref).strip('\x00 ').upper() in ('S', 'W') else degrees
+
+
+def _moment(value, offset):
+    try:
+        moment = datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    offset = str(offset or '').strip('\x00 ')
+    if len(offset) == 6 and offset[0] in '+-' and offset[3] == ':':
+        try:
+            delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6]))
+        except ValueError:
+            return moment
+        return moment.replace(tzinfo=timezone(delta if offset[0] == '+' else -delta))
+    return moment
+
+
+def read_exif(header):
+    """
+    Geotag and capture time from the first bytes of an image file.
+
+    Only the EXIF block is parsed, the image itself is never decoded.
+    Returns a dict with `lat`, `long` (None when there is no usable GPS fix)
+    and `captured_at` (a datetime, naive when the camera recorded no offset).
+    """
+    try:
+        exif = _exif(header)
+        gps = exif.get_ifd(GPS_IFD)
+        details = exif.get_ifd(EXIF_IFD)
+    except Exception:
+        return {'lat': None, 'long': None, 'captured_at': None}
+
+    lat = _degrees(gps.get(GPS_LATITUDE), gps.get(GPS_LATITUDE_REF))
+    long = _degrees(gps.get(GPS_LONGITUDE), gps.get(GPS_LONGITUDE_REF))
+    if lat is None or long is None or not (-90 <= lat <= 90 and -180 <= long <= 180) or (lat == 0 and long == 0):
+        # 0, 0 is what many devices write without a fix
+        lat = long = None
+
+    captured_at = None
+    if details.get(DATETIME_ORIGINAL):
+        captured_at = _moment(details[DATETIME_ORIGINAL], details.get(OFFSET_TIME_ORIGINAL))
+    if captured_at is None and exif.get(DATETIME):
+        captured_at = _moment(exif[DATETIME], None)
+    return {'lat': lat, 'long': long, 'captured_at': captured_at}
+
+
+def image_size(header):
+    """
+    (width, height) from the first bytes of an image file, or None when they
+    do not hold it. Unlike PIL.Image.open this does not stop at Pillow's
+    decompression bomb limit, so images over it are sized too.
+    """
+    PILImage.init()
+    for format_id in PILImage.ID:
+        factory, accept = PILImage.OPEN[format_id]
+        result = accept(header[:16]) if accept else True
+        if not result or isinstance(result, (str, bytes)):
+            continue
+        try:
+            with factory(io.BytesIO(header), None) as image:
+                return image.size
+        except Exception:
+            continue
+    return None
+
+
+def pyramid_levels(width, height):
+    """Number of deep zoom levels: level 0 is 1x1, each next level doubles, the last is full size."""
+    return math.ceil(math.log2(max(width, height, 1))) + 1
+
+
+def level_size(width, height, levels, level):
+    scale = 2 ** (levels - 1 - level)
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+
+def cut_pyramid(path, out_dir, tile_size, overlap, quality, max_pixels):
+    """
+    Cut the image at `path` into a deep zoom tile pyramid under `out_dir`,
+    as `<level>/<column>_<row>.jpg` tiles of `tile_size` pixels plus
+    `overlap` pixels shared with each neighbour.
+
+    The image is decoded once; each lower level is the previous one halved.
+    Runs in a worker process and returns the full size (width, height).
+    """
+    # Lifted for this job only, pool workers run one job at a time and
+    # render() relies on Pillow's decompression bomb limit; `max_pixels` is
+    # checked against the header instead, before anything is decoded
+    default_max_pixels = PILImage.MAX_IMAGE_PIXELS
+    PILImage.MAX_IMAGE_PIXELS = None
+    try:
+        with PILImage.open(path) as source:
+            if source.size[0] * source.size[1] > max_pixels:
+                raise PILImage.DecompressionBombError(f'Image has more than {max_pixels} pixels')
+            image = ImageOps.exif_transpose(source)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            width, height = image.size
+            levels = pyramid_levels(width, height)
+            for level in reversed(range(levels)):
+                size = level_size(width, height, levels, level)
+                if image.size != size:
+                    image = image.resize(size, PILImage.BOX)
+                os.makedirs(os.path.join(out_dir, str(level)), exist_ok=True)
+                for column in range(math.ceil(size[0] / tile_size)):
+                    for row in range(math.ceil(size[1] / tile_size)):
+                        box = (
+                            max(column * tile_size - overlap, 0),
+                            max(row * tile_size - overlap, 0),
+                            min((column + 1) * tile_size + overlap, size[0]),
+                            min((row + 1) * tile_size + overlap, size[1]),
+                        )
+                        image.crop(box).save(os.path.join(out_dir, str(level), f'{column}_{row}.jpg'), 'JPEG', quality=quality)
+            return width, height
+    finally:
+        PILImage.MAX_IMAGE_PIXELS = default_max_pixels
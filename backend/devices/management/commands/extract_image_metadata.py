@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from devices.metadata import extract_metadata
+from devices.models import Image
+
+
+class Command(BaseCommand):
+    help = 'Fill the geo location and capture time of images from their EXIF headers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Images read per batch')
+        parser.add_argument('--device', type=int, action='append', dest='devices', help='Only this device (repeatable)')
+
+    def handle(self, *args, **options):
+        images = Image.objects.filter(metadata_extracted=False).order_by('id')
+        if options['devices']:
+            images = images.filter(device_id__in=options['devices'])
+
+        last_id = 0
+        total = extracted = 0
+        while True:
+            batch = list(images.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            total += len(batch)
+            extracted += len(extract_metadata(batch))
+            self.stdout.write(f'{total} images read')
+        self.stdout.write(self.style.SUCCESS(f'Extracted metadata of {extracted} of {total} images'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from devices.models import Image
+from devices.renditions import generate_renditions
+
+
+class Command(BaseCommand):
+    help = 'Generate the renditions and dHash of images that have no dHash yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Images loaded per batch')
+        parser.add_argument('--device', type=int, action='append', dest='devices', help='Only this device (repeatable)')
+
+    def handle(self, *args, **options):
+        images = Image.objects.filter(dhash__isnull=True).order_by('id')
+        if options['devices']:
+            images = images.filter(device_id__in=options['devices'])
+
+        last_id = 0
+        processed = failed = 0
+        while True:
+            batch = list(images.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for image in batch:
+                try:
+                    generate_renditions(image)
+                    processed += 1
+                except OSError as e:
+                    failed += 1
+                    self.stderr.write(f'Image {image.id}: {e}')
+            self.stdout.write(f'{processed + failed} images processed')
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} images, {failed} failed'))
@@ -0,0 +1,78 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .imaging import read_exif
+from .models import Image
+from .storage import read_header
+
+logger = logging.getLogger(__name__)
+
+# JPEG keeps EXIF in one APP1 segment of at most 64 KiB near the start of the file
+HEADER_BYTES = 128 * 1024
+
+
+def _read_metadata(name):
+    try:
+        return read_exif(read_header(name, HEADER_BYTES))
+    except Exception:
+        logger.exception('Reading the EXIF header of %s failed', name)
+        return None
+
+
+def extract_metadata(images):
+    """
+    Fill the missing geo location and capture time of `images` from their
+    EXIF headers and mark them as extracted. Locations sent by the client
+    are kept. Headers are fetched with ranged reads, IMAGE_METADATA_WORKERS
+    at a time, and images sharing a file are read once. Images whose file
+    could not be read stay unmarked so a later run retries them.
+    """
+    names = list({image.image_file.name for image in images})
+    with ThreadPoolExecutor(max_workers=settings.IMAGE_METADATA_WORKERS) as executor:
+        metadata = dict(zip(names, executor.map(_read_metadata, names)))
+
+    updated = []
+    for image in images:
+        found = metadata[image.image_file.name]
+        if found is None:
+            continue
+        if image.geo_location_lat is None and image.geo_location_long is None:
+            image.geo_location_lat, image.geo_location_long = found['lat'], found['long']
+        if image.captured_at is None and found['captured_at'] is not None:
+            captured_at = found['captured_at']
+            if timezone.is_naive(captured_at):
+                captured_at = timezone.make_aware(captured_at)
+            image.captured_at = captured_at
+        image.metadata_extracted = True
+        updated.append(image)
+    Image.objects.bulk_update(updated, ['geo_location_lat', 'geo_location_long', 'captured_at', 'metadata_extracted'])
+    return updated
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _extract_in_background(image_ids):
+    try:
+        extract_metadata(list(Image.objects.filter(id__in=image_ids, metadata_extracted=False)))
+    except Exception:
+        logger.exception('Extracting metadata of images %s failed', image_ids)
+    finally:
+        close_old_connections()
+
+
+def schedule_metadata(image_ids):
+    """Extract the EXIF metadata of freshly uploaded images once their transaction has committed."""
+    global _executor
+    image_ids = list(image_ids)
+    if not image_ids:
+        return
+    with _executor_lock:
+        if _executor is None:
+            # One batch at a time; each batch fans its reads out itself
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-metadata')
+    transaction.on_commit(lambda: _executor.submit(_extract_in_background, image_ids))
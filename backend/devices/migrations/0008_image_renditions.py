@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_image_geo_location_lat_image_geo_location_long'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
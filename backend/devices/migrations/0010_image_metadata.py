@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0009_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='captured_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='metadata_extracted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0010_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='dhash',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0011_image_dhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='pyramid',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -22,11 +22,34 @@ class Device(models.Model):
     def __str__(self):
         return self.name
     
+class ImageBlob(models.Model):
+    # Stored image content, shared by every Image with the same bytes
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+
 class Image(models.Model):
     geo_location_lat = models.FloatField(null=True)
     geo_location_long = models.FloatField(null=True)
     device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='images')
     image_file = models.ImageField(upload_to='images/')
+    # Content of the upload; images created before deduplication have none
+    blob = models.ForeignKey(ImageBlob, on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='images')
+    # When the photo was taken, from its EXIF header
+    captured_at = models.DateTimeField(null=True, blank=True)
+    # Whether devices.metadata has read the EXIF header yet
+    metadata_extracted = models.BooleanField(default=False, editable=False)
+    # 64-bit difference hash for similarity search, see devices.similarity
+    dhash = models.BigIntegerField(null=True, blank=True, db_index=True, editable=False)
+    # Deep zoom tile pyramid of large images, when requested, see devices.pyramids
+    pyramid = models.JSONField(null=True, blank=True, editable=False)
+    # Storage names of the generated renditions by kind, see devices.renditions
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Image {self.id} for Device {self.device.id}"
\ No newline at end of file
@@ -0,0 +1,41 @@
+from rest_framework.permissions import BasePermission
+from .access import get_device_access, scope_to_user_devices, user_device_access
+from .models import Device
+
+
+def is_mapped(device_id, user):
+    """Whether `user` is mapped to the device, through the device access cache."""
+    access = user_device_access(user, device_id)
+    return access is not None and access.is_member
+
+
+class IsDeviceUser(BasePermission):
+    """
+    Object permission granted to the users mapped to a device, and to
+    superusers. Works on devices and on any object with a `device_id`;
+    the check is the single cached query of get_device_access, however
+    many users share the device.
+    """
+    message = "You do not have permission to access this resource."
+
+    def has_object_permission(self, request, view, obj):
+        device_id = obj.pk if isinstance(obj, Device) else getattr(obj, 'device_id', None)
+        access = get_device_access(request, device_id)
+        return access is not None and access.allows(request.user)
+
+
+class DeviceScopedQuerysetMixin:
+    """
+    Limits get_queryset() to the rows of devices mapped to the requesting
+    user, see scope_to_user_devices(); superusers see every row.
+    `device_lookup` is the path from the model to its device, empty for
+    Device itself.
+    """
+    device_lookup = 'device'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_superuser:
+            return queryset
+        return scope_to_user_devices(queryset, user, self.device_lookup)
@@ -0,0 +1,162 @@
+import logging
+import math
+import os
+import shutil
+import tempfile
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL.Image import DecompressionBombError
+from .imaging import cut_pyramid, image_size, level_size, pyramid_levels
+from .models import Image
+from .renditions import worker_pools
+from .storage import delete_files, read_header, save_files
+
+logger = logging.getLogger(__name__)
+
+# Deep Zoom defaults: 254 pixel tiles with a 1 pixel overlap make 256 pixel images
+TILE_SIZE = 254
+OVERLAP = 1
+QUALITY = 85
+# Tiles uploaded per save_files call, to bound the files open at once
+UPLOAD_BATCH = 256
+# Enough of a file for the dimensions of common formats, past any EXIF block
+SIZE_HEADER_BYTES = 256 * 1024
+
+
+def pyramid_root(original):
+    """Storage prefix of the tiles of an image, next to it: images/1/abc.tif -> images/1/abc_files"""
+    return f'{os.path.splitext(original)[0]}_files'
+
+
+def tile_name(pyramid, level, column, row):
+    return f"{pyramid['root']}/{level}/{column}_{row}.{pyramid['format']}"
+
+
+def tile_grid(pyramid, level):
+    """(columns, rows) of tiles at `level` of a ready pyramid."""
+    width, height = level_size(pyramid['width'], pyramid['height'], pyramid['levels'], level)
+    return math.ceil(width / pyramid['tile_size']), math.ceil(height / pyramid['tile_size'])
+
+
+def tile_names(pyramid):
+    """Storage names of every tile of a ready pyramid."""
+    if not pyramid or pyramid.get('status') != 'ready':
+        return []
+    names = []
+    for level in range(pyramid['levels']):
+        columns, rows = tile_grid(pyramid, level)
+        names.extend(tile_name(pyramid, level, column, row) for column in range(columns) for row in range(rows))
+    return names
+
+
+def exceeds_pixel_limit(image):
+    """
+    Whether the header of `image` shows more than IMAGE_PYRAMID_MAX_PIXELS
+    pixels. False when the header does not tell, the worker checks again.
+    """
+    try:
+        size = image_size(read_header(image.image_file.name, SIZE_HEADER_BYTES))
+    except OSError:
+        return False
+    return size is not None and size[0] * size[1] > settings.IMAGE_PYRAMID_MAX_PIXELS
+
+
+def _upload_tiles(tiles_dir, root):
+    written = []
+    try:
+        paths = [
+            os.path.relpath(os.path.join(directory, filename), tiles_dir)
+            for directory, _, filenames in os.walk(tiles_dir)
+            for filename in filenames
+        ]
+        for start in range(0, len(paths), UPLOAD_BATCH):
+            files = [open(os.path.join(tiles_dir, path), 'rb') for path in paths[start:start + UPLOAD_BATCH]]
+            try:
+                written += save_files([
+                    (f"{root}/{path.replace(os.sep, '/')}", File(file))
+                    for path, file in zip(paths[start:start + UPLOAD_BATCH], files)
+                ])
+            finally:
+                for file in files:
+                    file.close()
+    except Exception:
+        delete_files(written)
+        raise
+
+
+def generate_pyramid(image):
+    """
+    Cut `image` into a deep zoom tile pyramid stored next to the original
+    and record its descriptor on the row. Images sharing the same file
+    reuse a pyramid that is already there.
+    """
+    shared = (
+        Image.objects.filter(image_file=image.image_file.name, pyramid__status='ready')
+        .exclude(pk=image.pk)
+        .values_list('pyramid', flat=True)
+        .first()
+    )
+    if shared:
+        pyramid = shared
+    else:
+        root = pyramid_root(image.image_file.name)
+        with tempfile.TemporaryDirectory(prefix='pyramid-') as workdir:
+            source = os.path.join(workdir, 'source')
+            with default_storage.open(image.image_file.name, 'rb') as original, open(source, 'wb') as copy:
+                shutil.copyfileobj(original, copy, 1024 * 1024)
+            # Tiles go through the local disk so only paths cross the process boundary
+            tiles_dir = os.path.join(workdir, 'tiles')
+            processes, _ = worker_pools()
+            width, height = processes.submit(
+                cut_pyramid, source, tiles_dir, TILE_SIZE, OVERLAP, QUALITY, settings.IMAGE_PYRAMID_MAX_PIXELS,
+            ).result()
+            _upload_tiles(tiles_dir, root)
+        pyramid = {
+            'status': 'ready',
+            'width': width,
+            'height': height,
+            'levels': pyramid_levels(width, height),
+            'tile_size': TILE_SIZE,
+            'overlap': OVERLAP,
+            'format': 'jpg',
+            'root': root,
+        }
+    Image.objects.filter(pk=image.pk).update(pyramid=pyramid)
+    image.pyramid = pyramid
+    return pyramid
+
+
+def _generate_in_background(image_ids):
+    try:
+        for image in Image.objects.filter(id__in=image_ids):
+            try:
+                generate_pyramid(image)
+            except DecompressionBombError:
+                Image.objects.filter(pk=image.pk).update(pyramid={
+                    'status': 'failed',
+                    'detail': f'Images over {settings.IMAGE_PYRAMID_MAX_PIXELS} pixels cannot be cut into a tile pyramid.',
+                })
+            except Exception:
+                logger.exception('Generating the tile pyramid of image %s failed', image.pk)
+                Image.objects.filter(pk=image.pk).update(pyramid={'status': 'failed'})
+    finally:
+        close_old_connections()
+
+
+def schedule_pyramids(image_ids):
+    """Mark images as pending and cut their tile pyramids once the transaction has committed."""
+    image_ids = list(
+        Image.objects.filter(id__in=image_ids).exclude(pyramid__status__in=['pending', 'ready']).values_list('id', flat=True)
+    )
+    if not image_ids:
+        return []
+    Image.objects.filter(id__in=image_ids).update(pyramid={'status': 'pending'})
+
+    def submit():
+        _, threads = worker_pools()
+        threads.submit(_generate_in_background, image_ids)
+
+    transaction.on_commit(submit)
+    return image_ids
@@ -0,0 +1,106 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from .imaging import RENDITIONS, render
+from .models import Image
+from .similarity import image_hash_index, to_signed
+
+logger = logging.getLogger(__name__)
+
+
+def rendition_name(original, rendition):
+    """Storage name of a rendition, next to the original: images/1/abc.jpg -> images/1/abc.thumbnail.jpg"""
+    _, _, extension = RENDITIONS[rendition]
+    root, _ = os.path.splitext(original)
+    return f'{root}.{rendition}.{extension}'
+
+
+_processes = None
+_threads = None
+_pools_lock = threading.Lock()
+
+
+def worker_pools():
+    """Process pool for CPU bound Pillow work and thread pool for the background jobs driving it."""
+    global _processes, _threads
+    with _pools_lock:
+        if _processes is None:
+            # Spawned rather than forked from a multi-threaded server process
+            _processes = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_RENDITION_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            # Threads only move bytes to and from storage around the CPU bound work
+            _threads = ThreadPoolExecutor(max_workers=settings.IMAGE_RENDITION_PROCESSES * 2, thread_name_prefix='renditions')
+        return _processes, _threads
+
+
+def generate_renditions(image, renditions=None):
+    """
+    Create the missing renditions of `image`, store them and record their
+    names, along with the dHash, on every image sharing its file. Renditions
+    a duplicate of the image already has are reused rather than rendered.
+    """
+    missing = [rendition for rendition in (renditions or RENDITIONS) if rendition not in image.renditions]
+    if not missing and image.dhash is not None:
+        return image.renditions
+
+    name = image.image_file.name
+    stored, dhash = {}, image.dhash
+    for shared, shared_hash in Image.objects.filter(image_file=name).exclude(pk=image.pk).values_list('renditions', 'dhash'):
+        stored.update(shared)
+        dhash = shared_hash if dhash is None else dhash
+    stored.update(image.renditions)
+    missing = [rendition for rendition in missing if rendition not in stored]
+
+    if missing or dhash is None:
+        with default_storage.open(name, 'rb') as original:
+            data = original.read()
+        processes, _ = worker_pools()
+        outputs, dhash = processes.submit(render, data, missing).result()
+        dhash = to_signed(dhash)
+        for rendition, content in outputs.items():
+            stored[rendition] = default_storage.save(rendition_name(name, rendition), ContentFile(content))
+
+    with transaction.atomic():
+        # Merge with renditions another worker may have stored meanwhile
+        current = list(Image.objects.select_for_update().filter(image_file=name).values_list('renditions', flat=True))
+        if not current:
+            return stored
+        for renditions in current:
+            stored = {**renditions, **stored}
+        Image.objects.filter(image_file=name).update(renditions=stored, dhash=dhash)
+    image.renditions = stored
+    image.dhash = dhash
+    image_hash_index.observe(Image.objects.filter(image_file=name).only('pk', 'device_id', 'dhash'))
+    return stored
+
+
+def _generate_in_background(image_ids):
+    try:
+        for image in Image.objects.filter(id__in=image_ids):
+            try:
+                generate_renditions(image)
+            except Exception:
+                logger.exception('Generating renditions of image %s failed', image.pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(image_ids):
+    """Generate renditions of freshly uploaded images once their transaction has committed."""
+    image_ids = list(image_ids)
+    if not image_ids or not settings.IMAGE_RENDITIONS_ON_UPLOAD:
+        return
+
+    def submit():
+        _, threads = worker_pools()
+        threads.submit(_generate_in_background, image_ids)
+
+    transaction.on_commit(submit)
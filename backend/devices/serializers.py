@@ -1,5 +1,7 @@
+from django.urls import reverse
 from rest_framework import serializers
 from .models import Device, Image, DeviceType
+from .storage import signed_download_url
 
 class DeviceSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,6 +14,29 @@ class DeviceTypeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name')
 
 class ImageSerializer(serializers.ModelSerializer):
+    thumbnail_url = serializers.SerializerMethodField()
+    medium_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+
     class Meta:
         model = Image
-        fields = ['id', 'device', 'geo_location_lat', 'geo_location_long','image_file']
\ No newline at end of file
+        fields = ['id', 'device', 'geo_location_lat', 'geo_location_long','image_file', 'captured_at', 'pyramid', 'thumbnail_url', 'medium_url', 'preview_url']
+
+    def _rendition_url(self, image, rendition):
+        # Stored renditions are served straight from storage; missing ones
+        # point at the endpoint that generates them on first request
+        name = (image.renditions or {}).get(rendition)
+        if name:
+            return signed_download_url(name)
+        url = f"{reverse('image-rendition')}?image_id={image.pk}&name={rendition}"
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_thumbnail_url(self, image):
+        return self._rendition_url(image, 'thumbnail')
+
+    def get_medium_url(self, image):
+        return self._rendition_url(image, 'medium')
+
+    def get_preview_url(self, image):
+        return self._rendition_url(image, 'preview')
@@ -0,0 +1,34 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .access import device_access_cache
+from .blobs import release_blob
+from .models import Device, Image
+from .similarity import image_hash_index
+
+
+@receiver(m2m_changed, sender=Device.users.through)
+def invalidate_device_users(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # user.devices.add(...) / remove(...)
+        if pk_set is None:
+            device_access_cache.discard_where(lambda key, access: key[0] == instance.pk)
+        else:
+            device_access_cache.discard_where(lambda key, access: key[0] == instance.pk and key[1] in pk_set)
+    else:
+        # device.users.add(...) / remove(...), as done by map_user and unmap_user
+        device_access_cache.discard_where(lambda key, access: key[1] == instance.pk)
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def invalidate_device(sender, instance, **kwargs):
+    # Also drops the (None, device id) entries of claim based access
+    device_access_cache.discard_where(lambda key, access: key[1] == instance.pk)
+
+
+@receiver(post_delete, sender=Image)
+def release_image_blob(sender, instance, **kwargs):
+    image_hash_index.discard([instance.pk])
+    release_blob(instance)
@@ -0,0 +1,199 @@
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from .models import Image
+
+MASK = (1 << 64) - 1
+
+# Multi-index hashing splits the 64-bit hashes into CHUNKS chunks of
+# CHUNK_BITS bits; two hashes within r bits of each other agree to within
+# r // CHUNKS bits on at least one chunk
+CHUNKS = 4
+CHUNK_BITS = 16
+
+# Bits set in every 16-bit value, to count differing bits in bulk
+POPCOUNT_16 = np.array([bin(value).count('1') for value in range(1 << CHUNK_BITS)], dtype=np.uint8)
+
+# Images observed since the last merge are scanned linearly; past this many
+# they are merged into the sorted arrays
+MERGE_THRESHOLD = 5000
+
+
+def to_signed(value):
+    """A 64-bit hash as stored in the signed BIGINT dhash column."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value & MASK
+
+
+def hamming(a, b):
+    return ((a ^ b) & MASK).bit_count()
+
+
+def _distances(values, value):
+    differences = (values ^ np.uint64(value)).view(np.uint16)
+    return POPCOUNT_16[differences].reshape(-1, CHUNKS).sum(axis=1, dtype=np.int64)
+
+
+class HashSegment:
+    """
+    Immutable multi-index over arrays of hashes, image ids and device ids.
+
+    For each chunk the chunk values are kept sorted, so a query probes
+    every chunk value within r // CHUNKS bits of its own with a binary
+    search and only checks the full distance of the images found there.
+    """
+
+    def __init__(self, values, image_ids, device_ids):
+        self.values = values
+        self.image_ids = image_ids
+        self.device_ids = device_ids
+        self._chunks = []
+        for chunk in range(CHUNKS):
+            keys = ((values >> np.uint64(chunk * CHUNK_BITS)) & np.uint64((1 << CHUNK_BITS) - 1)).astype(np.uint16)
+            order = np.argsort(keys, kind='stable').astype(np.int32)
+            self._chunks.append((keys[order], order))
+
+    def __len__(self):
+        return len(self.values)
+
+    def search(self, value, radius):
+        """Positions and distances of the hashes within `radius` of `value`."""
+        if not len(self.values):
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        probes = np.flatnonzero(POPCOUNT_16 <= radius // CHUNKS)
+        found = []
+        for chunk, (keys, order) in enumerate(self._chunks):
+            key = (value >> (chunk * CHUNK_BITS)) & ((1 << CHUNK_BITS) - 1)
+            targets = probes ^ key
+            starts = np.searchsorted(keys, targets, side='left')
+            lengths = np.searchsorted(keys, targets, side='right') - starts
+            hit = lengths > 0
+            starts, lengths = starts[hit], lengths[hit]
+            if not len(starts):
+                continue
+            # Expand the [start, start + length) runs into one index array
+            offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            found.append(order[np.arange(lengths.sum()) + offsets])
+        if not found:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        positions = np.unique(np.concatenate(found))
+        distances = _distances(self.values[positions], value)
+        close = distances <= radius
+        return positions[close], distances[close]
+
+
+class ImageHashIndex:
+    """
+    dHash of every image with the device it belongs to, for Hamming
+    distance queries.
+
+    The bulk of the hashes sits in a HashSegment built from the database on
+    first use. Hashes computed by this process since are added through
+    `observe()` to a small overlay that is scanned linearly and merged into
+    a new segment once it grows past MERGE_THRESHOLD; deleted images are
+    dropped through `discard()`. After `SIMILAR_INDEX_TTL` seconds the index
+    is rebuilt from the database in the background, to pick up other
+    workers' images, while the current one keeps serving.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._segment = HashSegment(np.empty(0, np.uint64), np.empty(0, np.int64), np.empty(0, np.int64))
+        self._recent = {}
+        self._removed = set()
+        self._built_at = None
+        self._rebuilding = False
+
+    def rebuild(self):
+        rows = Image.objects.filter(dhash__isnull=False).values_list('dhash', 'id', 'device_id')
+        dhashes, image_ids, device_ids = [], [], []
+        for dhash, image_id, device_id in rows.iterator(chunk_size=10000):
+            dhashes.append(dhash)
+            image_ids.append(image_id)
+            device_ids.append(device_id)
+        segment = HashSegment(
+            np.array(dhashes, dtype=np.int64).view(np.uint64),
+            np.array(image_ids, dtype=np.int64),
+            np.array(device_ids, dtype=np.int64),
+        )
+        with self._lock:
+            self._segment, self._recent, self._removed = segment, {}, set()
+            self._built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        finally:
+            self._rebuilding = False
+
+    def _ensure_fresh(self):
+        built_at = self._built_at
+        if built_at is None:
+            self.rebuild()
+        elif time.monotonic() - built_at >= settings.SIMILAR_INDEX_TTL and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, name='similar-index', daemon=True).start()
+
+    def _merge(self):
+        segment = self._segment
+        keep = ~np.isin(segment.image_ids, list(self._removed | self._recent.keys()))
+        recent = list(self._recent.items())
+        self._segment = HashSegment(
+            np.concatenate([segment.values[keep], np.array([value for _, (value, _) in recent], dtype=np.uint64)]),
+            np.concatenate([segment.image_ids[keep], np.array([image_id for image_id, _ in recent], dtype=np.int64)]),
+            np.concatenate([segment.device_ids[keep], np.array([device_id for _, (_, device_id) in recent], dtype=np.int64)]),
+        )
+        self._recent, self._removed = {}, set()
+
+    def observe(self, images):
+        """Add newly hashed images."""
+        if self._built_at is None:
+            return
+        with self._lock:
+            for image in images:
+                if image.dhash is not None:
+                    # Shadows the image's entry in the segment, if any
+                    self._recent[image.pk] = (to_unsigned(image.dhash), image.device_id)
+                    self._removed.add(image.pk)
+            if len(self._recent) > MERGE_THRESHOLD:
+                self._merge()
+
+    def discard(self, image_ids):
+        """Remove deleted images."""
+        if self._built_at is None:
+            return
+        with self._lock:
+            for image_id in image_ids:
+                self._recent.pop(image_id, None)
+                self._removed.add(image_id)
+
+    def similar(self, dhash, max_distance, limit, device_ids=None, exclude=None):
+        """
+        Up to `limit` (distance, image id) pairs within `max_distance` bits
+        of `dhash`, closest first, optionally restricted to `device_ids`.
+        """
+        self._ensure_fresh()
+        value = to_unsigned(dhash)
+        with self._lock:
+            segment, recent, removed = self._segment, list(self._recent.items()), set(self._removed)
+
+        positions, distances = segment.search(value, max_distance)
+        matches = [
+            (int(distance), int(image_id))
+            for distance, image_id, device_id in zip(distances, segment.image_ids[positions], segment.device_ids[positions])
+            if image_id not in removed and (device_ids is None or device_id in device_ids)
+        ]
+        for image_id, (other, device_id) in recent:
+            distance = hamming(value, other)
+            if distance <= max_distance and (device_ids is None or device_id in device_ids):
+                matches.append((distance, image_id))
+        matches = [match for match in matches if match[1] != exclude]
+        matches.sort()
+        return matches[:limit]
+
+
+image_hash_index = ImageHashIndex()
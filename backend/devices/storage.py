@@ -0,0 +1,189 @@
+import logging
+import mimetypes
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+
+UPLOAD_SLOT_SALT = 'devices.image-upload-slot'
+
+logger = logging.getLogger(__name__)
+
+
+class DirectUploadUnavailable(Exception):
+    """The configured storage is not S3 compatible, so files cannot be accessed directly."""
+
+
+def _s3():
+    # S3Boto3Storage exposes the bucket; local storages do not
+    bucket = getattr(default_storage, 'bucket', None)
+    if bucket is None:
+        raise DirectUploadUnavailable('Direct storage access requires S3 compatible storage')
+    return bucket.meta.client, bucket.name
+
+
+def object_key(name):
+    """S3 key of a stored file name, including the storage location prefix."""
+    return default_storage._normalize_name(name)
+
+
+def _extension(filename, content_type):
+    extension = os.path.splitext(filename or '')[1].lower()
+    if not extension or len(extension) > 10:
+        extension = mimetypes.guess_extension(content_type or '') or ''
+    return extension
+
+
+def new_image_name(device_id, filename, content_type):
+    """A fresh, unguessable storage name for an image of `device_id`."""
+    return f'images/{device_id}/{uuid.uuid4().hex}{_extension(filename, content_type)}'
+
+
+def blob_name(sha256, filename, content_type):
+    """Storage name of image content, keyed by its hash."""
+    return f'images/blobs/{sha256}{_extension(filename, content_type)}'
+
+
+def presigned_put_url(name, content_type):
+    """URL the client PUTs the file to, valid for IMAGE_UPLOAD_URL_EXPIRY seconds."""
+    client, bucket = _s3()
+    return client.generate_presigned_url(
+        'put_object',
+        Params={'Bucket': bucket, 'Key': object_key(name), 'ContentType': content_type},
+        ExpiresIn=settings.IMAGE_UPLOAD_URL_EXPIRY,
+    )
+
+
+def delete_object(name):
+    client, bucket = _s3()
+    client.delete_object(Bucket=bucket, Key=object_key(name))
+
+
+def save_files(files):
+    """
+    Write (name, file) pairs to storage in parallel, IMAGE_UPLOAD_WORKERS at
+    a time, and return the stored names. All or nothing: when any write
+    fails the files already written are deleted again and the error raised.
+    """
+    with ThreadPoolExecutor(max_workers=settings.IMAGE_UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(default_storage.save, name, file) for name, file in files]
+    stored, error = [], None
+    for future in futures:
+        try:
+            stored.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        delete_files(stored)
+        raise error
+    return stored
+
+
+def delete_files(names):
+    """Delete stored files in parallel; failures are logged, not raised, as this runs during cleanup."""
+    def delete(name):
+        try:
+            default_storage.delete(name)
+        except Exception:
+            logger.exception('Deleting %s from storage failed', name)
+
+    with ThreadPoolExecutor(max_workers=settings.IMAGE_UPLOAD_WORKERS) as executor:
+        list(executor.map(delete, names))
+
+
+def list_files(directory):
+    """Names of every stored file under `directory`, at any depth."""
+    try:
+        directories, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return []
+    names = [f'{directory}/{name}' for name in files]
+    for child in directories:
+        names += list_files(f'{directory}/{child}')
+    return names
+
+
+def signed_download_url(name):
+    """Short-lived URL serving the file straight from storage."""
+    try:
+        return default_storage.url(name, expire=settings.IMAGE_DOWNLOAD_URL_EXPIRY)
+    except TypeError:
+        # Storages without signed URLs, e.g. the local file system
+        return default_storage.url(name)
+
+
+def object_metadata(name):
+    """Size, ETag, content type and modification time of a stored object, or None when it is missing."""
+    client, bucket = _s3()
+    try:
+        head = client.head_object(Bucket=bucket, Key=object_key(name))
+    except client.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return {
+        'size': head['ContentLength'],
+        'etag': head['ETag'],
+        'content_type': head.get('ContentType') or 'application/octet-stream',
+        'last_modified': head.get('LastModified'),
+    }
+
+
+def read_object(name, start=None, end=None, chunk_size=64 * 1024):
+    """Iterate over the bytes of a stored object, or of its inclusive `start`-`end` range."""
+    client, bucket = _s3()
+    params = {'Bucket': bucket, 'Key': object_key(name)}
+    if start is not None:
+        params['Range'] = f'bytes={start}-{end}'
+    body = client.get_object(**params)['Body']
+    return _iter_body(body, chunk_size)
+
+
+def read_header(name, length):
+    """The first `length` bytes of a stored file, fetched with a ranged read where the storage allows it."""
+    try:
+        client, bucket = _s3()
+    except DirectUploadUnavailable:
+        with default_storage.open(name, 'rb') as file:
+            return file.read(length)
+    try:
+        body = client.get_object(Bucket=bucket, Key=object_key(name), Range=f'bytes=0-{length - 1}')['Body']
+    except client.exceptions.ClientError as e:
+        # An empty object has no satisfiable range
+        if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+            return b''
+        raise
+    try:
+        return body.read()
+    finally:
+        body.close()
+
+
+def _iter_body(body, chunk_size):
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+
+def sign_upload_slot(name, device_id, user_id, content_type):
+    return signing.dumps(
+        {'name': name, 'device': device_id, 'user': user_id, 'content_type': content_type},
+        salt=UPLOAD_SLOT_SALT,
+        compress=True,
+    )
+
+
+def read_upload_slot(token):
+    """
+    Contents of a slot token, or None when it was tampered with or has expired.
+
+    Slots stay confirmable a little longer than their upload URL so a
+    transfer that started just before expiry can still be confirmed.
+    """
+    try:
+        return signing.loads(token, salt=UPLOAD_SLOT_SALT, max_age=settings.IMAGE_UPLOAD_URL_EXPIRY * 2)
+    except signing.BadSignature:
+        return None
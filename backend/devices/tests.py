@@ -1,3 +1,387 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.test import TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image as PILImage
+from PIL.Image import DecompressionBombError
+from rest_framework.test import APIClient
+from storages.backends.s3boto3 import S3Boto3Storage
+from users.models import CustomUser
+from utils.utils import DeviceType
+from .access import device_access_cache, get_device_access, scope_to_user_devices
+from .imaging import image_size
+from .metadata import extract_metadata
+from .models import Device, Image, ImageBlob
+from .permissions import is_mapped
+from .pyramids import generate_pyramid, pyramid_root
+from .similarity import image_hash_index
+from .storage import read_upload_slot, sign_upload_slot
 
-# Create your tests here.
+
+class DeviceAccessTests(TestCase):
+    def setUp(self):
+        device_access_cache.clear()
+        self.user = CustomUser.objects.create_user(username='farmer', email='farmer@example.org', password='password')
+        self.own = Device.objects.create(name='own', location='field', address='own', type_id=DeviceType.MOBILE.value)
+        self.own.users.add(self.user)
+        self.foreign = Device.objects.create(name='foreign', location='field', address='foreign', type_id=DeviceType.QGIS.value)
+
+    def test_access_resolves_type_and_membership(self):
+        request = SimpleNamespace(user=self.user)
+
+        self.assertEqual(get_device_access(request, self.own.id), (self.own.id, DeviceType.MOBILE.value, True))
+        self.assertEqual(get_device_access(request, self.foreign.id), (self.foreign.id, DeviceType.QGIS.value, False))
+        self.assertIsNone(get_device_access(request, 999999))
+        self.assertIsNone(get_device_access(request, 'abc'))
+
+    def test_access_is_memoized_per_request(self):
+        request = SimpleNamespace(user=self.user)
+        get_device_access(request, self.own.id)
+
+        with self.assertNumQueries(0):
+            get_device_access(request, self.own.id)
+
+    def test_retrieve_foreign_device_is_forbidden(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        self.assertEqual(client.get(f'/devices/{self.own.id}/').status_code, 200)
+        self.assertEqual(client.get(f'/devices/{self.foreign.id}/').status_code, 403)
+
+    def test_mapping_checks_share_the_access_cache(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post(f'/devices/{self.foreign.id}/map_user/')
+
+        self.assertEqual(response.json()['data'], {'status': 'user added to device'})
+        self.assertTrue(is_mapped(self.foreign.id, self.user))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_mapped(self.foreign.id, self.user))
+        self.assertEqual(client.post(f'/devices/{self.foreign.id}/map_user/').json()['data'], {'status': 'user already mapped to device'})
+
+    def test_unmapping_revokes_cached_access(self):
+        request = SimpleNamespace(user=self.user)
+        self.assertTrue(get_device_access(request, self.own.id).is_member)
+
+        self.own.users.remove(self.user)
+
+        self.assertFalse(get_device_access(SimpleNamespace(user=self.user), self.own.id).is_member)
+
+    def test_claimed_devices_replace_the_mapping(self):
+        # As set by users.authentication.DeviceClaimsJWTAuthentication
+        self.user.claimed_device_ids = frozenset([self.foreign.id])
+        request = SimpleNamespace(user=self.user)
+
+        self.assertTrue(get_device_access(request, self.foreign.id).is_member)
+        self.assertFalse(get_device_access(request, self.own.id).is_member)
+        self.assertEqual(get_device_access(request, self.foreign.id).type_id, DeviceType.QGIS.value)
+        self.assertEqual(list(scope_to_user_devices(Device.objects.all(), self.user, device_lookup='')), [self.foreign])
+
+
+class ImageTestCase(TestCase):
+    def setUp(self):
+        device_access_cache.clear()
+        self.user = CustomUser.objects.create_user(username='farmer', email='farmer@example.org', password='password')
+        self.device = Device.objects.create(name='drone', location='field', address='drone', type_id=DeviceType.MOBILE.value)
+        self.device.users.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.use_storage(self.local_storage())
+
+    def local_storage(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        return FileSystemStorage(location=location, base_url='/media/')
+
+    def use_storage(self, storage):
+        previous = default_storage._wrapped
+        default_storage._wrapped = storage
+        self.addCleanup(setattr, default_storage, '_wrapped', previous)
+
+    def jpeg(self, size=(800, 600), color=(40, 120, 60)):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', size, color).save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def geotagged_jpeg(self):
+        exif = PILImage.Exif()
+        exif[0x8825] = {1: 'N', 2: (40.0, 30.0, 0.0), 3: 'W', 4: (22.0, 15.0, 0.0)}
+        exif[0x8769] = {0x9003: '2024:05:01 10:30:00', 0x9011: '+03:00'}
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (64, 48)).save(buffer, 'JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def stored_image(self, content=b'image', device=None, **fields):
+        name = default_storage.save('images/photo.jpg', ContentFile(content))
+        return Image.objects.create(device=device or self.device, image_file=name, **fields)
+
+    def upload(self, files, **data):
+        images = [SimpleUploadedFile(f'photo{index}.jpg', content, 'image/jpeg') for index, content in enumerate(files)]
+        data = {'device': self.device.id, 'images': images, **data}
+        return self.client.post('/images/upload_multiple/', encode_multipart(BOUNDARY, data), content_type=MULTIPART_CONTENT)
+
+    def post_json(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+
+class DirectUploadTests(ImageTestCase):
+    def s3_storage(self):
+        # Presigning is local, no request reaches the bucket
+        return S3Boto3Storage(bucket_name='uploads', access_key='key', secret_key='secret', region_name='eu-west-1')
+
+    def test_slots_need_s3_storage(self):
+        response = self.post_json('/images/upload-slots/', {'device': self.device.id, 'files': [{'name': 'a.jpg', 'content_type': 'image/jpeg'}]})
+
+        self.assertEqual(response.status_code, 501)
+
+    def test_slots_are_presigned_for_the_device(self):
+        self.use_storage(self.s3_storage())
+
+        response = self.post_json('/images/upload-slots/', {'device': self.device.id, 'files': [{'name': 'a.jpg', 'content_type': 'image/jpeg'}]})
+
+        self.assertEqual(response.status_code, 201)
+        [slot] = response.json()['data']['slots']
+        self.assertIn('uploads.s3', slot['url'])
+        self.assertIn('Signature=', slot['url'])
+        token = read_upload_slot(slot['token'])
+        self.assertEqual((token['device'], token['user']), (self.device.id, self.user.id))
+        self.assertTrue(token['name'].startswith(f'images/{self.device.id}/') and token['name'].endswith('.jpg'))
+
+    def test_confirm_creates_images_of_uploaded_objects(self):
+        self.use_storage(self.s3_storage())
+        tokens = [sign_upload_slot(f'images/{self.device.id}/{name}.jpg', self.device.id, self.user.id, 'image/jpeg') for name in ('a', 'b')]
+        sizes = {f'images/{self.device.id}/a.jpg': {'size': 10}}
+
+        with mock.patch('devices.views.object_metadata', side_effect=sizes.get):
+            response = self.post_json('/images/confirm-uploads/', {'uploads': [
+                {'token': tokens[0], 'geo_location_lat': 40.5, 'geo_location_long': 22.5},
+                {'token': tokens[1]},
+                {'token': 'forged'},
+            ]})
+
+        self.assertEqual(response.status_code, 201)
+        result = response.json()['data']
+        self.assertEqual([image['image_file'].split('?')[0].rsplit('/', 1)[-1] for image in result['images']], ['a.jpg'])
+        self.assertEqual([item['index'] for item in result['rejected']], [1, 2])
+        self.assertEqual(list(Image.objects.values_list('device_id', 'geo_location_lat')), [(self.device.id, 40.5)])
+
+
+class DownloadTests(ImageTestCase):
+    def test_download_redirects_to_storage(self):
+        image = self.stored_image()
+
+        response = self.client.get(f'/images/download/?image_id={image.id}')
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], f'/media/{image.image_file.name}')
+        self.assertEqual(response['Cache-Control'], 'private, no-store')
+
+    def test_proxy_streams_the_file(self):
+        image = self.stored_image(b'jpeg bytes')
+
+        response = self.client.get(f'/images/download/?image_id={image.id}&proxy=true')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'jpeg bytes')
+
+    def test_foreign_image_is_forbidden(self):
+        foreign = Device.objects.create(name='foreign', location='field', address='foreign', type_id=DeviceType.MOBILE.value)
+        image = self.stored_image(device=foreign)
+
+        self.assertEqual(self.client.get(f'/images/download/?image_id={image.id}').status_code, 403)
+
+
+class RenditionTests(ImageTestCase):
+    def test_missing_rendition_is_generated_on_request(self):
+        image = self.stored_image(self.jpeg())
+
+        response = self.client.get(f'/images/rendition/?image_id={image.id}&name=thumbnail')
+
+        self.assertEqual(response.status_code, 302)
+        image.refresh_from_db()
+        self.assertEqual(set(image.renditions), {'thumbnail', 'medium', 'preview'})
+        self.assertEqual(response['Location'], f"/media/{image.renditions['thumbnail']}")
+        self.assertIsNotNone(image.dhash)
+        with default_storage.open(image.renditions['thumbnail'], 'rb') as file, PILImage.open(file) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 240))
+
+    def test_unknown_rendition_and_undecodable_image(self):
+        image = self.stored_image(b'not an image')
+
+        self.assertEqual(self.client.get(f'/images/rendition/?image_id={image.id}&name=huge').status_code, 400)
+        self.assertEqual(self.client.get(f'/images/rendition/?image_id={image.id}&name=thumbnail').status_code, 422)
+
+
+class UploadMultipleTests(ImageTestCase):
+    def test_images_are_stored_with_their_locations(self):
+        response = self.upload(
+            [self.jpeg(color=(200, 0, 0)), self.jpeg(color=(0, 0, 200))],
+            geo_locations=json.dumps([[40.5, 22.5], None]),
+        )
+
+        self.assertEqual(response.status_code, 201)
+        images = Image.objects.order_by('id')
+        self.assertEqual([image['id'] for image in response.json()['data']], [str(image.id) for image in images])
+        self.assertEqual([(image.geo_location_lat, image.geo_location_long) for image in images], [(40.5, 22.5), (None, None)])
+        for image in images:
+            self.assertTrue(default_storage.exists(image.image_file.name))
+
+    def test_invalid_requests_store_nothing(self):
+        self.assertEqual(self.upload([self.jpeg()], geo_locations=json.dumps([[1, 2], [3, 4]])).status_code, 400)
+        self.assertEqual(self.upload([self.jpeg()], geo_locations=json.dumps([[91, 0]])).status_code, 400)
+        self.assertEqual(self.upload([]).status_code, 400)
+        self.assertFalse(Image.objects.exists())
+
+
+class DeduplicationTests(ImageTestCase):
+    def test_duplicates_share_one_blob_and_its_renditions(self):
+        content = self.jpeg()
+
+        self.assertEqual(self.upload([content, content]).status_code, 201)
+
+        first, second = Image.objects.order_by('id')
+        blob = ImageBlob.objects.get()
+        self.assertEqual((first.blob_id, second.blob_id), (blob.id, blob.id))
+        self.assertEqual(first.image_file.name, blob.file.name)
+        self.assertEqual(self.client.get(f'/images/rendition/?image_id={first.id}&name=thumbnail').status_code, 302)
+        second.refresh_from_db()
+        self.assertEqual(second.renditions, Image.objects.get(pk=first.pk).renditions)
+        self.assertIsNotNone(second.dhash)
+
+        # A later duplicate starts out with them
+        self.upload([content])
+        self.assertEqual(Image.objects.latest('id').renditions, second.renditions)
+
+    def test_last_image_releases_every_derived_file(self):
+        self.upload([self.jpeg()])
+        first = Image.objects.get()
+        self.client.get(f'/images/rendition/?image_id={first.id}&name=thumbnail')
+        self.upload([self.jpeg()])
+        second = Image.objects.latest('id')
+        name = first.image_file.name
+        tile = default_storage.save(f'{pyramid_root(name)}/0/0_0.jpg', ContentFile(b'tile'))
+        stored = [name, tile, *Image.objects.get(pk=first.pk).renditions.values()]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(all(default_storage.exists(path) for path in stored))
+
+        # The survivor never had renditions or a pyramid recorded of its own
+        Image.objects.filter(pk=second.pk).update(renditions={}, pyramid=None)
+        with self.captureOnCommitCallbacks(execute=True):
+            Image.objects.get(pk=second.pk).delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(any(default_storage.exists(path) for path in stored))
+
+    def test_failed_insert_deletes_the_new_files(self):
+        with mock.patch('devices.blobs._insert_images', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.upload([self.jpeg()])
+
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertEqual(default_storage.listdir('images/blobs'), ([], []))
+
+
+class MetadataTests(ImageTestCase):
+    def test_geotag_and_capture_time_fill_missing_fields(self):
+        tagged = self.stored_image(self.geotagged_jpeg())
+        located = Image.objects.create(device=self.device, image_file=tagged.image_file.name, geo_location_lat=1.0, geo_location_long=2.0)
+        untagged = self.stored_image(self.jpeg())
+
+        with self.assertNumQueries(1):
+            extract_metadata([tagged, located, untagged])
+
+        tagged.refresh_from_db()
+        self.assertEqual((tagged.geo_location_lat, tagged.geo_location_long), (40.5, -22.25))
+        self.assertEqual(tagged.captured_at, datetime(2024, 5, 1, 10, 30, tzinfo=dt_timezone(timedelta(hours=3))))
+        located.refresh_from_db()
+        self.assertEqual((located.geo_location_lat, located.geo_location_long), (1.0, 2.0))
+        untagged.refresh_from_db()
+        self.assertTrue(untagged.metadata_extracted)
+        self.assertIsNone(untagged.geo_location_lat)
+
+    def test_unreadable_files_are_retried_later(self):
+        image = Image.objects.create(device=self.device, image_file='images/missing.jpg')
+
+        with self.assertLogs('devices.metadata', 'ERROR'):
+            self.assertEqual(extract_metadata([image]), [])
+        self.assertFalse(Image.objects.get(pk=image.pk).metadata_extracted)
+
+
+class SimilarityTests(ImageTestCase):
+    def test_nearby_hashes_of_own_devices_closest_first(self):
+        foreign = Device.objects.create(name='foreign', location='field', address='foreign', type_id=DeviceType.MOBILE.value)
+        image = self.stored_image(dhash=0)
+        near = self.stored_image(dhash=0b111)
+        nearest = self.stored_image(dhash=0b1)
+        self.stored_image(dhash=-1)
+        self.stored_image(device=foreign, dhash=0)
+        image_hash_index.rebuild()
+
+        response = self.client.get(f'/images/similar/?image_id={image.id}&max_distance=4')
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()['data']
+        self.assertEqual(result['dhash'], '0' * 16)
+        self.assertEqual([(match['distance'], match['image']['id']) for match in result['results']], [(1, nearest.id), (3, near.id)])
+
+    def test_recently_hashed_images_are_found(self):
+        image = self.stored_image(dhash=0)
+        image_hash_index.rebuild()
+        later = self.stored_image(dhash=0b11)
+        image_hash_index.observe([later])
+
+        result = self.client.get(f'/images/similar/?image_id={image.id}&max_distance=2').json()['data']
+
+        self.assertEqual([match['image']['id'] for match in result['results']], [later.id])
+
+    def test_distance_is_capped(self):
+        image = self.stored_image(dhash=0)
+
+        self.assertEqual(self.client.get(f'/images/similar/?image_id={image.id}&max_distance=64').status_code, 400)
+
+
+class PyramidTests(ImageTestCase):
+    def test_pyramid_is_cut_and_served_by_tile(self):
+        image = self.stored_image(self.jpeg(size=(600, 400)))
+
+        self.assertEqual(self.post_json('/images/pyramid/', {'image_id': image.id}).status_code, 202)
+        generate_pyramid(image)
+
+        response = self.client.get(f'/images/pyramid/?image_id={image.id}')
+        self.assertEqual(response.status_code, 200)
+        pyramid = response.json()['data']
+        self.assertEqual((pyramid['status'], pyramid['width'], pyramid['height'], pyramid['levels']), ('ready', 600, 400, 11))
+        response = self.client.get(f'/images/tile/?image_id={image.id}&level=10&column=2&row=1')
+        self.assertEqual(response.status_code, 302)
+        with default_storage.open(response['Location'].removeprefix('/media/'), 'rb') as file, PILImage.open(file) as tile:
+            self.assertEqual(tile.size, (600 - 2 * 254 + 1, 400 - 254 + 1))
+
+    @override_settings(IMAGE_PYRAMID_MAX_PIXELS=100_000)
+    def test_images_over_the_pixel_limit_are_rejected(self):
+        image = self.stored_image(self.jpeg(size=(600, 400)))
+
+        response = self.post_json('/images/pyramid/', {'image_id': image.id})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(Image.objects.get(pk=image.pk).pyramid)
+        # Workers check again, for uploads and headers that did not tell the size
+        with self.assertRaises(DecompressionBombError):
+            generate_pyramid(image)
+
+    def test_size_is_read_past_pillows_limit(self):
+        header = bytearray(self.jpeg(size=(16, 16)))
+        # Height and width of the baseline start of frame segment
+        frame = header.index(b'\xff\xc0')
+        header[frame + 5:frame + 9] = (40000).to_bytes(2, 'big') + (50000).to_bytes(2, 'big')
+
+        self.assertEqual(image_size(bytes(header)), (50000, 40000))
+        self.assertIsNone(image_size(b'not an image'))
@@ -0,0 +1,45 @@
+import hashlib
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadMixin:
+    """
+    Hash each uploaded file while the request body streams in, so the
+    content hash is known without reading the file a second time. The
+    SHA-256 hex digest is set as `sha256` on the resulting UploadedFile.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # Before super(), which raises StopFutureHandlers once a handler takes the file
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def file_sha256(file):
+    """SHA-256 hex digest of an uploaded file, hashed during the upload when possible."""
+    digest = getattr(file, 'sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
@@ -1,16 +1,33 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from PIL.Image import DecompressionBombError
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .models import Device, Image
+from .access import get_device_access
+from .blobs import create_images
+from .downloads import proxy_response, redirect_response
+from .imaging import RENDITIONS
+from .metadata import schedule_metadata
+from .permissions import DeviceScopedQuerysetMixin, IsDeviceUser, is_mapped
+from .pyramids import exceeds_pixel_limit, schedule_pyramids, tile_grid, tile_name
+from .renditions import generate_renditions, schedule_renditions
+from .similarity import image_hash_index, to_unsigned
+from .storage import (
+    DirectUploadUnavailable, delete_object, new_image_name, presigned_put_url,
+    object_metadata, read_upload_slot, sign_upload_slot,
+)
+from utils.pagination import paginated_response
 from .serializers import DeviceSerializer, ImageSerializer
 from rest_framework.exceptions import PermissionDenied, NotFound
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import get_user_model
-from django.http import FileResponse
-from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import Http404
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 
 User = get_user_model()
 
@@ -36,38 +53,36 @@ class DeviceViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
     def admin(self, request):        
         queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return paginated_response(request, queryset, DeviceSerializer)
 
         
+    def get_permissions(self):
+        # admin-api: a device can be read by its users and by admins
+        if self.action == 'retrieve':
+            return [IsAuthenticated(), IsDeviceUser()]
+        return super().get_permissions()
+
     def retrieve(self, request, pk=None):
         device = self.get_object()
-        
-        # admin-api
-        if request.user in device.users.all() or request.user.is_superuser:
-            serializer = self.get_serializer(device)
-            return Response(serializer.data)
-        else:
-            raise PermissionDenied("You do not have permission to access this resource.")
+        serializer = self.get_serializer(device)
+        return Response(serializer.data)
  
-    @action(detail=False, methods=['get'], url_path='address/(?P<address>[^/.]+)', permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['get'], url_path='address/(?P<address>[^/.]+)', permission_classes=[IsAuthenticated, IsDeviceUser])
     def retrieve_by_address(self, request, address=None):
         try:
             device = Device.objects.get(address=address)
-            if request.user in device.users.all() or request.user.is_superuser:
-                serializer = self.get_serializer(device)
-                return Response(serializer.data)
-            else:
-                raise PermissionDenied("You do not have permission to access this resource.")
         except Device.DoesNotExist:
             raise NotFound(detail="Device not found", code=404)
+        self.check_object_permissions(request, device)
+        serializer = self.get_serializer(device)
+        return Response(serializer.data)
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def map_user(self, request, pk=None):
         device = self.get_object()  # This retrieves the Device instance based on the provided pk (primary key)
         user = request.user
         
-        if user not in device.users.all():
+        if not is_mapped(device.pk, user):
             device.users.add(user)
             device.save()
             return Response({'status': 'user added to device'}, status=status.HTTP_200_OK)
@@ -79,7 +94,7 @@ class DeviceViewSet(viewsets.ModelViewSet):
         device = self.get_object()
         user = request.user
 
-        if user in device.users.all():
+        if is_mapped(device.pk, user):
             device.users.remove(user)
             device.save()
             return Response({'status': 'device unmapped from user'}, status=status.HTTP_200_OK)
@@ -100,7 +115,7 @@ class DeviceViewSet(viewsets.ModelViewSet):
         user = get_object_or_404(User, pk=user_id)
 
         # Check if the user is already mapped to the device
-        if user in device.users.all():
+        if is_mapped(device.pk, user):
             return Response({'status': 'User already mapped to device'}, status=status.HTTP_200_OK)
 
         # Add the user to the device
@@ -123,14 +138,14 @@ class DeviceViewSet(viewsets.ModelViewSet):
         user = get_object_or_404(User, pk=user_id)
 
         # Check if the user is mapped to the device
-        if user in device.users.all():
+        if is_mapped(device.pk, user):
             device.users.remove(user)
             device.save()
             return Response({'status': 'User unmapped from device'}, status=status.HTTP_200_OK)
         else:
             return Response({'status': 'User not mapped to device'}, status=status.HTTP_200_OK)
 
-class ImageViewSet(viewsets.ModelViewSet):
+class ImageViewSet(DeviceScopedQuerysetMixin, viewsets.ModelViewSet):
     queryset = Image.objects.all()
     serializer_class = ImageSerializer
     parser_classes = (MultiPartParser, FormParser)
@@ -140,18 +155,22 @@ class ImageViewSet(viewsets.ModelViewSet):
         device_id = request.data.get('device')
         if not device_id:
             return Response({"detail": "Device ID is required."}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            device = Device.objects.get(id=device_id)
-            if request.user in device.users.all() or request.user.is_superuser:
-                device = Device.objects.get(id=device_id)
-            else:
-                return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
-        except Device.DoesNotExist:
+        access = get_device_access(request, device_id)
+        if access is None:
             return Response({"detail": "Device not found."}, status=status.HTTP_404_NOT_FOUND)
+        if not access.allows(request.user):
+            return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
         
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save(device=device)
+        data = serializer.validated_data
+        [image] = create_images(access.device_id, [data['image_file']], [(data.get('geo_location_lat'), data.get('geo_location_long'))])
+        schedule_metadata([image.id])
+        schedule_renditions([image.id])
+        if request.data.get('pyramid') in ('true', '1'):
+            schedule_pyramids([image.id])
+            image.refresh_from_db(fields=['pyramid'])
+        serializer = self.get_serializer(image)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
     
@@ -160,40 +179,160 @@ class ImageViewSet(viewsets.ModelViewSet):
         device_id = request.data.get('device')
         if not device_id:
             return Response({"detail": "Device ID is required."}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            device = Device.objects.get(id=device_id)
-            if request.user in device.users.all() or request.user.is_superuser:
-                device = Device.objects.get(id=device_id)
-            else:
-                return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
-        except Device.DoesNotExist:
+        access = get_device_access(request, device_id)
+        if access is None:
             return Response({"detail": "Device not found."}, status=status.HTTP_404_NOT_FOUND)
+        if not access.allows(request.user):
+            return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
 
         files = request.FILES.getlist('images')
         geo_locations = request.data.get('geo_locations')
 
         if not files:
             return Response({"detail": "No images provided."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(files) > settings.IMAGE_UPLOAD_MAX_SLOTS:
+            return Response({"detail": f"At most {settings.IMAGE_UPLOAD_MAX_SLOTS} images can be uploaded at once."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Optional JSON array with one [lat, long] pair or null per image; images
+        # without one get the location from their EXIF geotag
+        if geo_locations:
+            try:
+                geo_locations = [None if location is None else (float(location[0]), float(location[1])) for location in json.loads(geo_locations)]
+            except (TypeError, ValueError, IndexError, KeyError):
+                return Response({"detail": "Invalid geo locations format."}, status=status.HTTP_400_BAD_REQUEST)
+            if any(location is not None and not (-90 <= location[0] <= 90 and -180 <= location[1] <= 180) for location in geo_locations):
+                return Response({"detail": "Invalid geo locations format."}, status=status.HTTP_400_BAD_REQUEST)
+            if len(files) != len(geo_locations):
+                return Response({"detail": "The number of images does not match the number of geo locations."}, status=status.HTTP_400_BAD_REQUEST)
+            geo_locations = [location or (None, None) for location in geo_locations]
+        else:
+            geo_locations = [(None, None)] * len(files)
+
+        # Each distinct content is written once, all writes concurrently, so the
+        # upload takes about as long as the slowest one; nothing is kept unless
+        # every write and the insert succeed
+        images = create_images(access.device_id, files, geo_locations)
+        schedule_metadata([image.id for image in images])
+        schedule_renditions([image.id for image in images])
+        if request.data.get('pyramid') in ('true', '1'):
+            # Large orthomosaics are also cut into tiles for deep zoom viewers
+            schedule_pyramids([image.id for image in images])
+            images = Image.objects.filter(id__in=[image.id for image in images]).order_by('id')
+
+        serializer = ImageSerializer(images, many=True, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='upload-slots', parser_classes=[JSONParser])
+    def upload_slots(self, request, *args, **kwargs):
+        # Clients PUT the images straight to storage with the presigned URLs and
+        # then pass the slot tokens to confirm_uploads to create the Image rows
+        device_id = request.data.get('device')
+        if not device_id:
+            return Response({"detail": "Device ID is required."}, status=status.HTTP_400_BAD_REQUEST)
+        access = get_device_access(request, device_id)
+        if access is None:
+            return Response({"detail": "Device not found."}, status=status.HTTP_404_NOT_FOUND)
+        if not access.allows(request.user):
+            return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
 
-        if not geo_locations:
-            return Response({"detail": "Geo locations are required."}, status=status.HTTP_400_BAD_REQUEST)
+        files = request.data.get('files')
+        if not isinstance(files, list) or not files:
+            return Response({"detail": "A list of files is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(files) > settings.IMAGE_UPLOAD_MAX_SLOTS:
+            return Response({"detail": f"At most {settings.IMAGE_UPLOAD_MAX_SLOTS} files can be uploaded at once."}, status=status.HTTP_400_BAD_REQUEST)
 
+        slots = []
         try:
-            geo_locations = eval(geo_locations)  # assuming geo_locations is a string representation of a list of tuples
-        except:
-            return Response({"detail": "Invalid geo locations format."}, status=status.HTTP_400_BAD_REQUEST)
+            for file in files:
+                file = file if isinstance(file, dict) else {}
+                content_type = str(file.get('content_type') or '')
+                if not content_type.startswith('image/'):
+                    return Response({"detail": "Every file needs an image content_type."}, status=status.HTTP_400_BAD_REQUEST)
+                name = new_image_name(access.device_id, str(file.get('name') or ''), content_type)
+                slots.append({
+                    'name': file.get('name'),
+                    'token': sign_upload_slot(name, access.device_id, request.user.id, content_type),
+                    'url': presigned_put_url(name, content_type),
+                    'method': 'PUT',
+                    'headers': {'Content-Type': content_type},
+                })
+        except DirectUploadUnavailable as e:
+            return Response({"detail": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        return Response({
+            'slots': slots,
+            'expires_in': settings.IMAGE_UPLOAD_URL_EXPIRY,
+            'max_bytes': settings.IMAGE_UPLOAD_MAX_BYTES,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='confirm-uploads', parser_classes=[JSONParser])
+    def confirm_uploads(self, request, *args, **kwargs):
+        # Only object metadata is read from storage, to check that each upload
+        # arrived and is within the size limit
+        uploads = request.data.get('uploads')
+        if not isinstance(uploads, list) or not uploads:
+            return Response({"detail": "A list of uploads is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(uploads) > settings.IMAGE_UPLOAD_MAX_SLOTS:
+            return Response({"detail": f"At most {settings.IMAGE_UPLOAD_MAX_SLOTS} uploads can be confirmed at once."}, status=status.HTTP_400_BAD_REQUEST)
+
+        rejected = []
+        pending = []
+        for index, upload in enumerate(uploads):
+            upload = upload if isinstance(upload, dict) else {}
+            slot = read_upload_slot(str(upload.get('token') or ''))
+            if slot is None or slot['user'] != request.user.id:
+                rejected.append({'index': index, 'detail': 'Invalid or expired upload token.'})
+                continue
+            try:
+                lat = upload.get('geo_location_lat')
+                long = upload.get('geo_location_long')
+                lat = None if lat is None else float(lat)
+                long = None if long is None else float(long)
+            except (TypeError, ValueError):
+                rejected.append({'index': index, 'detail': 'Invalid geo location.'})
+                continue
+            pending.append((index, slot, lat, long))
 
-        if len(files) != len(geo_locations):
-            return Response({"detail": "The number of images does not match the number of geo locations."}, status=status.HTTP_400_BAD_REQUEST)
+        # Device access may have been revoked since the slots were issued
+        allowed = {}
+        for device_id in {slot['device'] for _, slot, _, _ in pending}:
+            access = get_device_access(request, device_id)
+            allowed[device_id] = access is not None and access.allows(request.user)
+
+        confirmed = set(Image.objects.filter(image_file__in=[slot['name'] for _, slot, _, _ in pending]).values_list('image_file', flat=True))
+        checks = [(index, slot, lat, long) for index, slot, lat, long in pending if allowed[slot['device']] and slot['name'] not in confirmed]
+        for index, slot, _, _ in pending:
+            if not allowed[slot['device']]:
+                rejected.append({'index': index, 'detail': 'You do not have permission to access this resource.'})
+            elif slot['name'] in confirmed:
+                rejected.append({'index': index, 'detail': 'Upload was already confirmed.'})
+
+        try:
+            with ThreadPoolExecutor(max_workers=settings.IMAGE_UPLOAD_CHECK_WORKERS) as executor:
+                objects = list(executor.map(lambda check: object_metadata(check[1]['name']), checks))
+        except DirectUploadUnavailable as e:
+            return Response({"detail": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
 
         images = []
-        for file, (lat, long) in zip(files, geo_locations):
-            image = Image(device=device, image_file=file, geo_location_lat=lat, geo_location_long=long)
-            image.save()
-            images.append(image)
+        for (index, slot, lat, long), stored in zip(checks, objects):
+            if stored is None:
+                rejected.append({'index': index, 'detail': 'File was not uploaded.'})
+            elif stored['size'] > settings.IMAGE_UPLOAD_MAX_BYTES:
+                delete_object(slot['name'])
+                rejected.append({'index': index, 'detail': f'File is larger than {settings.IMAGE_UPLOAD_MAX_BYTES} bytes.'})
+            else:
+                images.append(Image(device_id=slot['device'], image_file=slot['name'], geo_location_lat=lat, geo_location_long=long))
 
-        serializer = ImageSerializer(images, many=True)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        Image.objects.bulk_create(images)
+        # Re-read so the ids are known on backends that do not return them from bulk inserts
+        images = Image.objects.filter(image_file__in=[image.image_file.name for image in images]).order_by('id')
+        schedule_metadata([image.id for image in images])
+        schedule_renditions([image.id for image in images])
+        rejected.sort(key=lambda item: item['index'])
+        return Response({
+            'images': ImageSerializer(images, many=True, context=self.get_serializer_context()).data,
+            'rejected': rejected,
+        }, status=status.HTTP_201_CREATED if images else status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, methods=['get'])
     def all(self, request):
@@ -201,18 +340,14 @@ class ImageViewSet(viewsets.ModelViewSet):
         device_id = request.query_params.get('device_id')
         if not device_id:
             return Response({"detail": "Device ID is required."}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            device = Device.objects.get(id=device_id)
-            if request.user in device.users.all() or request.user.is_superuser:
-                device = Device.objects.get(id=device_id)
-            else:
-                return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
-        except Device.DoesNotExist:
+        access = get_device_access(request, device_id)
+        if access is None:
             return Response({"detail": "Device not found."}, status=status.HTTP_404_NOT_FOUND)
+        if not access.allows(request.user):
+            return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
         
-        images = Image.objects.filter(device=device)
-        serializer = self.get_serializer(images, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        images = Image.objects.filter(device_id=access.device_id)
+        return paginated_response(request, images, ImageSerializer, context=self.get_serializer_context())
     
     @action(detail=False, methods=['get'])
     def download(self, request, pk=None):
@@ -220,16 +355,133 @@ class ImageViewSet(viewsets.ModelViewSet):
         image_id = request.query_params.get('image_id')
         try:
             image = Image.objects.get(id=image_id)
-            device = image.device
-            if request.user in device.users.all() or request.user.is_superuser:
-                pass
-            else:
+            access = get_device_access(request, image.device_id)
+            if not access.allows(request.user):
                 return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
         except Image.DoesNotExist:
             return Response({"detail": "Image not found/No permission."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Serve the image file using FileResponse
+        # Storage serves the bytes; proxying through the app is kept for
+        # clients that cannot follow a redirect to another origin
+        if request.query_params.get('proxy') == 'true':
+            return proxy_response(request, image.image_file)
+        return redirect_response(image.image_file.name)
+
+    @action(detail=False, methods=['get'])
+    def rendition(self, request):
+        # Images uploaded before renditions existed, or whose background job
+        # has not finished yet, get theirs generated here on first request
+        name = request.query_params.get('name')
+        if name not in RENDITIONS:
+            return Response({"detail": f"Rendition must be one of: {', '.join(RENDITIONS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            image = Image.objects.get(id=request.query_params.get('image_id'))
+        except (Image.DoesNotExist, ValueError, TypeError):
+            return Response({"detail": "Image not found/No permission."}, status=status.HTTP_404_NOT_FOUND)
+        access = get_device_access(request, image.device_id)
+        if not access.allows(request.user):
+            return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
+
+        if name not in image.renditions:
+            try:
+                generate_renditions(image)
+            except (OSError, DecompressionBombError):
+                # Pillow raises OSError subclasses for files it cannot decode,
+                # and DecompressionBombError for images over its pixel limit
+                return Response({"detail": "Image could not be rendered."}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return redirect_response(image.renditions[name])
+
+    @action(detail=False, methods=['get'])
+    def similar(self, request):
+        # Images that look alike: their dHashes differ in at most max_distance bits
+        try:
+            image = Image.objects.get(id=request.query_params.get('image_id'))
+        except (Image.DoesNotExist, ValueError, TypeError):
+            return Response({"detail": "Image not found/No permission."}, status=status.HTTP_404_NOT_FOUND)
+        access = get_device_access(request, image.device_id)
+        if not access.allows(request.user):
+            return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            max_distance = int(request.query_params.get('max_distance', 10))
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({"detail": "Invalid max_distance or limit."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= max_distance <= settings.SIMILAR_MAX_DISTANCE:
+            return Response({"detail": f"max_distance must be between 0 and {settings.SIMILAR_MAX_DISTANCE}."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= settings.SIMILAR_MAX_RESULTS:
+            return Response({"detail": f"limit must be between 1 and {settings.SIMILAR_MAX_RESULTS}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if image.dhash is None:
+            try:
+                generate_renditions(image)
+            except (OSError, DecompressionBombError):
+                return Response({"detail": "Image could not be rendered."}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        device_ids = None
+        if not request.user.is_superuser:
+            device_ids = set(request.user.devices.values_list('id', flat=True))
+        matches = image_hash_index.similar(image.dhash, max_distance, limit, device_ids=device_ids, exclude=image.id)
+        images = Image.objects.in_bulk([image_id for _, image_id in matches])
+        context = self.get_serializer_context()
+        return Response({
+            'image': image.id,
+            'dhash': f'{to_unsigned(image.dhash):016x}',
+            'results': [
+                {'distance': distance, 'image': ImageSerializer(images[image_id], context=context).data}
+                for distance, image_id in matches
+                if image_id in images
+            ],
+        })
+
+    @action(detail=False, methods=['get', 'post'], parser_classes=[JSONParser])
+    def pyramid(self, request):
+        # POST requests the deep zoom tile pyramid of an image, GET describes it
+        image_id = request.data.get('image_id') if request.method == 'POST' else request.query_params.get('image_id')
+        try:
+            image = Image.objects.get(id=image_id)
+        except (Image.DoesNotExist, ValueError, TypeError):
+            return Response({"detail": "Image not found/No permission."}, status=status.HTTP_404_NOT_FOUND)
+        access = get_device_access(request, image.device_id)
+        if not access.allows(request.user):
+            return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
+
+        if request.method == 'POST':
+            if (image.pyramid or {}).get('status') not in ('pending', 'ready') and exceeds_pixel_limit(image):
+                return Response({"detail": f"Images over {settings.IMAGE_PYRAMID_MAX_PIXELS} pixels cannot be cut into a tile pyramid."}, status=status.HTTP_400_BAD_REQUEST)
+            schedule_pyramids([image.id])
+            image.refresh_from_db(fields=['pyramid'])
+        elif image.pyramid is None:
+            return Response({"detail": "No tile pyramid was requested for this image."}, status=status.HTTP_404_NOT_FOUND)
+
+        pyramid = dict(image.pyramid)
+        if pyramid['status'] == 'ready':
+            pyramid.pop('root')
+            url = reverse('image-tile')
+            pyramid['tile_url'] = request.build_absolute_uri(f'{url}?image_id={image.id}') + '&level={level}&column={column}&row={row}'
+        return Response({'image': image.id, **pyramid}, status=status.HTTP_202_ACCEPTED if pyramid['status'] == 'pending' else status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def tile(self, request):
+        try:
+            image = Image.objects.get(id=request.query_params.get('image_id'))
+        except (Image.DoesNotExist, ValueError, TypeError):
+            return Response({"detail": "Image not found/No permission."}, status=status.HTTP_404_NOT_FOUND)
+        access = get_device_access(request, image.device_id)
+        if not access.allows(request.user):
+            return Response({"detail": "You do not have permission to access this resource."}, status=status.HTTP_403_FORBIDDEN)
+        if not image.pyramid or image.pyramid.get('status') != 'ready':
+            return Response({"detail": "The tile pyramid of this image is not ready."}, status=status.HTTP_404_NOT_FOUND)
+
         try:
-            return FileResponse(image.image_file)
-        except FileNotFoundError:
-            raise Http404("Image not found.")
\ No newline at end of file
+            level = int(request.query_params['level'])
+            column = int(request.query_params['column'])
+            row = int(request.query_params['row'])
+        except (KeyError, ValueError):
+            return Response({"detail": "level, column and row are required."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= level < image.pyramid['levels']:
+            return Response({"detail": "Tile not found."}, status=status.HTTP_404_NOT_FOUND)
+        columns, rows = tile_grid(image.pyramid, level)
+        if not (0 <= column < columns and 0 <= row < rows):
+            return Response({"detail": "Tile not found."}, status=status.HTTP_404_NOT_FOUND)
+        return redirect_response(tile_name(image.pyramid, level, column, row))
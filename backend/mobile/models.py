@@ -1,5 +1,6 @@
 from django.db import models
 from devices.models import Device
+from utils.geo import grid_cell
 from users.models import CustomUser
     
 class Crop(models.Model):
@@ -14,6 +15,8 @@ class Crop(models.Model):
 class Mobile(models.Model):
     geo_location_lat = models.FloatField(null=True)
     geo_location_long = models.FloatField(null=True)
+    # Spatial grid key of the position, see utils.geo
+    geo_cell = models.IntegerField(null=True, db_index=True, editable=False)
     qr_code=models.TextField()
     recording_time=models.DateTimeField(null=True)
     device = models.ForeignKey(Device, on_delete=models.SET_NULL, null=True, related_name='mobiles')
@@ -22,6 +25,17 @@ class Mobile(models.Model):
     pesticide_used=models.FloatField(null=True)
     crop = models.ForeignKey(Crop, on_delete=models.SET_NULL, null=True, related_name='mobiles')
 
+    class Meta:
+        # Per-device history is read as a range over (device, recording_time)
+        indexes = [
+            models.Index(fields=['device', 'recording_time'], name='mobile_device_time_idx'),
+        ]
+        ordering = ['device', 'recording_time', 'id']
+
+    def save(self, *args, **kwargs):
+        self.geo_cell = grid_cell(self.geo_location_lat, self.geo_location_long)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Mobile {self.id}-Device {self.device.name}" if self.device else f"Mobile {self.id}"
     
@@ -26,6 +26,8 @@ AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
 AWS_STORAGE_BUCKET_NAME = os.environ.get("AWS_STORAGE_BUCKET_NAME")
 AWS_S3_REGION_NAME = os.environ.get("AWS_S3_REGION_NAME")
+# Set to use an S3 compatible service instead of AWS, e.g. a local MinIO
+AWS_S3_ENDPOINT_URL = os.environ.get("AWS_S3_ENDPOINT_URL")
 
 DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
@@ -239,3 +241,111 @@ SIMPLE_JWT = {
     # 'SLIDING_TOKEN_LIFETIME': timedelta(minutes=5),
     # 'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
+
+# Limits for the wstations-edge bulk ingestion endpoint
+EDGE_BULK_MAX_READINGS = int(os.environ.get("EDGE_BULK_MAX_READINGS", default=1000))
+EDGE_BULK_BATCH_SIZE = int(os.environ.get("EDGE_BULK_BATCH_SIZE", default=500))
+
+# In-process cache of API key -> user/devices used by ApiKeyAuthentication.
+# Deleting a key or changing its user's devices only clears the cache of the
+# process handling the change: other workers keep the old entry for up to
+# API_KEY_CACHE_TTL seconds
+API_KEY_CACHE_TTL = int(os.environ.get("API_KEY_CACHE_TTL", default=300))
+API_KEY_CACHE_SIZE = int(os.environ.get("API_KEY_CACHE_SIZE", default=10000))
+
+# Per-process cache used by devices.access.get_device_access. Mapping changes
+# invalidate it in the process that made them; other worker processes pick
+# them up once the TTL expires.
+DEVICE_ACCESS_CACHE_TTL = int(os.environ.get("DEVICE_ACCESS_CACHE_TTL", default=30))
+DEVICE_ACCESS_CACHE_SIZE = int(os.environ.get("DEVICE_ACCESS_CACHE_SIZE", default=10000))
+
+# Optional write-behind mode for reading create endpoints: accepted readings
+# are buffered in-process and written with bulk_create once INGEST_BUFFER_SIZE
+# rows are pending or the oldest one has waited INGEST_FLUSH_INTERVAL seconds.
+INGEST_WRITE_BEHIND = bool(int(os.environ.get("INGEST_WRITE_BEHIND", default=0)))
+INGEST_BUFFER_SIZE = int(os.environ.get("INGEST_BUFFER_SIZE", default=500))
+INGEST_BUFFER_MAX_PENDING = int(os.environ.get("INGEST_BUFFER_MAX_PENDING", default=50000))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", default=2.0))
+INGEST_FLUSH_LAG_WARNING = float(os.environ.get("INGEST_FLUSH_LAG_WARNING", default=30.0))
+# Buffers with a backlog, drops or failed flushes are logged this often, and
+# admins can read the serving process's counters at /ingest/stats/
+INGEST_STATS_LOG_INTERVAL = float(os.environ.get("INGEST_STATS_LOG_INTERVAL", default=60.0))
+
+# Keyset pagination of list endpoints (utils.pagination), page[size] is capped
+# at KEYSET_MAX_PAGE_SIZE
+KEYSET_PAGE_SIZE = int(os.environ.get("KEYSET_PAGE_SIZE", default=100))
+KEYSET_MAX_PAGE_SIZE = int(os.environ.get("KEYSET_MAX_PAGE_SIZE", default=1000))
+
+# Rows read per query while streaming NDJSON exports
+NDJSON_CHUNK_SIZE = int(os.environ.get("NDJSON_CHUNK_SIZE", default=2000))
+
+# Rows read per query while building columnar (.npz) exports
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", default=20000))
+
+# Most readings a stats request computes percentiles over, they are held in
+# memory; read EXPORT_CHUNK_SIZE rows per query
+STATS_PERCENTILE_MAX_ROWS = int(os.environ.get("STATS_PERCENTILE_MAX_ROWS", default=1_000_000))
+
+# The nearest weather station index is rebuilt from the database after
+# NEAREST_INDEX_TTL seconds; new readings update it in between
+NEAREST_INDEX_TTL = float(os.environ.get("NEAREST_INDEX_TTL", default=300))
+NEAREST_MAX_K = int(os.environ.get("NEAREST_MAX_K", default=100))
+
+# QGIS raster grids: largest grid served (rows x columns) and how long a
+# computed grid is reused from the cache
+QGIS_GRID_MAX_CELLS = int(os.environ.get("QGIS_GRID_MAX_CELLS", default=250000))
+QGIS_GRID_CACHE_TTL = int(os.environ.get("QGIS_GRID_CACHE_TTL", default=300))
+
+# Bulk QGIS survey uploads: samples accepted per request and rows per INSERT
+QGIS_BULK_MAX_SAMPLES = int(os.environ.get("QGIS_BULK_MAX_SAMPLES", default=100000))
+QGIS_BULK_BATCH_SIZE = int(os.environ.get("QGIS_BULK_BATCH_SIZE", default=2000))
+
+# Direct-to-storage image uploads: lifetime of presigned PUT URLs, slots
+# handed out per request, largest accepted image and concurrent HEAD checks
+# when uploads are confirmed
+IMAGE_UPLOAD_URL_EXPIRY = int(os.environ.get("IMAGE_UPLOAD_URL_EXPIRY", default=900))
+IMAGE_UPLOAD_MAX_SLOTS = int(os.environ.get("IMAGE_UPLOAD_MAX_SLOTS", default=100))
+IMAGE_UPLOAD_MAX_BYTES = int(os.environ.get("IMAGE_UPLOAD_MAX_BYTES", default=25 * 1024 * 1024))
+IMAGE_UPLOAD_CHECK_WORKERS = int(os.environ.get("IMAGE_UPLOAD_CHECK_WORKERS", default=8))
+
+# Lifetime in seconds of the signed URLs image downloads redirect to
+IMAGE_DOWNLOAD_URL_EXPIRY = int(os.environ.get("IMAGE_DOWNLOAD_URL_EXPIRY", default=300))
+
+# Image renditions (thumbnail, medium, preview) are generated after upload by
+# IMAGE_RENDITION_PROCESSES worker processes; older images get theirs on
+# first request
+IMAGE_RENDITIONS_ON_UPLOAD = bool(int(os.environ.get("IMAGE_RENDITIONS_ON_UPLOAD", default=1)))
+IMAGE_RENDITION_PROCESSES = int(os.environ.get("IMAGE_RENDITION_PROCESSES", default=2))
+
+# Concurrent storage writes of a multi-image upload
+IMAGE_UPLOAD_WORKERS = int(os.environ.get("IMAGE_UPLOAD_WORKERS", default=8))
+
+# Uploaded files are hashed while they stream in, for image deduplication
+FILE_UPLOAD_HANDLERS = [
+    "devices.uploads.HashingMemoryFileUploadHandler",
+    "devices.uploads.HashingTemporaryFileUploadHandler",
+]
+
+# Concurrent EXIF header reads when extracting image geotags and capture times
+IMAGE_METADATA_WORKERS = int(os.environ.get("IMAGE_METADATA_WORKERS", default=8))
+
+# Image similarity search: the in-memory dHash index is rebuilt after
+# SIMILAR_INDEX_TTL seconds; queries are capped in distance and results
+SIMILAR_INDEX_TTL = int(os.environ.get("SIMILAR_INDEX_TTL", default=600))
+SIMILAR_MAX_DISTANCE = int(os.environ.get("SIMILAR_MAX_DISTANCE", default=16))
+SIMILAR_MAX_RESULTS = int(os.environ.get("SIMILAR_MAX_RESULTS", default=100))
+
+# Largest image, in pixels, cut into a deep zoom tile pyramid; a worker holds
+# about 3 bytes per pixel of the full image in memory (Pillow refuses images
+# over about 179 million pixels by default, this limit replaces it)
+IMAGE_PYRAMID_MAX_PIXELS = int(os.environ.get("IMAGE_PYRAMID_MAX_PIXELS", default=250_000_000))
+
+# Opt-in JWT mode embedding the user's device ids and a device mapping
+# version in access tokens, so device scoped reads skip the user and
+# mapping lookups. The version and flags checked against each token are
+# kept in the Django cache for JWT_USER_STATE_CACHE_TTL seconds and dropped
+# when they change. With the default per-process cache, other workers keep
+# accepting tokens made stale by a mapping change for up to that long;
+# configure a shared CACHES backend, or set the TTL to 0, to reject them at once
+JWT_DEVICE_CLAIMS = bool(int(os.environ.get("JWT_DEVICE_CLAIMS", default=0)))
+JWT_USER_STATE_CACHE_TTL = int(os.environ.get("JWT_USER_STATE_CACHE_TTL", default=30))
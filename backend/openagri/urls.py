@@ -11,6 +11,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 from users import serializers as user_serializers
+from utils.views import IngestStatsView
 
 router = routers.DefaultRouter()
 
@@ -29,5 +30,6 @@ urlpatterns = router.urls
 urlpatterns += [
     path('admin/', admin.site.urls),
     path('login/', TokenObtainPairView.as_view(serializer_class=user_serializers.CustomTokenObtainPairSerializer), name='token_obtain_pair'),
-    path('refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('ingest/stats/', IngestStatsView.as_view(), name='ingest_stats'),
+    path('refresh/', TokenRefreshView.as_view(serializer_class=user_serializers.CustomTokenRefreshSerializer), name='token_refresh'),
 ]
\ No newline at end of file
@@ -0,0 +1,203 @@
+import csv
+import io
+import json
+from datetime import timezone
+import numpy as np
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from devices.access import scope_to_user_devices
+from devices.models import Device
+from utils.geo import assign_geo_cells
+from utils.utils import DeviceType
+from .models import QGIS
+
+INDEXES = ('ndvi', 'gndvi', 'lai', 'msdvi')
+COORDINATES = ('geo_location_lat', 'geo_location_long')
+
+# Column names accepted in CSV files and GeoJSON properties besides the field names
+ALIASES = {
+    'lat': 'geo_location_lat',
+    'latitude': 'geo_location_lat',
+    'long': 'geo_location_long',
+    'lon': 'geo_location_long',
+    'longitude': 'geo_location_long',
+}
+
+
+class SampleFileError(ValueError):
+    pass
+
+
+def _normalize(sample):
+    return {ALIASES.get(key.strip().lower(), key.strip().lower()): value for key, value in sample.items()}
+
+
+def read_csv(raw):
+    try:
+        text = raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise SampleFileError('CSV file must be UTF-8 encoded')
+    return [_normalize(row) for row in csv.DictReader(io.StringIO(text))]
+
+
+def read_geojson(raw):
+    try:
+        document = json.loads(raw)
+    except ValueError:
+        raise SampleFileError('Invalid GeoJSON')
+    features = document.get('features') if isinstance(document, dict) else None
+    if not isinstance(features, list):
+        raise SampleFileError('GeoJSON must be a FeatureCollection')
+
+    samples = []
+    for feature in features:
+        properties = feature.get('properties') if isinstance(feature, dict) else None
+        sample = _normalize(properties) if isinstance(properties, dict) else {}
+        geometry = feature.get('geometry') if isinstance(feature, dict) else None
+        if isinstance(geometry, dict) and geometry.get('type') == 'Point':
+            coordinates = geometry.get('coordinates') or []
+            if len(coordinates) >= 2:
+                sample['geo_location_long'], sample['geo_location_lat'] = coordinates[0], coordinates[1]
+        samples.append(sample)
+    return samples
+
+
+def read_samples(data, upload=None):
+    """
+    Samples of a bulk upload as a list of dicts keyed by QGIS field names.
+
+    `data` is a parsed JSON array (or an object with a `samples` array);
+    `upload` a CSV or GeoJSON file, told apart by its extension.
+    """
+    if upload is not None:
+        raw = upload.read()
+        if upload.name.lower().endswith('.csv'):
+            return read_csv(raw)
+        if upload.name.lower().endswith(('.geojson', '.json')):
+            return read_geojson(raw)
+        raise SampleFileError('File must be a .csv or .geojson file')
+
+    samples = data.get('samples') if isinstance(data, dict) else data
+    if not isinstance(samples, list):
+        raise SampleFileError('A list of samples or a CSV or GeoJSON file is required')
+    return [_normalize(sample) if isinstance(sample, dict) else None for sample in samples]
+
+
+def _floats(samples, field, errors):
+    values = [sample.get(field) for sample in samples]
+    values = [None if value == '' else value for value in values]
+    try:
+        # One pass for the whole column, None becomes NaN
+        column = np.asarray(values, dtype=np.float64)
+        if column.shape == (len(samples),):
+            return column
+    except (TypeError, ValueError):
+        pass
+
+    # Some value is not a number: parse row by row to tell which
+    column = np.full(len(samples), np.nan)
+    for row, value in enumerate(values):
+        if value is None:
+            continue
+        try:
+            column[row] = float(value)
+        except (TypeError, ValueError):
+            errors.setdefault(row, {})[field] = ['A valid number is required.']
+    return column
+
+
+def validate_samples(samples, user, default_device=None):
+    """
+    Check every sample and the devices they belong to.
+
+    Returns the QGIS rows ready to insert, with their position in `samples`,
+    and a {position: field errors} dict for the rejected ones. Numbers are
+    parsed into arrays and range checked in one pass per column; devices are
+    checked with one query for their types and one for the user's mappings.
+    """
+    errors = {}
+    for row, sample in enumerate(samples):
+        if sample is None:
+            errors[row] = {'non_field_errors': ['Sample must be an object.']}
+    samples = [sample or {} for sample in samples]
+
+    columns = {field: _floats(samples, field, errors) for field in COORDINATES + INDEXES}
+    lat, long = columns['geo_location_lat'], columns['geo_location_long']
+    checks = [
+        ('geo_location_lat', ~np.isnan(lat) & ~((lat >= -90) & (lat <= 90)), 'Latitude must be within ±90.'),
+        ('geo_location_long', ~np.isnan(long) & ~((long >= -180) & (long <= 180)), 'Longitude must be within ±180.'),
+    ]
+    for field in INDEXES:
+        checks.append((field, np.isinf(columns[field]), 'A finite number is required.'))
+    for field, invalid, message in checks:
+        for row in np.flatnonzero(invalid):
+            errors.setdefault(int(row), {}).setdefault(field, [message])
+
+    times = []
+    for row, sample in enumerate(samples):
+        value = sample.get('recording_time')
+        moment = None
+        if isinstance(value, str) and value:
+            try:
+                moment = parse_datetime(value.strip())
+            except ValueError:
+                moment = None
+        if moment is None:
+            errors.setdefault(row, {})['recording_time'] = ['A valid ISO 8601 datetime is required.']
+        elif moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        times.append(moment)
+
+    device_ids = []
+    for row, sample in enumerate(samples):
+        value = sample.get('device') or default_device
+        try:
+            device_ids.append(int(value))
+        except (TypeError, ValueError):
+            device_ids.append(None)
+            errors.setdefault(row, {})['device'] = ['A valid device ID is required.']
+
+    device_types = dict(
+        Device.objects.filter(id__in={d for d in device_ids if d is not None}).values_list('id', 'type_id')
+    )
+    if user.is_superuser:
+        members = set(device_types)
+    else:
+        # Scoped like every other device read, from token claims when present
+        members = set(
+            scope_to_user_devices(Device.objects.filter(id__in=device_types), user, device_lookup='')
+            .values_list('id', flat=True)
+        )
+    for row, device_id in enumerate(device_ids):
+        if device_id is None:
+            continue
+        if device_id not in device_types:
+            errors.setdefault(row, {})['device'] = ['Device not found.']
+        elif device_types[device_id] != DeviceType.QGIS.value:
+            errors.setdefault(row, {})['device'] = ['Device is not of type QGIS.']
+        elif device_id not in members:
+            errors.setdefault(row, {})['device'] = ['Device is not associated with the authenticated user.']
+
+    accepted = []
+    for row in range(len(samples)):
+        if row in errors:
+            continue
+        values = {field: None if np.isnan(column[row]) else float(column[row]) for field, column in columns.items()}
+        accepted.append((row, QGIS(device_id=device_ids[row], recording_time=times[row], **values)))
+    return accepted, errors
+
+
+def insert_samples(accepted, batch_size):
+    """Insert the accepted rows in batches of `batch_size`, all in one transaction."""
+    batches = []
+    with transaction.atomic():
+        for start in range(0, len(accepted), batch_size):
+            batch = accepted[start:start + batch_size]
+            QGIS.objects.bulk_create(assign_geo_cells([sample for _, sample in batch]))
+            batches.append({
+                'batch': len(batches),
+                'first_row': batch[0][0],
+                'last_row': batch[-1][0],
+                'inserted': len(batch),
+            })
+    return batches
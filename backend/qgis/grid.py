@@ -0,0 +1,70 @@
+import math
+import numpy as np
+
+INDEXES = ('ndvi', 'gndvi', 'lai', 'msdvi')
+AGGREGATES = ('mean', 'min', 'max', 'count')
+
+
+def grid_shape(bbox, cell):
+    """Number of (rows, columns) of `cell` degrees needed to cover `bbox`."""
+    min_long, min_lat, max_long, max_lat = bbox
+    width = max_long - min_long if min_long <= max_long else max_long + 360 - min_long
+    # Rounded first so float noise does not add a whole row or column
+    return (
+        max(math.ceil(round((max_lat - min_lat) / cell, 9)), 1),
+        max(math.ceil(round(width / cell, 9)), 1),
+    )
+
+
+def bin_points(columns, bbox, cell, indexes, aggregate):
+    """
+    Aggregate point samples into a lat/long raster.
+
+    `columns` holds the geo_location_lat/long arrays and one array per index,
+    as read by utils.export.read_columns. Returns one (rows, columns) array
+    per index, row 0 being the southern edge of `bbox`; cells without samples
+    are NaN (0 for `count`).
+    """
+    min_long, min_lat, max_long, max_lat = bbox
+    rows, cols = grid_shape(bbox, cell)
+
+    lat = columns['geo_location_lat']
+    long = columns['geo_location_long']
+    if min_long > max_long:
+        # Unwrap a box crossing the antimeridian
+        long = np.where(long < min_long, long + 360, long)
+
+    row = np.clip(((lat - min_lat) // cell).astype(np.int64), 0, rows - 1)
+    col = np.clip(((long - min_long) // cell).astype(np.int64), 0, cols - 1)
+    flat = row * cols + col
+    size = rows * cols
+
+    grids = {}
+    for index in indexes:
+        values = columns[index]
+        present = ~np.isnan(values)
+        cells, values = flat[present], values[present].astype(np.float64)
+        counts = np.bincount(cells, minlength=size)
+
+        if aggregate == 'count':
+            grid = counts
+        elif aggregate == 'mean':
+            sums = np.bincount(cells, weights=values, minlength=size)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                grid = np.where(counts > 0, sums / counts, np.nan)
+        else:
+            reduce, start = (np.minimum, np.inf) if aggregate == 'min' else (np.maximum, -np.inf)
+            grid = np.full(size, start)
+            reduce.at(grid, cells, values)
+            grid[counts == 0] = np.nan
+        grids[index] = grid.reshape(rows, cols)
+    return grids
+
+
+def grid_to_lists(grid, decimals=4):
+    """JSON friendly nested lists, with NaN cells as None."""
+    if np.issubdtype(grid.dtype, np.integer):
+        return grid.tolist()
+    rounded = np.round(grid, decimals).astype(object)
+    rounded[np.isnan(grid)] = None
+    return rounded.tolist()
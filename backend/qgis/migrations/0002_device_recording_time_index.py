@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_image_geo_location_lat_image_geo_location_long'),
+        ('qgis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='qgis',
+            options={'ordering': ['device', 'recording_time', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='qgis',
+            index=models.Index(fields=['device', 'recording_time'], name='qgis_device_time_idx'),
+        ),
+    ]
@@ -1,9 +1,12 @@
 from django.db import models
 from devices.models import Device
+from utils.geo import grid_cell
 
 class QGIS(models.Model):
     geo_location_lat = models.FloatField(null=True)
     geo_location_long = models.FloatField(null=True)
+    # Spatial grid key of the position, see utils.geo
+    geo_cell = models.IntegerField(null=True, db_index=True, editable=False)
     ndvi = models.FloatField(null=True)
     gndvi = models.FloatField(null=True)
     lai = models.FloatField(null=True)
@@ -11,5 +14,16 @@ class QGIS(models.Model):
     recording_time = models.DateTimeField()
     device = models.ForeignKey(Device, on_delete=models.SET_NULL, null=True, related_name='qgis')
 
+    class Meta:
+        # Per-device history is read as a range over (device, recording_time)
+        indexes = [
+            models.Index(fields=['device', 'recording_time'], name='qgis_device_time_idx'),
+        ]
+        ordering = ['device', 'recording_time', 'id']
+
+    def save(self, *args, **kwargs):
+        self.geo_cell = grid_cell(self.geo_location_lat, self.geo_location_long)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"QGIS {self.id}-Device {self.device.name}" if self.device else f"QGIS {self.id}"
@@ -1,3 +1,71 @@
+import json
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+from rest_framework.test import APIClient
+from devices.access import device_access_cache
+from devices.models import Device
+from users.models import CustomUser
+from utils.utils import DeviceType
+from .models import QGIS
 
-# Create your tests here.
+
+class QGISTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        device_access_cache.clear()
+        self.user = CustomUser.objects.create_user(username='farmer', email='farmer@example.org', password='password')
+        self.survey = Device.objects.create(name='drone', location='field', address='drone', type_id=DeviceType.QGIS.value)
+        self.survey.users.add(self.user)
+        self.foreign = Device.objects.create(name='foreign', location='field', address='foreign', type_id=DeviceType.QGIS.value)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class GridTests(QGISTestCase):
+    def test_grid_averages_samples_per_cell(self):
+        for lat, long, ndvi in ((40.0005, 22.0005, 0.2), (40.0006, 22.0004, 0.4), (40.0015, 22.0015, 0.9)):
+            QGIS.objects.create(device=self.survey, geo_location_lat=lat, geo_location_long=long, ndvi=ndvi, recording_time=timezone.now())
+        QGIS.objects.create(device=self.foreign, geo_location_lat=40.0005, geo_location_long=22.0005, ndvi=1, recording_time=timezone.now())
+
+        response = self.client.get('/qgis/grid/?bbox=22,40,22.002,40.002&cell=0.001&indexes=ndvi')
+
+        self.assertEqual(response.status_code, 200)
+        grid = response.json()['data']
+        self.assertEqual((grid['rows'], grid['columns'], grid['points']), (2, 2, 3))
+        # Row 0 is the southern edge
+        self.assertEqual(grid['grids']['ndvi'], [[0.3, None], [None, 0.9]])
+
+    def test_grid_rejects_too_many_cells(self):
+        response = self.client.get('/qgis/grid/?bbox=0,0,10,10&cell=0.0001')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkUploadTests(QGISTestCase):
+    def test_json_samples_are_validated_per_row(self):
+        samples = [
+            {'device': self.survey.id, 'lat': 40.1, 'lon': 22.1, 'ndvi': '0.5', 'recording_time': '2024-01-01T00:00:00Z'},
+            {'device': self.foreign.id, 'recording_time': '2024-01-01T00:00:00Z'},
+            {'device': self.survey.id, 'lat': 200, 'ndvi': 'abc', 'recording_time': 'yesterday'},
+        ]
+
+        response = self.client.post('/qgis/bulk/', json.dumps(samples), content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        result = response.json()['data']
+        self.assertEqual((result['inserted'], result['rejected']), (1, 2))
+        errors = {error['row']: error['errors'] for error in result['errors']}
+        self.assertEqual(errors[1], {'device': ['Device is not associated with the authenticated user.']})
+        self.assertEqual(set(errors[2]), {'geo_location_lat', 'ndvi', 'recording_time'})
+        self.assertEqual(list(QGIS.objects.values_list('device_id', 'ndvi', 'geo_location_long')), [(self.survey.id, 0.5, 22.1)])
+
+    def test_csv_file_uses_the_upload_device(self):
+        upload = SimpleUploadedFile('survey.csv', b'Lat,Lon,ndvi,recording_time\n40.1,22.1,0.5,2024-02-01T10:00:00\n40.2,22.2,,2024-02-01T10:00:00\n')
+
+        response = self.client.post(f'/qgis/bulk/?device={self.survey.id}', encode_multipart(BOUNDARY, {'file': upload}), content_type=MULTIPART_CONTENT)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(QGIS.objects.filter(device=self.survey).count(), 2)
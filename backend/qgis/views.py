@@ -1,84 +1,165 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from .models import QGIS, Device
 from .serializers import QGISSerializer
+from .bulk import SampleFileError, insert_samples, read_samples, validate_samples
+from .grid import AGGREGATES, INDEXES, bin_points, grid_shape, grid_to_lists
 from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from rest_framework.permissions import IsAdminUser
 from utils.utils import DeviceType
-
-
-class QGISViewSet(viewsets.ModelViewSet):
+from devices.access import get_device_access, scope_to_user_devices
+from devices.permissions import DeviceScopedQuerysetMixin
+from users.authentication import DeviceClaimsJWTAuthentication
+from utils.export import read_columns
+from utils.filters import filter_time_range, parse_list_param
+from utils.geo import filter_bbox, filter_location, parse_bbox
+from utils.ingest import write_behind_buffer
+from utils.views import ReadingExportMixin, ReadingListMixin, ReadingStatsMixin
+from utils.pagination import RecordingTimePagination
+
+
+class QGISViewSet(DeviceScopedQuerysetMixin, ReadingListMixin, ReadingStatsMixin, ReadingExportMixin, viewsets.ModelViewSet):
     queryset = QGIS.objects.all()
     serializer_class = QGISSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [DeviceClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecordingTimePagination
+    stats_metrics = ('ndvi', 'gndvi', 'lai', 'msdvi')
+    export_columns = {
+        'id': 'int64',
+        'device': 'int32',
+        'recording_time': 'int64',
+        'geo_location_lat': 'float64',
+        'geo_location_long': 'float64',
+        'ndvi': 'float32',
+        'gndvi': 'float32',
+        'lai': 'float32',
+        'msdvi': 'float32',
+    }
+    export_name = 'qgis'
 
     def create(self, request, *args, **kwargs):
         device_id = request.data.get('device')
-        try:
-            device = Device.objects.get(id=device_id)
-        except Device.DoesNotExist:
+        access = get_device_access(request, device_id)
+        if access is None:
             return Response({'error': 'Device not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        if device.type.id != DeviceType.QGIS.value:
+        if access.type_id != DeviceType.QGIS.value:
             return Response({'error': 'Device is not of type QGIS'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Check if the device is associated with the authenticated user
-        if not request.user.is_superuser and request.user not in device.users.all():
+        if not access.allows(request.user):
             return Response({'error': 'Device is not associated with the authenticated user'}, status=status.HTTP_403_FORBIDDEN)
         
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
+            if settings.INGEST_WRITE_BEHIND:
+                reading = write_behind_buffer(QGIS).append(serializer.validated_data)
+                return Response(self.get_serializer(reading).data, status=status.HTTP_202_ACCEPTED)
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=False, methods=['get'], url_path='by-location')
-    def by_location(self, request):
-        lat = request.query_params.get('lat')
-        long = request.query_params.get('long')
-
-        if not lat or not long:
-            return Response({'error': 'Latitude and longitude are required'}, status=status.HTTP_400_BAD_REQUEST)
-
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, MultiPartParser, FormParser])
+    def bulk(self, request):
+        try:
+            samples = read_samples(request.data, request.FILES.get('file'))
+        except SampleFileError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not samples:
+            return Response({'error': 'No samples found'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(samples) > settings.QGIS_BULK_MAX_SAMPLES:
+            return Response({'error': f'At most {settings.QGIS_BULK_MAX_SAMPLES} samples are accepted per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Samples without their own device belong to the one given with the upload
+        default_device = request.query_params.get('device')
+        if default_device is None and isinstance(request.data, dict):
+            default_device = request.data.get('device')
+
+        accepted, errors = validate_samples(samples, request.user, default_device)
+        batches = insert_samples(accepted, settings.QGIS_BULK_BATCH_SIZE)
+
+        rejected = [{'row': row, 'errors': errors[row]} for row in sorted(errors)]
+        return Response({
+            'received': len(samples),
+            'inserted': len(accepted),
+            'rejected': len(rejected),
+            'batches': batches,
+            'errors': rejected[:100],
+            'errors_truncated': len(rejected) > 100,
+        }, status=status.HTTP_201_CREATED if accepted else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'])
+    def grid(self, request):
+        bbox = parse_bbox(request)
+        if bbox is None:
+            return Response({'error': 'bbox is required'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            lat = float(lat)
-            long = float(long)
+            cell = float(request.query_params.get('cell', 0.001))
         except ValueError:
-            return Response({'error': 'Invalid latitude or longitude'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'error': 'Invalid cell size'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < cell <= 10:
+            return Response({'error': 'Cell size must be greater than 0 and at most 10 degrees'}, status=status.HTTP_400_BAD_REQUEST)
+        rows, columns = grid_shape(bbox, cell)
+        if rows * columns > settings.QGIS_GRID_MAX_CELLS:
+            return Response({'error': f'The grid would have {rows * columns} cells, at most {settings.QGIS_GRID_MAX_CELLS} are allowed'}, status=status.HTTP_400_BAD_REQUEST)
+
+        indexes = parse_list_param(request, 'indexes', INDEXES, INDEXES)
+        aggregate = request.query_params.get('aggregate', 'mean')
+        if aggregate not in AGGREGATES:
+            return Response({'error': f'Aggregate must be one of: {", ".join(AGGREGATES)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        readings = filter_time_range(self.get_reading_scope(request), request)
+
+        # Access was checked above, so users sharing a scope share its grids
+        params = request.query_params
+        scope = ('device', params['device_id']) if params.get('device_id') else ('user', params.get('user_id') or request.user.id)
+        key = (scope, bbox, cell, params.get('since'), params.get('until'), tuple(indexes), aggregate)
+        cache_key = 'qgis-grid:' + hashlib.sha1(repr(key).encode()).hexdigest()
+        result = cache.get(cache_key)
+        if result is None:
+            min_long, min_lat, max_long, max_lat = bbox
+            points = read_columns(
+                filter_bbox(readings, min_lat, min_long, max_lat, max_long),
+                {'geo_location_lat': 'float64', 'geo_location_long': 'float64', **{index: 'float32' for index in indexes}},
+                settings.EXPORT_CHUNK_SIZE,
+            )
+            grids = bin_points(points, bbox, cell, indexes, aggregate)
+            result = {
+                'bbox': list(bbox),
+                'cell': cell,
+                'rows': rows,
+                'columns': columns,
+                'aggregate': aggregate,
+                'points': len(points['geo_location_lat']),
+                'grids': {index: grid_to_lists(grid) for index, grid in grids.items()},
+            }
+            cache.set(cache_key, result, settings.QGIS_GRID_CACHE_TTL)
+        return Response(result)
 
-        qgis_data = QGIS.objects.filter(geo_location_lat=lat, geo_location_long=long, device__users=request.user)
+    @action(detail=False, methods=['get'], url_path='by-location')
+    def by_location(self, request):
+        qgis_data = filter_location(scope_to_user_devices(QGIS.objects.all(), request.user), request)
 
-        serializer = QGISSerializer(qgis_data, many=True)
-        return Response(serializer.data)
+        return self.reading_response(request, qgis_data)
 
     @action(detail=False, methods=['get'], url_path='by-location/admin', permission_classes=[IsAdminUser])
     def by_location_admin(self, request):
-        lat = request.query_params.get('lat')
-        long = request.query_params.get('long')
-
-        if not lat or not long:
-            return Response({'error': 'Latitude and longitude are required'}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            lat = float(lat)
-            long = float(long)
-        except ValueError:
-            return Response({'error': 'Invalid latitude or longitude'}, status=status.HTTP_400_BAD_REQUEST)
+        qgis_data = filter_location(QGIS.objects.all(), request)
 
-        qgis_data = QGIS.objects.filter(geo_location_lat=lat, geo_location_long=long)
-
-        serializer = QGISSerializer(qgis_data, many=True)
-        return Response(serializer.data)
+        return self.reading_response(request, qgis_data)
     
     @action(detail=False, methods=['get'], url_path='mapped-to-user')
     def mapped_to_user(self, request):
-        qgis_data = QGIS.objects.filter(device__users=request.user)
+        qgis_data = scope_to_user_devices(QGIS.objects.all(), request.user)
 
-        serializer = QGISSerializer(qgis_data, many=True)
-        return Response(serializer.data)
+        return self.reading_response(request, qgis_data)
     
     @action(detail=False, methods=['get'], url_path='mapped-to-user/admin')
     def mapped_to_any_user(self, request):
@@ -91,8 +172,7 @@ class QGISViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Only admin users can access this endpoint'}, status=status.HTTP_403_FORBIDDEN)
 
         qgis_data = QGIS.objects.filter(device__users__id=user_id)
-        serializer = QGISSerializer(qgis_data, many=True)
-        return Response(serializer.data)
+        return self.reading_response(request, qgis_data)
 
     @action(detail=False, methods=['get'], url_path='by-device')
     def by_device(self, request):
@@ -101,29 +181,29 @@ class QGISViewSet(viewsets.ModelViewSet):
         if not device_id:
             return Response({'error': 'Device ID is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            device = Device.objects.get(id=device_id)
-        except Device.DoesNotExist:
+        access = get_device_access(request, device_id)
+        if access is None:
             return Response({'error': 'Device not found'}, status=status.HTTP_404_NOT_FOUND)
 
         # Check if the device is associated with the authenticated user
-        if not request.user.is_superuser and request.user not in device.users.all():
+        if not access.allows(request.user):
             return Response({'error': 'Device is not associated with the authenticated user'}, status=status.HTTP_403_FORBIDDEN)
 
-        qgis_data = QGIS.objects.filter(device=device)
+        qgis_data = QGIS.objects.filter(device_id=access.device_id)
 
-        serializer = QGISSerializer(qgis_data, many=True)
-        return Response(serializer.data)
+        return self.reading_response(request, qgis_data)
 
     def update(self, request, pk=None):
         try:
             qgis = self.get_object()
-            device = qgis.device
+            access = get_device_access(request, qgis.device_id)
+            if access is None:
+                return Response({'error': 'Device not found'}, status=status.HTTP_404_NOT_FOUND)
 
-            if device.type.id != DeviceType.QGIS.value:
+            if access.type_id != DeviceType.QGIS.value:
                 return Response({'error': 'Device is not of type QGIS'}, status=status.HTTP_400_BAD_REQUEST)
 
-            if not request.user.is_superuser and request.user not in device.users.all():
+            if not access.allows(request.user):
                 return Response({'error': 'Device is not associated with the authenticated user'}, status=status.HTTP_403_FORBIDDEN)
 
             serializer = self.get_serializer(qgis, data=request.data, partial=True)
@@ -131,7 +211,7 @@ class QGISViewSet(viewsets.ModelViewSet):
                 serializer.save()
                 return Response(serializer.data)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        except QGIS.DoesNotExist:
+        except (QGIS.DoesNotExist, Http404):
             return Response({'error': 'QGIS data not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
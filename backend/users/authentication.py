@@ -0,0 +1,105 @@
+import uuid
+from collections import namedtuple
+from django.conf import settings
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from utils.cache import TTLCache
+from .claims import DEVICES_CLAIM, SUPERUSER_CLAIM, VERSION_CLAIM, decode_device_ids, get_user_state
+from .models import ApiKey, CustomUser
+
+# What a request authenticated with an API key carries in `request.auth`
+ApiKeyCredentials = namedtuple('ApiKeyCredentials', ['key', 'user', 'device_ids'])
+
+api_key_cache = TTLCache(maxsize=settings.API_KEY_CACHE_SIZE, ttl=settings.API_KEY_CACHE_TTL)
+
+
+class ApiKeyAuthentication(BaseAuthentication):
+    """
+    Authenticates requests carrying an `Api-Key` header.
+
+    Keys are resolved to their user and the ids of the devices mapped to
+    that user, and the result is cached in-process so repeated requests from
+    the same edge device skip the database lookup. Entries are dropped by
+    users.signals in the process that handles a change only, so other
+    processes may honour a revoked key for up to API_KEY_CACHE_TTL seconds.
+    """
+    header = 'Api-Key'
+
+    def authenticate(self, request):
+        raw_key = request.headers.get(self.header)
+        if not raw_key:
+            return None
+
+        try:
+            key = uuid.UUID(raw_key)
+        except ValueError:
+            raise AuthenticationFailed('Invalid API key')
+
+        credentials = api_key_cache.get(key)
+        if credentials is None:
+            try:
+                api_key = ApiKey.objects.select_related('user').get(key=key)
+            except ApiKey.DoesNotExist:
+                raise AuthenticationFailed('Invalid API key')
+            user = api_key.user
+            credentials = ApiKeyCredentials(key, user, frozenset(user.devices.values_list('id', flat=True)))
+            api_key_cache.set(key, credentials)
+
+        if not credentials.user.is_active:
+            raise AuthenticationFailed('User inactive or deleted')
+
+        return (credentials.user, credentials)
+
+    def authenticate_header(self, request):
+        return self.header
+
+
+class DeviceClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the device claims of access tokens issued
+    with JWT_DEVICE_CLAIMS enabled.
+
+    The user is built from the token and a cached (version, flags) state
+    instead of being loaded from the database, and the ids of its devices
+    are set as `claimed_device_ids` for devices.access to authorize against.
+    A token whose device version is behind the user's is stale: the
+    mappings changed since it was issued, so it is rejected and the client
+    has to refresh it; see JWT_USER_STATE_CACHE_TTL for how soon other
+    processes notice. Tokens without claims authenticate as usual.
+    """
+
+    def get_user(self, validated_token):
+        if not settings.JWT_DEVICE_CLAIMS or VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        state = get_user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        device_version, is_active, is_superuser, is_staff = state
+        if not is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if validated_token[VERSION_CLAIM] != device_version or validated_token.get(SUPERUSER_CLAIM) != is_superuser:
+            raise InvalidToken('Device mappings changed, refresh the token')
+
+        known = {
+            'id': user_id,
+            'is_active': is_active,
+            'is_superuser': is_superuser,
+            'is_staff': is_staff,
+            'device_version': device_version,
+        }
+        # from_db() takes the values in model field order, the rest load on access
+        fields = [field.attname for field in CustomUser._meta.concrete_fields if field.attname in known]
+        user = CustomUser.from_db('default', fields, [known[field] for field in fields])
+        # None when the list was too long to embed
+        devices = validated_token.get(DEVICES_CLAIM)
+        user.claimed_device_ids = decode_device_ids(devices) if devices is not None else None
+        return user
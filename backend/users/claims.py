@@ -0,0 +1,91 @@
+import base64
+import json
+from django.conf import settings
+from django.core.cache import cache
+
+# Claims carried by access tokens in device claims mode
+VERSION_CLAIM = 'dv'
+DEVICES_CLAIM = 'devices'
+SUPERUSER_CLAIM = 'su'
+
+# Users mapped to more devices than fit in this many bytes get tokens
+# without the device list and are authorized from the database instead
+MAX_DEVICES_CLAIM_BYTES = 2048
+
+
+def encode_device_ids(device_ids):
+    """
+    The shorter of a sorted id list and a bitmap of the ids relative to
+    the smallest one: {"offset": first id, "bitmap": base64url bits}.
+    """
+    device_ids = sorted(device_ids)
+    if not device_ids:
+        return []
+    offset = device_ids[0]
+    bits = 0
+    for device_id in device_ids:
+        bits |= 1 << (device_id - offset)
+    bitmap = bits.to_bytes((device_ids[-1] - offset) // 8 + 1, 'little')
+    packed = {'offset': offset, 'bitmap': base64.urlsafe_b64encode(bitmap).rstrip(b'=').decode()}
+    if len(json.dumps(packed)) < len(json.dumps(device_ids)):
+        return packed
+    return device_ids
+
+
+def decode_device_ids(claim):
+    if isinstance(claim, list):
+        return frozenset(claim)
+    bitmap = base64.urlsafe_b64decode(claim['bitmap'] + '=' * (-len(claim['bitmap']) % 4))
+    bits = int.from_bytes(bitmap, 'little')
+    device_ids = set()
+    while bits:
+        lowest = bits & -bits
+        device_ids.add(claim['offset'] + lowest.bit_length() - 1)
+        bits ^= lowest
+    return frozenset(device_ids)
+
+
+def add_device_claims(token, user):
+    """Embed the user's device ids and device mapping version in access `token`."""
+    # Access tokens copy the claims of their refresh token, which older logins
+    # filled with a device list that may since have gone stale
+    token.payload.pop(DEVICES_CLAIM, None)
+    # The version is read before the ids: a mapping change in between leaves
+    # the token with an old version, so it is rejected rather than trusted
+    token[VERSION_CLAIM] = user.device_version
+    token[SUPERUSER_CLAIM] = user.is_superuser
+    devices = encode_device_ids(user.devices.values_list('id', flat=True))
+    if len(json.dumps(devices)) <= MAX_DEVICES_CLAIM_BYTES:
+        token[DEVICES_CLAIM] = devices
+    return token
+
+
+def _state_key(user_id):
+    return f'jwt-user-state:{user_id}'
+
+
+def get_user_state(user_id):
+    """
+    (device_version, is_active, is_superuser, is_staff) of a user, or None
+    when the user does not exist. Cached for JWT_USER_STATE_CACHE_TTL
+    seconds; changes to the user or its device mappings drop the entry, in
+    every process only when the Django cache backend is shared.
+    """
+    from .models import CustomUser
+
+    key = _state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        state = (
+            CustomUser.objects.filter(pk=user_id)
+            .values_list('device_version', 'is_active', 'is_superuser', 'is_staff')
+            .first()
+        )
+        if state is None:
+            return None
+        cache.set(key, state, settings.JWT_USER_STATE_CACHE_TTL)
+    return tuple(state)
+
+
+def forget_user_state(user_ids):
+    cache.delete_many([_state_key(user_id) for user_id in user_ids])
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_alter_customuser_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='device_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -9,6 +9,9 @@ class CustomUser(AbstractUser):
     last_name = models.CharField(max_length=100, blank=True, null=True)
     role = models.CharField(max_length=30, blank=True, null=True)
     email = models.EmailField(unique=True)
+    # Bumped whenever the user's device mappings change, so access tokens
+    # carrying an older device list are rejected, see users.claims
+    device_version = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.username
@@ -4,8 +4,13 @@ from .models import CustomUser
 from devices.serializers import DeviceSerializer
 from .models import ApiKey
 from rest_framework.validators import UniqueValidator
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from django.conf import settings
 from django.contrib.auth import authenticate
+from .claims import add_device_claims
 
 class UserSerializer(serializers.ModelSerializer):
     contact = serializers.CharField(max_length=100, allow_blank=True, required=False)
@@ -62,10 +67,14 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
             raise serializers.ValidationError('No active account found with the given credentials')
 
         refresh = self.get_token(user)
+        access = refresh.access_token
+        if settings.JWT_DEVICE_CLAIMS:
+            # Only access tokens carry them, refreshing reads them afresh
+            add_device_claims(access, user)
 
         data = {}
         data['refresh'] = str(refresh)
-        data['access'] = str(refresh.access_token)
+        data['access'] = str(access)
         data['user'] = {
             'id': user.id,
             'username': user.username,
@@ -75,4 +84,21 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
             'role': user.role,
         }
 
-        return data
\ No newline at end of file
+        return data
+
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refreshes access tokens with the current device claims rather than those of the login."""
+
+    def validate(self, attrs):
+        if not settings.JWT_DEVICE_CLAIMS:
+            return super().validate(attrs)
+
+        refresh = RefreshToken(attrs['refresh'])
+        user = CustomUser.objects.filter(**{jwt_settings.USER_ID_FIELD: refresh[jwt_settings.USER_ID_CLAIM]}).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed('No active account found for the given token', code='no_active_account')
+
+        access = refresh.access_token
+        add_device_claims(access, user)
+        return {'access': str(access)}
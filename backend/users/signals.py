@@ -0,0 +1,54 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from devices.models import Device
+from .authentication import api_key_cache
+from .claims import forget_user_state
+from .models import ApiKey, CustomUser
+
+
+@receiver(post_delete, sender=ApiKey)
+def invalidate_deleted_api_key(sender, instance, **kwargs):
+    api_key_cache.pop(instance.key)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_api_keys(sender, instance, created, **kwargs):
+    forget_user_state([instance.pk])
+    if not created:
+        api_key_cache.discard_where(lambda key, credentials: credentials.user.pk == instance.pk)
+
+
+@receiver(m2m_changed, sender=Device.users.through)
+def invalidate_api_key_devices(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        user_ids = {instance.pk}
+    elif pk_set is None:
+        # device.users.clear() does not say which users were affected
+        api_key_cache.clear()
+        return
+    else:
+        user_ids = pk_set
+    api_key_cache.discard_where(lambda key, credentials: credentials.user.pk in user_ids)
+
+
+@receiver(m2m_changed, sender=Device.users.through)
+def bump_device_version(sender, instance, action, reverse, pk_set, **kwargs):
+    """Outdate the device claims of tokens issued to users whose mappings change."""
+    if action == 'pre_clear' and not reverse:
+        # Who loses the device is only known before device.users.clear()
+        instance._cleared_user_ids = list(instance.users.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        user_ids = [instance.pk]
+    elif pk_set is None:
+        user_ids = instance.__dict__.pop('_cleared_user_ids', [])
+    else:
+        user_ids = list(pk_set)
+    if user_ids:
+        CustomUser.objects.filter(pk__in=user_ids).update(device_version=F('device_version') + 1)
+        forget_user_state(user_ids)
@@ -1,3 +1,139 @@
-from django.test import TestCase
+import json
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from devices.access import device_access_cache
+from devices.models import Device
+from utils.utils import DeviceType
+from .authentication import api_key_cache
+from .claims import DEVICES_CLAIM
+from .models import ApiKey, CustomUser
 
-# Create your tests here.
+
+def make_user(username):
+    return CustomUser.objects.create_user(username=username, email=f'{username}@example.org', password='password')
+
+
+def make_station(name, *users):
+    device = Device.objects.create(name=name, location='field', address=name, type_id=DeviceType.WEATHER_STATION.value)
+    device.users.add(*users)
+    return device
+
+
+class CacheResetMixin:
+    def setUp(self):
+        # The caches are per process and outlive each test's transaction
+        cache.clear()
+        api_key_cache.clear()
+        device_access_cache.clear()
+
+
+@override_settings(JWT_DEVICE_CLAIMS=True)
+class DeviceClaimsTokenTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('farmer')
+        self.station = make_station('station', self.user)
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post('/login/', json.dumps({'username': 'farmer', 'password': 'password'}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']
+
+    def refresh(self, refresh_token):
+        response = self.client.post('/refresh/', json.dumps({'refresh': refresh_token}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']['access']
+
+    def get_station(self, access, station):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        try:
+            return self.client.get(f'/wstations/by-device/?device_id={station.id}')
+        finally:
+            self.client.credentials()
+
+    def test_token_authorizes_mapped_devices(self):
+        other = make_station('other', make_user('neighbour'))
+        access = self.login()['access']
+
+        self.assertEqual(self.get_station(access, self.station).status_code, 200)
+        self.assertEqual(self.get_station(access, other).status_code, 403)
+
+    def test_mapping_change_makes_token_stale(self):
+        tokens = self.login()
+        make_station('new', self.user)
+
+        self.assertEqual(self.get_station(tokens['access'], self.station).status_code, 401)
+        self.assertEqual(self.get_station(self.refresh(tokens['refresh']), self.station).status_code, 200)
+
+    def test_refreshed_token_loses_unmapped_device(self):
+        tokens = self.login()
+        self.station.users.remove(self.user)
+
+        self.assertEqual(self.get_station(tokens['access'], self.station).status_code, 401)
+        self.assertEqual(self.get_station(self.refresh(tokens['refresh']), self.station).status_code, 403)
+
+    def test_only_access_tokens_carry_device_ids(self):
+        tokens = self.login()
+
+        self.assertEqual(AccessToken(tokens['access'])[DEVICES_CLAIM], [self.station.id])
+        self.assertNotIn(DEVICES_CLAIM, RefreshToken(tokens['refresh']).payload)
+
+    def test_refresh_drops_device_ids_that_outgrew_the_claim(self):
+        # As issued before refresh tokens stopped carrying device ids
+        refresh = RefreshToken.for_user(self.user)
+        refresh[DEVICES_CLAIM] = [self.station.id]
+        other = make_station('other', self.user)
+        self.station.users.remove(self.user)
+
+        with mock.patch('users.claims.MAX_DEVICES_CLAIM_BYTES', 2):
+            access = self.refresh(str(refresh))
+
+        self.assertNotIn(DEVICES_CLAIM, AccessToken(access).payload)
+        # Authorized from the database instead of the stale list
+        self.assertEqual(self.get_station(access, self.station).status_code, 403)
+        self.assertEqual(self.get_station(access, other).status_code, 200)
+
+    def test_inactive_user_cannot_refresh(self):
+        tokens = self.login()
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.get_station(tokens['access'], self.station).status_code, 401)
+        response = self.client.post('/refresh/', json.dumps({'refresh': tokens['refresh']}), content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+
+class ApiKeyAuthenticationTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('farmer')
+        self.station = make_station('station', self.user)
+        self.key = ApiKey.objects.create(user=self.user)
+        self.client = APIClient()
+
+    def post_reading(self):
+        return self.client.post(
+            '/wstations-edge/',
+            json.dumps({'device': self.station.id, 'temperature': 21, 'recording_time': '2024-01-01T00:00:00Z'}),
+            content_type='application/json',
+            HTTP_API_KEY=str(self.key.key),
+        )
+
+    def test_valid_key_is_accepted(self):
+        self.assertEqual(self.post_reading().status_code, 201)
+
+    def test_unmapped_device_is_rejected(self):
+        self.assertEqual(self.post_reading().status_code, 201)
+        self.station.users.remove(self.user)
+
+        self.assertEqual(self.post_reading().status_code, 403)
+
+    def test_revoked_key_is_rejected(self):
+        self.assertEqual(self.post_reading().status_code, 201)
+        self.key.delete()
+
+        self.assertEqual(self.post_reading().status_code, 401)
@@ -15,6 +15,7 @@ from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAdminUser
 from .models import ApiKey
 from .serializers import ApiKeySerializer
+from utils.pagination import paginated_response
 
 # from devices.serializers import DeviceSerializer
 # from rest_framework.decorators import action
@@ -71,9 +72,8 @@ class UserViewSet(viewsets.ViewSet):
         if not request.user.is_superuser:
             raise PermissionDenied("You do not have permission to perform this action.")
 
-        users = CustomUser.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        users = CustomUser.objects.prefetch_related('devices')
+        return paginated_response(request, users, UserSerializer)
 
     def update(self, request, pk=None):
         try:
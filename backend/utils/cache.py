@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return default
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def discard_where(self, predicate):
+        # Drop every entry for which predicate(key, value) is true
+        with self._lock:
+            for key in [key for key, (_, value) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,67 @@
+import io
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from django.db import models
+
+# Stored for missing timestamps and foreign keys in the integer columns
+MISSING_TIME = np.iinfo(np.int64).min
+MISSING_ID = -1
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def _column(values, field, dtype):
+    if isinstance(field, models.DateTimeField):
+        return np.fromiter(
+            (MISSING_TIME if value is None else (value - EPOCH) // MILLISECOND for value in values),
+            dtype=np.int64, count=len(values),
+        )
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        return np.fromiter(
+            (MISSING_ID if value is None else value for value in values),
+            dtype=dtype, count=len(values),
+        )
+    # None becomes NaN
+    return np.array(values, dtype=dtype)
+
+
+def read_columns(queryset, columns, chunk_size):
+    """
+    Read `queryset` into one typed array per column.
+
+    `columns` maps field names to numpy dtypes. Datetime fields become int64
+    epoch milliseconds whatever dtype is given, missing integers become -1
+    and missing floats NaN. Rows are read in id order with values_list, one
+    chunk of `chunk_size` rows per query, so no model instances are built.
+    """
+    names = list(columns)
+    fields = [queryset.model._meta.get_field(name) for name in names]
+    parts = {name: [] for name in names}
+
+    readings = queryset.order_by('id')
+    last_id = None
+    while True:
+        chunk = readings if last_id is None else readings.filter(id__gt=last_id)
+        rows = list(chunk.values_list('id', *[field.attname for field in fields])[:chunk_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for position, (name, field) in enumerate(zip(names, fields), start=1):
+            parts[name].append(_column([row[position] for row in rows], field, columns[name]))
+        if len(rows) < chunk_size:
+            break
+
+    arrays = {}
+    for name, field in zip(names, fields):
+        dtype = np.int64 if isinstance(field, models.DateTimeField) else columns[name]
+        arrays[name] = np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=dtype)
+    return arrays
+
+
+def export_npz(queryset, columns, chunk_size, compress=False):
+    """Write `queryset` as a NumPy .npz archive with one array per column, see `read_columns`."""
+    arrays = read_columns(queryset, columns, chunk_size)
+    buffer = io.BytesIO()
+    (np.savez_compressed if compress else np.savez)(buffer, **arrays)
+    return buffer.getvalue()
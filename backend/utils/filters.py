@@ -0,0 +1,50 @@
+from datetime import datetime, time, timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ParseError
+
+
+def parse_datetime_param(request, name):
+    """
+    Read an ISO date or datetime query parameter. Naive values are taken as UTC.
+
+    Returns None when the parameter is absent and raises ParseError when it
+    cannot be parsed.
+    """
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = datetime.combine(day, time.min) if day else None
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ParseError(f'Invalid {name}: expected an ISO 8601 date or datetime')
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def filter_time_range(queryset, request, field='recording_time'):
+    """Apply the `since` (inclusive) and `until` (exclusive) query parameters to `field`."""
+    since = parse_datetime_param(request, 'since')
+    until = parse_datetime_param(request, 'until')
+    if since:
+        queryset = queryset.filter(**{f'{field}__gte': since})
+    if until:
+        queryset = queryset.filter(**{f'{field}__lt': until})
+    return queryset
+
+
+def parse_list_param(request, name, allowed, default):
+    """Read a comma separated query parameter, rejecting values not in `allowed`."""
+    value = request.query_params.get(name)
+    if not value:
+        return list(default)
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    unknown = [item for item in items if item not in allowed]
+    if unknown:
+        raise ParseError(f'Unknown {name}: {", ".join(unknown)}. Allowed: {", ".join(allowed)}')
+    return items
@@ -0,0 +1,171 @@
+import math
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+from rest_framework.exceptions import ParseError
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+# Readings are indexed on a fixed 0.01° grid (about 1.1 km north-south).
+# Stored `geo_cell` values depend on it, so changing the cell size requires
+# recomputing the column for every row.
+CELL_DEGREES = 0.01
+ROWS = 18000
+COLUMNS = 36000
+
+# A bbox spanning more grid rows than this is matched with one coarse cell
+# range instead of one range per row
+MAX_CELL_ROWS = 64
+MAX_RADIUS_M = 500000
+
+
+def _row(lat):
+    return min(max(int(math.floor((lat + 90) / CELL_DEGREES)), 0), ROWS - 1)
+
+
+def _column(long):
+    return min(max(int(math.floor((long + 180) / CELL_DEGREES)), 0), COLUMNS - 1)
+
+
+def grid_cell(lat, long):
+    """Grid cell id of a position, or None when either coordinate is missing or out of range."""
+    if lat is None or long is None or not (-90 <= lat <= 90 and -180 <= long <= 180):
+        return None
+    return _row(lat) * COLUMNS + _column(long)
+
+
+def assign_geo_cells(readings):
+    """Set `geo_cell` on unsaved readings, for code paths that bypass Model.save()."""
+    for reading in readings:
+        reading.geo_cell = grid_cell(reading.geo_location_lat, reading.geo_location_long)
+    return readings
+
+
+def haversine(lat1, long1, lat2, long2):
+    """Great-circle distance in meters."""
+    lat1, long1, lat2, long2 = map(math.radians, (lat1, long1, lat2, long2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_expression(lat, long):
+    """Database expression of the haversine distance in meters from a reading to (lat, long)."""
+    lat1, long1 = Radians(F('geo_location_lat')), Radians(F('geo_location_long'))
+    lat2, long2 = math.radians(lat), math.radians(long)
+    a = (
+        Power(Sin((lat1 - lat2) / 2), 2)
+        + Cos(lat1) * math.cos(lat2) * Power(Sin((long1 - long2) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_M * ASin(Sqrt(a), output_field=FloatField())
+
+
+def _cell_condition(min_lat, min_long, max_lat, max_long):
+    first_row, last_row = _row(min_lat), _row(max_lat)
+    first_column, last_column = _column(min_long), _column(max_long)
+    if last_row - first_row >= MAX_CELL_ROWS:
+        return Q(geo_cell__range=(first_row * COLUMNS + first_column, last_row * COLUMNS + last_column))
+    condition = Q()
+    for row in range(first_row, last_row + 1):
+        condition |= Q(geo_cell__range=(row * COLUMNS + first_column, row * COLUMNS + last_column))
+    return condition
+
+
+def filter_bbox(queryset, min_lat, min_long, max_lat, max_long):
+    """
+    Readings inside a bounding box.
+
+    The grid cells covering the box select candidates through the geo_cell
+    index; the exact coordinates are then compared on those rows only. A box
+    whose west edge lies east of its east edge crosses the antimeridian.
+    """
+    if min_long <= max_long:
+        spans = [(min_long, max_long)]
+    else:
+        spans = [(min_long, 180.0), (-180.0, max_long)]
+
+    cells = Q()
+    bounds = Q()
+    for west, east in spans:
+        cells |= _cell_condition(min_lat, west, max_lat, east)
+        bounds |= Q(geo_location_long__gte=west, geo_location_long__lte=east)
+    return queryset.filter(cells).filter(bounds, geo_location_lat__gte=min_lat, geo_location_lat__lte=max_lat)
+
+
+def filter_radius(queryset, lat, long, radius_m):
+    """Readings within `radius_m` meters of (lat, long), annotated with their `distance`."""
+    lat_delta = radius_m / METERS_PER_DEGREE
+    min_lat, max_lat = max(lat - lat_delta, -90.0), min(lat + lat_delta, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        min_long, max_long = -180.0, 180.0
+    else:
+        long_delta = lat_delta / math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+        if long_delta >= 180:
+            min_long, max_long = -180.0, 180.0
+        else:
+            min_long = (long - long_delta + 180) % 360 - 180
+            max_long = (long + long_delta + 180) % 360 - 180
+
+    candidates = filter_bbox(queryset, min_lat, min_long, max_lat, max_long)
+    return candidates.annotate(distance=distance_expression(lat, long)).filter(distance__lte=radius_m)
+
+
+def _parse_floats(request, name, count):
+    try:
+        values = [float(value) for value in request.query_params[name].split(',')]
+    except ValueError:
+        values = []
+    if len(values) != count or not all(math.isfinite(value) for value in values):
+        raise ParseError(f'Invalid {name}: expected {count} comma separated numbers')
+    return values
+
+
+def _check_position(lat, long, name):
+    if not (-90 <= lat <= 90 and -180 <= long <= 180):
+        raise ParseError(f'Invalid {name}: latitude must be within ±90 and longitude within ±180')
+
+
+def parse_bbox(request):
+    """Read `bbox=min_long,min_lat,max_long,max_lat`, or None when it is absent."""
+    if not request.query_params.get('bbox'):
+        return None
+    min_long, min_lat, max_long, max_lat = _parse_floats(request, 'bbox', 4)
+    _check_position(min_lat, min_long, 'bbox')
+    _check_position(max_lat, max_long, 'bbox')
+    if min_lat > max_lat:
+        raise ParseError('Invalid bbox: min_lat is greater than max_lat')
+    return min_long, min_lat, max_long, max_lat
+
+
+def filter_location(queryset, request):
+    """
+    Apply the location parameters of the by-location actions.
+
+    - `bbox=min_long,min_lat,max_long,max_lat` (GeoJSON order)
+    - `near=lat,long&radius_m=` for a great-circle radius
+    - `lat=&long=` for the exact position, as before
+    """
+    params = request.query_params
+    bbox = parse_bbox(request)
+    if bbox:
+        min_long, min_lat, max_long, max_lat = bbox
+        return filter_bbox(queryset, min_lat, min_long, max_lat, max_long)
+
+    if params.get('near'):
+        lat, long = _parse_floats(request, 'near', 2)
+        _check_position(lat, long, 'near')
+        try:
+            radius_m = float(params.get('radius_m', ''))
+        except ValueError:
+            raise ParseError('radius_m is required with near')
+        if not 0 < radius_m <= MAX_RADIUS_M:
+            raise ParseError(f'radius_m must be greater than 0 and at most {MAX_RADIUS_M}')
+        return filter_radius(queryset, lat, long, radius_m)
+
+    lat, long = params.get('lat'), params.get('long')
+    if not lat or not long:
+        raise ParseError('One of bbox, near or lat and long is required')
+    try:
+        lat, long = float(lat), float(long)
+    except ValueError:
+        raise ParseError('Invalid latitude or longitude')
+    return queryset.filter(geo_cell=grid_cell(lat, long), geo_location_lat=lat, geo_location_long=long)
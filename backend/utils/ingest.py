@@ -0,0 +1,211 @@
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, close_old_connections, transaction
+from .geo import assign_geo_cells
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Collects unsaved readings of one model and writes them with bulk_create.
+
+    A buffer is flushed when it holds `max_size` rows or when its oldest row
+    has waited `flush_interval` seconds. Rows of a batch that cannot be
+    written because the database is unavailable are kept for the next flush
+    (up to `max_pending` rows); rows rejected by the database are retried one
+    by one so a single bad row does not drop the whole batch.
+    """
+
+    def __init__(self, model, max_size, flush_interval, max_pending):
+        self.model = model
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # Called with the written rows inside the inserting transaction, so
+        # derived rows commit or roll back with them; after_flush runs after
+        self.on_insert = []
+        self.after_flush = []
+        # bulk_create skips Model.save(), which computes the spatial key
+        self.has_geo_cell = hasattr(model, 'geo_cell')
+        self._pending = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        # Reported through `stats()` and the log
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_flush_lag = 0.0
+
+    def append(self, validated_data):
+        instance = self.model(**validated_data)
+        if self.has_geo_cell:
+            assign_geo_cells([instance])
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(instance)
+            full = len(self._pending) >= self.max_size
+        if full:
+            self.flush()
+        else:
+            _ensure_flusher()
+        return instance
+
+    def is_due(self):
+        with self._lock:
+            return self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                oldest, self._oldest = self._oldest, None
+            if not rows:
+                return 0
+
+            lag = time.monotonic() - oldest
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create(rows, batch_size=self.max_size)
+                    self._inserted(rows)
+                written = rows
+            except OperationalError:
+                self.failures += 1
+                logger.exception('Database unavailable, keeping %d buffered %s rows', len(rows), self.model.__name__)
+                self._requeue(rows, oldest)
+                return 0
+            except DatabaseError:
+                self.failures += 1
+                logger.exception('Bulk insert of %d %s rows failed, retrying row by row', len(rows), self.model.__name__)
+                written = self._save_individually(rows)
+
+            for callback in self.after_flush:
+                try:
+                    callback(written)
+                except Exception:
+                    logger.exception('after_flush callback for %s failed', self.model.__name__)
+
+            self.flushed += len(written)
+            self.last_flush_lag = lag
+            if lag >= settings.INGEST_FLUSH_LAG_WARNING:
+                logger.warning('Flushed %d %s rows, oldest waited %.1fs', len(written), self.model.__name__, lag)
+            else:
+                logger.debug('Flushed %d %s rows, oldest waited %.1fs', len(written), self.model.__name__, lag)
+            return len(written)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+            age = time.monotonic() - self._oldest if self._oldest is not None else 0.0
+        return {
+            'model': self.model.__name__,
+            'pending': pending,
+            'oldest_pending_age': age,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'last_flush_lag': self.last_flush_lag,
+        }
+
+    def _requeue(self, rows, oldest):
+        with self._lock:
+            self._pending[:0] = rows
+            self._oldest = oldest
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                del self._pending[:overflow]
+                self.dropped += overflow
+                logger.error('Write-behind buffer for %s is full, dropped %d oldest rows', self.model.__name__, overflow)
+
+    def _inserted(self, rows):
+        for callback in self.on_insert:
+            callback(rows)
+
+    def _save_individually(self, rows):
+        written = []
+        for row in rows:
+            try:
+                with transaction.atomic():
+                    row.save(force_insert=True)
+                    self._inserted([row])
+                written.append(row)
+            except DatabaseError:
+                self.dropped += 1
+                logger.exception('Dropped buffered %s row that the database rejected', self.model.__name__)
+        return written
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+_flusher = None
+
+
+def write_behind_buffer(model):
+    """Return the process-wide write-behind buffer for `model`."""
+    with _buffers_lock:
+        buffer = _buffers.get(model)
+        if buffer is None:
+            buffer = _buffers[model] = WriteBehindBuffer(
+                model,
+                max_size=settings.INGEST_BUFFER_SIZE,
+                flush_interval=settings.INGEST_FLUSH_INTERVAL,
+                max_pending=settings.INGEST_BUFFER_MAX_PENDING,
+            )
+        return buffer
+
+
+def flush_all():
+    for buffer in list(_buffers.values()):
+        buffer.flush()
+
+
+def buffer_stats():
+    """Backlog, flush lag and failure counts of this process's buffers."""
+    return [buffer.stats() for buffer in list(_buffers.values())]
+
+
+def _log_stats():
+    for stats in buffer_stats():
+        if stats['pending'] or stats['dropped'] or stats['failures']:
+            logger.info(
+                'Write-behind %(model)s: %(pending)d pending, oldest %(oldest_pending_age).1fs, '
+                '%(flushed)d flushed, %(dropped)d dropped, %(failures)d failed flushes, '
+                'last flush lag %(last_flush_lag).1fs', stats,
+            )
+
+
+def _flush_due_buffers():
+    last_report = time.monotonic()
+    while True:
+        time.sleep(max(settings.INGEST_FLUSH_INTERVAL / 2, 0.1))
+        for buffer in list(_buffers.values()):
+            if buffer.is_due():
+                try:
+                    buffer.flush()
+                except Exception:
+                    logger.exception('Background flush of %s failed', buffer.model.__name__)
+        close_old_connections()
+        # Every worker process reports its own buffers
+        if time.monotonic() - last_report >= settings.INGEST_STATS_LOG_INTERVAL:
+            last_report = time.monotonic()
+            _log_stats()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _buffers_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_due_buffers, name='write-behind-flusher', daemon=True)
+            _flusher.start()
+
+
+# Whatever is still buffered when the worker process exits is written out
+atexit.register(flush_all)
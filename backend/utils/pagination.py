@@ -0,0 +1,126 @@
+import base64
+import json
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def keyset_after(ordering, position):
+    """Condition selecting the rows that sort after `position` in `ordering`."""
+    # (a, b, c) > (x, y, z)  <=>  a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+    condition = Q()
+    for depth, field in enumerate(ordering):
+        equal = {name: value for name, value in zip(ordering[:depth], position)}
+        condition |= Q(**equal, **{f'{field}__gt': position[depth]})
+    return condition
+
+
+def iterate_keyset(queryset, ordering, chunk_size):
+    """
+    Yield every row of `queryset` in `ordering`, reading `chunk_size` rows per query.
+
+    Unlike QuerySet.iterator() this keeps memory flat on MySQL too, whose
+    driver buffers the whole result set of a query client-side.
+    """
+    queryset = queryset.order_by(*ordering)
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        position = [getattr(chunk[-1], field) for field in ordering]
+        chunk = list(queryset.filter(keyset_after(ordering, position))[:chunk_size])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque-cursor pagination over a unique, ascending ordering.
+
+    Each page is read with a `WHERE (ordering) > (last row of previous page)`
+    condition instead of an OFFSET, so every page costs the same regardless
+    of how deep the client has paged. The last field of `ordering` must be
+    unique (usually `id`) to keep the ordering total.
+    """
+    ordering = ('id',)
+    cursor_query_param = 'page[cursor]'
+    page_size_query_param = 'page[size]'
+
+    def __init__(self):
+        self.page_size = settings.KEYSET_PAGE_SIZE
+        self.max_page_size = settings.KEYSET_MAX_PAGE_SIZE
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, instance):
+        position = [getattr(instance, field) for field in self.ordering]
+        raw = json.dumps(position, default=lambda value: value.isoformat(), separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, queryset, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            position = json.loads(raw)
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            fields = [queryset.model._meta.get_field(field) for field in self.ordering]
+            return [field.to_python(value) for field, value in zip(fields, position)]
+        except Exception:
+            raise NotFound('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(keyset_after(self.ordering, self.decode_cursor(queryset, cursor)))
+
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = self.encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+        self.page_size_used = page_size
+        return page[:page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'meta': {
+                'pagination': {
+                    'page_size': self.page_size_used,
+                    'next_cursor': self.next_cursor,
+                },
+            },
+            'links': {
+                'first': self.get_first_link(),
+                'next': self.get_next_link(),
+            },
+        })
+
+
+class RecordingTimePagination(KeysetPagination):
+    """Keyset pagination for readings, following their (recording_time, id) order."""
+    ordering = ('recording_time', 'id')
+
+
+def paginated_response(request, queryset, serializer_class, pagination_class=KeysetPagination, context=None):
+    """Serialize one keyset page of `queryset` and wrap it in a paginated response."""
+    paginator = pagination_class()
+    page = paginator.paginate_queryset(queryset, request)
+    serializer = serializer_class(page, many=True, context=context or {'request': request})
+    return paginator.get_paginated_response(serializer.data)
@@ -0,0 +1,26 @@
+import json
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline delimited JSON, one object per line.
+
+    Reading lists stream their rows themselves (see ReadingListMixin); this
+    renderer makes `format=ndjson` / `Accept: application/x-ndjson`
+    negotiable and renders any other response, such as errors, as lines.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, list) else [data]
+        return b''.join(encode_line(item) for item in items)
+
+
+def encode_line(item):
+    return json.dumps(item, cls=JSONEncoder, ensure_ascii=False).encode() + b'\n'
@@ -0,0 +1,121 @@
+import numpy as np
+from django.db.models import Avg, Count, Max, Min
+from django.db.models.functions import Trunc
+
+BUCKETS = ('minute', 'hour', 'day', 'week', 'month')
+SQL_AGGREGATES = {'avg': Avg, 'min': Min, 'max': Max, 'count': Count}
+PERCENTILES = {'p25': 25, 'p50': 50, 'p75': 75, 'p90': 90, 'p95': 95, 'p99': 99}
+AGGREGATES = tuple(SQL_AGGREGATES) + tuple(PERCENTILES)
+
+
+class TooManyReadings(ValueError):
+    """More readings than percentiles are computed over in memory."""
+
+
+def grouped_percentiles(groups, values, group_count, percentiles):
+    """
+    Percentiles of `values` per group, computed without a Python loop over groups.
+
+    `groups` holds the group index of every value and NaN values are ignored.
+    Values are sorted by (group, value) once and every percentile is read
+    with numpy's default linear interpolation from each group's slice.
+    """
+    keep = ~np.isnan(values)
+    groups, values = groups[keep], values[keep]
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+
+    result = {}
+    for percentile in percentiles:
+        position = (counts[present] - 1) * (percentile / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        fraction = position - lower
+        out = np.full(group_count, np.nan)
+        out[present] = (
+            values[starts[present] + lower] * (1 - fraction)
+            + values[starts[present] + upper] * fraction
+        )
+        result[percentile] = out
+    return result
+
+
+def _read_samples(queryset, index, metrics, chunk_size):
+    """
+    Group index and float64 values of every reading, read in id order with
+    one values_list query per `chunk_size` rows. Missing values become NaN.
+    """
+    groups, values = [], {metric: [] for metric in metrics}
+    readings = queryset.order_by('id')
+    last_id = None
+    while True:
+        chunk = readings if last_id is None else readings.filter(id__gt=last_id)
+        rows = list(chunk.values_list('id', 'bucket', *metrics)[:chunk_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        groups.append(np.fromiter((index[row[1]] for row in rows), dtype=np.int64, count=len(rows)))
+        for column, metric in enumerate(metrics, start=2):
+            values[metric].append(np.array([row[column] for row in rows], dtype=np.float64))
+        if len(rows) < chunk_size:
+            break
+    groups = np.concatenate(groups) if groups else np.empty(0, dtype=np.int64)
+    return groups, {metric: np.concatenate(parts) if parts else np.empty(0) for metric, parts in values.items()}
+
+
+def bucketed_stats(queryset, time_field, bucket, metrics, aggregates, chunk_size=20000, max_rows=None):
+    """
+    Aggregate `metrics` of `queryset` per `bucket` of `time_field`.
+
+    avg/min/max/count are computed by the database in one grouped query.
+    Percentiles need the raw values, which are read in chunks into numpy
+    arrays; TooManyReadings is raised instead when there are more than
+    `max_rows` of them.
+    """
+    queryset = (
+        queryset.filter(**{f'{time_field}__isnull': False})
+        .annotate(bucket=Trunc(time_field, bucket))
+        .order_by()
+    )
+
+    sql_aggregates = {
+        f'{metric}_{aggregate}': SQL_AGGREGATES[aggregate](metric)
+        for metric in metrics
+        for aggregate in aggregates
+        if aggregate in SQL_AGGREGATES
+    }
+    rows = list(queryset.values('bucket').annotate(readings=Count('id'), **sql_aggregates).order_by('bucket'))
+    buckets = [
+        {
+            'start': row['bucket'],
+            'readings': row['readings'],
+            **{
+                metric: {
+                    aggregate: row[f'{metric}_{aggregate}']
+                    for aggregate in aggregates
+                    if aggregate in SQL_AGGREGATES
+                }
+                for metric in metrics
+            },
+        }
+        for row in rows
+    ]
+
+    percentiles = [PERCENTILES[aggregate] for aggregate in aggregates if aggregate in PERCENTILES]
+    if percentiles and buckets:
+        total = sum(row['readings'] for row in rows)
+        if max_rows is not None and total > max_rows:
+            raise TooManyReadings(total)
+        index = {row['bucket']: position for position, row in enumerate(rows)}
+        groups, values = _read_samples(queryset, index, metrics, chunk_size)
+        for metric in metrics:
+            by_percentile = grouped_percentiles(groups, values[metric], len(buckets), percentiles)
+            for aggregate in aggregates:
+                if aggregate in PERCENTILES:
+                    for position, value in enumerate(by_percentile[PERCENTILES[aggregate]]):
+                        buckets[position][metric][aggregate] = None if np.isnan(value) else float(value)
+
+    return buckets
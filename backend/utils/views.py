@@ -0,0 +1,152 @@
+import os
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ParseError, PermissionDenied
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from devices.access import get_device_access, scope_to_user_devices
+from .export import export_npz
+from .filters import filter_time_range, parse_list_param
+from .ingest import buffer_stats
+from .pagination import iterate_keyset, paginated_response
+from .renderers import NDJSONRenderer, encode_line
+from .stats import AGGREGATES, BUCKETS, TooManyReadings, bucketed_stats
+
+
+class ReadingListMixin:
+    """
+    Shared rendering of reading lists: every list and filter action narrows
+    its queryset with the `since`/`until` parameters and returns one keyset
+    page of the result, or streams all of it as NDJSON when the client asks
+    for `format=ndjson` or `Accept: application/x-ndjson`.
+    """
+    time_field = 'recording_time'
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+
+    def reading_response(self, request, readings, serializer_class=None, pagination_class=None, time_field=None):
+        readings = filter_time_range(readings, request, time_field or self.time_field)
+        serializer_class = serializer_class or self.get_serializer_class()
+        pagination_class = pagination_class or self.pagination_class
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return self.stream_ndjson(readings, serializer_class, pagination_class.ordering)
+        return paginated_response(request, readings, serializer_class, pagination_class)
+
+    def stream_ndjson(self, readings, serializer_class, ordering):
+        """Stream every row as one JSON line, serializing rows as they are read."""
+        serializer = serializer_class(context=self.get_serializer_context())
+        rows = iterate_keyset(readings, ordering, settings.NDJSON_CHUNK_SIZE)
+        lines = (encode_line(serializer.to_representation(row)) for row in rows)
+        return StreamingHttpResponse(lines, content_type=NDJSONRenderer.media_type)
+
+    def list(self, request, *args, **kwargs):
+        return self.reading_response(request, self.get_queryset())
+
+
+class ReadingScopeMixin:
+    """
+    Resolves which readings an aggregate or export action covers: a single
+    device (`device_id`), another user's devices for admins (`user_id`) or,
+    by default, every device mapped to the requesting user.
+    """
+    time_field = 'recording_time'
+
+    def get_reading_scope(self, request):
+        # Every branch narrows to devices itself, so it starts unscoped
+        readings = self.queryset.all()
+        device_id = request.query_params.get('device_id')
+        user_id = request.query_params.get('user_id')
+
+        if device_id:
+            access = get_device_access(request, device_id)
+            if access is None:
+                raise NotFound('Device not found')
+            if not access.allows(request.user):
+                raise PermissionDenied('Device is not associated with the authenticated user')
+            return readings.filter(device_id=access.device_id)
+
+        if user_id:
+            if not request.user.is_superuser:
+                raise PermissionDenied('Only admin users can access this endpoint')
+            return readings.filter(device__users__id=user_id)
+
+        return scope_to_user_devices(readings, request.user)
+
+
+class ReadingStatsMixin(ReadingScopeMixin):
+    """
+    Adds a `stats` action returning bucketed aggregates of a reading viewset.
+
+    Viewsets list their numeric fields in `stats_metrics`.
+    """
+    stats_metrics = ()
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in BUCKETS:
+            raise ParseError(f'Bucket must be one of: {", ".join(BUCKETS)}')
+        metrics = parse_list_param(request, 'metrics', self.stats_metrics, self.stats_metrics)
+        aggregates = parse_list_param(request, 'aggregates', AGGREGATES, ('avg', 'min', 'max'))
+
+        readings = filter_time_range(self.get_reading_scope(request), request, self.time_field)
+        try:
+            buckets = bucketed_stats(
+                readings, self.time_field, bucket, metrics, aggregates,
+                chunk_size=settings.EXPORT_CHUNK_SIZE, max_rows=settings.STATS_PERCENTILE_MAX_ROWS,
+            )
+        except TooManyReadings:
+            raise ParseError(
+                f'Percentiles are computed over at most {settings.STATS_PERCENTILE_MAX_ROWS} readings, '
+                'narrow the range with since and until'
+            )
+
+        return Response({
+            'bucket': bucket,
+            'metrics': metrics,
+            'aggregates': aggregates,
+            'buckets': buckets,
+        })
+
+
+class ReadingExportMixin(ReadingScopeMixin):
+    """
+    Adds an `export` action writing the readings in scope as a NumPy .npz
+    archive, one typed array per column, for analytics jobs that would
+    otherwise page through the JSON API.
+
+    Viewsets map the exported fields to numpy dtypes in `export_columns`.
+    Admins may pass `all=true` to export every device.
+    """
+    export_columns = {}
+    export_name = 'readings'
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        if request.query_params.get('all') == 'true':
+            if not request.user.is_superuser:
+                raise PermissionDenied('Only admin users can access this endpoint')
+            readings = self.get_queryset()
+        else:
+            readings = self.get_reading_scope(request)
+        readings = filter_time_range(readings, request, self.time_field)
+        compress = request.query_params.get('compress') == 'true'
+
+        payload = export_npz(readings, self.export_columns, settings.EXPORT_CHUNK_SIZE, compress=compress)
+        response = HttpResponse(payload, content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{self.export_name}.npz"'
+        return response
+
+
+class IngestStatsView(APIView):
+    """
+    Write-behind buffer counters of the worker process serving the request;
+    every process also logs its own, see INGEST_STATS_LOG_INTERVAL.
+    """
+    permission_classes = [IsAdminUser]
+    resource_name = 'IngestStats'
+
+    def get(self, request):
+        return Response({'pid': os.getpid(), 'buffers': buffer_stats()})
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import WeatherStation
+from .models import UnparsedMeasurement, WeatherStation, WeatherStationRollup
 
 # Register your models here.
 admin.site.register(WeatherStation)
+admin.site.register(WeatherStationRollup)
+admin.site.register(UnparsedMeasurement)
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class WeatherstationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'weatherStation'
+
+    def ready(self):
+        from utils.ingest import write_behind_buffer
+        from .models import WeatherStation
+        from .nearest import station_index
+        from .rollups import record_readings
+
+        # Buffered readings reach the rollups in the transaction that writes
+        # them and the station index once they are written
+        buffer = write_behind_buffer(WeatherStation)
+        buffer.on_insert.append(record_readings)
+        buffer.after_flush.append(station_index.observe)
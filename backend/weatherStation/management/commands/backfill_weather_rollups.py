@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+from weatherStation.models import WeatherStation
+from weatherStation.rollups import rebuild_rollups
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date: {value}')
+        moment = parse_datetime(f'{day.isoformat()}T00:00:00+00:00')
+    return moment
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hourly and daily WeatherStation rollups from the raw readings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', type=int, action='append', dest='devices', help='Only rebuild this device (repeatable)')
+        parser.add_argument('--since', type=parse_moment, help='Rebuild buckets from this date (YYYY-MM-DD or ISO datetime)')
+        parser.add_argument('--until', type=parse_moment, help='Rebuild buckets up to and including this date')
+
+    def handle(self, *args, **options):
+        device_ids = options['devices']
+        if not device_ids:
+            device_ids = (
+                WeatherStation.objects.filter(device__isnull=False)
+                .values_list('device_id', flat=True)
+                .distinct()
+                .order_by('device_id')
+            )
+
+        total = 0
+        for device_id in device_ids:
+            written = rebuild_rollups(device_id, since=options['since'], until=options['until'])
+            total += written
+            self.stdout.write(f'Device {device_id}: {written} rollup rows')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {total} rollup rows'))
@@ -0,0 +1,166 @@
+import re
+import sys
+from django.db import migrations, models
+
+MEASUREMENTS = ('wind_speed', 'rainfall', 'sunshine', 'temperature', 'humidity')
+MEASUREMENT_RE = re.compile(r'^\s*([-+]?(?:\d+(?:[.,]\d*)?|[.,]\d+)(?:[eE][-+]?\d+)?)\s*[^\d\s]*\s*$')
+BATCH_SIZE = 2000
+REPORT_LIMIT = 100
+
+
+def parse_measurement(raw):
+    match = MEASUREMENT_RE.match(raw)
+    if not match:
+        return None
+    value = float(match.group(1).replace(',', '.'))
+    return value if value == value and abs(value) != float('inf') else None
+
+
+def convert_measurements(apps, schema_editor):
+    WeatherStation = apps.get_model('weatherStation', 'WeatherStation')
+    UnparsedMeasurement = apps.get_model('weatherStation', 'UnparsedMeasurement')
+    unparsed = 0
+    reported = []
+    last_id = 0
+    while True:
+        batch = list(WeatherStation.objects.filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+        if not batch:
+            break
+        rejected = []
+        for row in batch:
+            for field in MEASUREMENTS:
+                raw = getattr(row, field)
+                value = None
+                if raw is not None and raw.strip():
+                    value = parse_measurement(raw)
+                    if value is None:
+                        rejected.append(UnparsedMeasurement(reading_id=row.id, field=field, raw_value=raw))
+                setattr(row, f'{field}_value', value)
+        # Every value set to NULL is kept verbatim before the text columns go
+        UnparsedMeasurement.objects.bulk_create(rejected)
+        WeatherStation.objects.bulk_update(batch, [f'{field}_value' for field in MEASUREMENTS])
+        unparsed += len(rejected)
+        reported += rejected[:REPORT_LIMIT - len(reported)]
+        last_id = batch[-1].id
+
+    if unparsed:
+        sys.stdout.write(
+            f'\n  {unparsed} weather station values could not be parsed and were set to NULL; '
+            'all of them are kept in weatherStation_unparsedmeasurement:\n'
+        )
+        for measurement in reported:
+            sys.stdout.write(f'    WeatherStation {measurement.reading_id} {measurement.field}={measurement.raw_value!r}\n')
+        if unparsed > len(reported):
+            sys.stdout.write(f'    ... and {unparsed - len(reported)} more\n')
+
+
+def restore_measurements(apps, schema_editor):
+    WeatherStation = apps.get_model('weatherStation', 'WeatherStation')
+    UnparsedMeasurement = apps.get_model('weatherStation', 'UnparsedMeasurement')
+    last_id = 0
+    while True:
+        batch = list(WeatherStation.objects.filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+        if not batch:
+            break
+        raw_values = {
+            (reading_id, field): raw_value
+            for reading_id, field, raw_value in UnparsedMeasurement.objects.filter(
+                reading_id__gte=batch[0].id, reading_id__lte=batch[-1].id,
+            ).values_list('reading_id', 'field', 'raw_value')
+        }
+        for row in batch:
+            for field in MEASUREMENTS:
+                value = getattr(row, f'{field}_value')
+                setattr(row, field, raw_values.get((row.id, field)) if value is None else repr(value))
+        WeatherStation.objects.bulk_update(batch, list(MEASUREMENTS))
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherStation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherstation',
+            name='wind_speed_value',
+            field=models.FloatField(help_text='m/s', null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherstation',
+            name='rainfall_value',
+            field=models.FloatField(help_text='mm', null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherstation',
+            name='sunshine_value',
+            field=models.FloatField(help_text='hours', null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherstation',
+            name='temperature_value',
+            field=models.FloatField(help_text='°C', null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherstation',
+            name='humidity_value',
+            field=models.FloatField(help_text='% relative humidity', null=True),
+        ),
+        migrations.CreateModel(
+            name='UnparsedMeasurement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reading_id', models.IntegerField(db_index=True)),
+                ('field', models.CharField(max_length=32)),
+                ('raw_value', models.TextField()),
+            ],
+        ),
+        migrations.RunPython(convert_measurements, restore_measurements),
+        migrations.RemoveField(
+            model_name='weatherstation',
+            name='wind_speed',
+        ),
+        migrations.RemoveField(
+            model_name='weatherstation',
+            name='rainfall',
+        ),
+        migrations.RemoveField(
+            model_name='weatherstation',
+            name='sunshine',
+        ),
+        migrations.RemoveField(
+            model_name='weatherstation',
+            name='temperature',
+        ),
+        migrations.RemoveField(
+            model_name='weatherstation',
+            name='humidity',
+        ),
+        migrations.RenameField(
+            model_name='weatherstation',
+            old_name='wind_speed_value',
+            new_name='wind_speed',
+        ),
+        migrations.RenameField(
+            model_name='weatherstation',
+            old_name='rainfall_value',
+            new_name='rainfall',
+        ),
+        migrations.RenameField(
+            model_name='weatherstation',
+            old_name='sunshine_value',
+            new_name='sunshine',
+        ),
+        migrations.RenameField(
+            model_name='weatherstation',
+            old_name='temperature_value',
+            new_name='temperature',
+        ),
+        migrations.RenameField(
+            model_name='weatherstation',
+            old_name='humidity_value',
+            new_name='humidity',
+        ),
+    ]
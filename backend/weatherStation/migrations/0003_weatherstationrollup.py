@@ -0,0 +1,49 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_image_geo_location_lat_image_geo_location_long'),
+        ('weatherStation', '0002_numeric_measurements'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeatherStationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('wind_speed_min', models.FloatField(null=True)),
+                ('wind_speed_max', models.FloatField(null=True)),
+                ('wind_speed_sum', models.FloatField(default=0)),
+                ('wind_speed_count', models.PositiveIntegerField(default=0)),
+                ('rainfall_min', models.FloatField(null=True)),
+                ('rainfall_max', models.FloatField(null=True)),
+                ('rainfall_sum', models.FloatField(default=0)),
+                ('rainfall_count', models.PositiveIntegerField(default=0)),
+                ('sunshine_min', models.FloatField(null=True)),
+                ('sunshine_max', models.FloatField(null=True)),
+                ('sunshine_sum', models.FloatField(default=0)),
+                ('sunshine_count', models.PositiveIntegerField(default=0)),
+                ('temperature_min', models.FloatField(null=True)),
+                ('temperature_max', models.FloatField(null=True)),
+                ('temperature_sum', models.FloatField(default=0)),
+                ('temperature_count', models.PositiveIntegerField(default=0)),
+                ('humidity_min', models.FloatField(null=True)),
+                ('humidity_max', models.FloatField(null=True)),
+                ('humidity_sum', models.FloatField(default=0)),
+                ('humidity_count', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weather_rollups', to='devices.device')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='weatherstationrollup',
+            constraint=models.UniqueConstraint(fields=('device', 'resolution', 'bucket_start'), name='unique_weather_rollup_bucket'),
+        ),
+    ]
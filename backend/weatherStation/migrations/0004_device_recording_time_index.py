@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_image_geo_location_lat_image_geo_location_long'),
+        ('weatherStation', '0003_weatherstationrollup'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='weatherstation',
+            options={'ordering': ['device', 'recording_time', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='weatherstation',
+            index=models.Index(fields=['device', 'recording_time'], name='weather_device_time_idx'),
+        ),
+    ]
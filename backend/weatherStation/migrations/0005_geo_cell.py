@@ -0,0 +1,51 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:55
+
+import math
+from django.db import migrations, models
+
+# Frozen copy of utils.geo.grid_cell
+CELL_DEGREES = 0.01
+ROWS = 18000
+COLUMNS = 36000
+BATCH_SIZE = 2000
+
+
+def grid_cell(lat, long):
+    if lat is None or long is None or not (-90 <= lat <= 90 and -180 <= long <= 180):
+        return None
+    row = min(max(int(math.floor((lat + 90) / CELL_DEGREES)), 0), ROWS - 1)
+    column = min(max(int(math.floor((long + 180) / CELL_DEGREES)), 0), COLUMNS - 1)
+    return row * COLUMNS + column
+
+
+def backfill_geo_cells(apps, schema_editor):
+    Model = apps.get_model('weatherStation', 'WeatherStation')
+    last_id = 0
+    while True:
+        batch = list(
+            Model.objects.filter(id__gt=last_id)
+            .order_by('id')
+            .only('id', 'geo_location_lat', 'geo_location_long')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for row in batch:
+            row.geo_cell = grid_cell(row.geo_location_lat, row.geo_location_long)
+        Model.objects.bulk_update(batch, ['geo_cell'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherStation', '0004_device_recording_time_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherstation',
+            name='geo_cell',
+            field=models.IntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_geo_cells, migrations.RunPython.noop),
+    ]
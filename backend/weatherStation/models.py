@@ -1,17 +1,84 @@
 from django.db import models
 from devices.models import Device
+from utils.geo import grid_cell
 
 class WeatherStation(models.Model):
+    MEASUREMENTS = ('wind_speed', 'rainfall', 'sunshine', 'temperature', 'humidity')
+
     geo_location_lat = models.FloatField(null=True)
     geo_location_long = models.FloatField(null=True)
+    # Spatial grid key of the position, see utils.geo
+    geo_cell = models.IntegerField(null=True, db_index=True, editable=False)
     wind_direction = models.CharField(max_length=128, null=True)
-    wind_speed = models.CharField(max_length=128, null=True)
-    rainfall = models.CharField(max_length=128, null=True)
-    sunshine = models.CharField(max_length=128, null=True)
-    temperature = models.CharField(max_length=128, null=True)
-    humidity = models.CharField(max_length=128, null=True)
+    wind_speed = models.FloatField(null=True, help_text='m/s')
+    rainfall = models.FloatField(null=True, help_text='mm')
+    sunshine = models.FloatField(null=True, help_text='hours')
+    temperature = models.FloatField(null=True, help_text='°C')
+    humidity = models.FloatField(null=True, help_text='% relative humidity')
     recording_time = models.DateTimeField()
     device = models.ForeignKey(Device, on_delete=models.SET_NULL, null=True, related_name='weather_stations')
 
+    class Meta:
+        # Per-device history is read as a range over (device, recording_time)
+        indexes = [
+            models.Index(fields=['device', 'recording_time'], name='weather_device_time_idx'),
+        ]
+        ordering = ['device', 'recording_time', 'id']
+
+    def save(self, *args, **kwargs):
+        self.geo_cell = grid_cell(self.geo_location_lat, self.geo_location_long)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"WeatherStation {self.id}-Device {self.device.name}" if self.device else f"WeatherStation {self.id}"
+
+
+class WeatherStationRollup(models.Model):
+    """Per-device hourly or daily aggregates of the WeatherStation measurements."""
+    HOUR = 'hour'
+    DAY = 'day'
+    RESOLUTIONS = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='weather_rollups')
+    resolution = models.CharField(max_length=4, choices=RESOLUTIONS)
+    bucket_start = models.DateTimeField()
+    readings = models.PositiveIntegerField(default=0)
+    wind_speed_min = models.FloatField(null=True)
+    wind_speed_max = models.FloatField(null=True)
+    wind_speed_sum = models.FloatField(default=0)
+    wind_speed_count = models.PositiveIntegerField(default=0)
+    rainfall_min = models.FloatField(null=True)
+    rainfall_max = models.FloatField(null=True)
+    rainfall_sum = models.FloatField(default=0)
+    rainfall_count = models.PositiveIntegerField(default=0)
+    sunshine_min = models.FloatField(null=True)
+    sunshine_max = models.FloatField(null=True)
+    sunshine_sum = models.FloatField(default=0)
+    sunshine_count = models.PositiveIntegerField(default=0)
+    temperature_min = models.FloatField(null=True)
+    temperature_max = models.FloatField(null=True)
+    temperature_sum = models.FloatField(default=0)
+    temperature_count = models.PositiveIntegerField(default=0)
+    humidity_min = models.FloatField(null=True)
+    humidity_max = models.FloatField(null=True)
+    humidity_sum = models.FloatField(default=0)
+    humidity_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'resolution', 'bucket_start'], name='unique_weather_rollup_bucket'),
+        ]
+
+    def __str__(self):
+        return f"WeatherStationRollup {self.resolution} {self.bucket_start:%Y-%m-%d %H:%M}-Device {self.device_id}"
+
+
+class UnparsedMeasurement(models.Model):
+    """Legacy text measurement migration 0002 could not convert to a number, kept verbatim."""
+    # Not a foreign key so the record outlives the reading
+    reading_id = models.IntegerField(db_index=True)
+    field = models.CharField(max_length=32)
+    raw_value = models.TextField()
+
+    def __str__(self):
+        return f"UnparsedMeasurement WeatherStation {self.reading_id} {self.field}={self.raw_value!r}"
@@ -0,0 +1,163 @@
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from devices.models import Device
+from utils.geo import EARTH_RADIUS_M, METERS_PER_DEGREE, haversine
+from utils.utils import DeviceType
+from .models import WeatherStation
+
+# Cells of the in-memory index, in degrees. Independent of utils.geo's
+# database grid, which is much finer than station spacing.
+CELL_DEGREES = 1.0
+ROWS = int(180 / CELL_DEGREES)
+COLUMNS = int(360 / CELL_DEGREES)
+
+# Below this many candidate stations a linear scan beats walking the grid
+LINEAR_SCAN_LIMIT = 64
+
+
+def _cell(lat, long):
+    row = min(int((lat + 90) // CELL_DEGREES), ROWS - 1)
+    column = int((long + 180) // CELL_DEGREES) % COLUMNS
+    return row, column
+
+
+def _cap_cells(lat, long, radius_m):
+    """Grid cells covering every point within `radius_m` of (lat, long)."""
+    angle = radius_m / EARTH_RADIUS_M
+    min_lat = lat - math.degrees(angle)
+    max_lat = lat + math.degrees(angle)
+    first_row, _ = _cell(max(min_lat, -90.0), long)
+    last_row, _ = _cell(min(max_lat, 90.0), long)
+
+    if min_lat <= -90 or max_lat >= 90 or math.sin(angle) >= math.cos(math.radians(lat)):
+        # The cap contains a pole: every longitude is in reach
+        columns = range(COLUMNS)
+    else:
+        # Widest longitude offset of the spherical cap
+        delta = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+        _, first_column = _cell(lat, long - delta)
+        _, last_column = _cell(lat, long + delta)
+        if last_column < first_column:
+            last_column += COLUMNS
+        columns = [column % COLUMNS for column in range(first_column, last_column + 1)]
+
+    for row in range(first_row, last_row + 1):
+        for column in columns:
+            yield row, column
+
+
+class StationIndex:
+    """
+    Latest known position of every weather station device, bucketed on a
+    uniform lat/long grid for k-nearest-neighbour queries.
+
+    The index is built from the database on first use and rebuilt after
+    `NEAREST_INDEX_TTL` seconds; in between, stored readings are fed to
+    `observe()` so stations that move are picked up immediately by the
+    worker that received the reading.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._cells = defaultdict(set)
+        self._built_at = None
+
+    def _place(self, positions, cells, device_id, lat, long, recording_time):
+        current = positions.get(device_id)
+        if current is not None:
+            if recording_time is not None and current[2] is not None and recording_time < current[2]:
+                return
+            cells[_cell(current[0], current[1])].discard(device_id)
+        positions[device_id] = (lat, long, recording_time)
+        cells[_cell(lat, long)].add(device_id)
+
+    def rebuild(self):
+        latest = (
+            WeatherStation.objects.filter(
+                device=OuterRef('pk'), geo_location_lat__isnull=False, geo_location_long__isnull=False,
+            )
+            .order_by('-recording_time', '-id')
+        )
+        stations = (
+            Device.objects.filter(type_id=DeviceType.WEATHER_STATION.value)
+            .annotate(
+                lat=Subquery(latest.values('geo_location_lat')[:1]),
+                long=Subquery(latest.values('geo_location_long')[:1]),
+                recorded=Subquery(latest.values('recording_time')[:1]),
+            )
+            .filter(lat__isnull=False)
+            .values_list('id', 'lat', 'long', 'recorded')
+        )
+
+        positions, cells = {}, defaultdict(set)
+        for device_id, lat, long, recording_time in stations:
+            if -90 <= lat <= 90 and -180 <= long <= 180:
+                self._place(positions, cells, device_id, lat, long, recording_time)
+        with self._lock:
+            self._positions, self._cells = positions, cells
+            self._built_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        built_at = self._built_at
+        if built_at is None or time.monotonic() - built_at >= settings.NEAREST_INDEX_TTL:
+            self.rebuild()
+
+    def observe(self, readings):
+        """Move stations to the position of newly stored readings."""
+        if self._built_at is None:
+            return
+        with self._lock:
+            for reading in readings:
+                lat, long = reading.geo_location_lat, reading.geo_location_long
+                if reading.device_id is None or lat is None or long is None:
+                    continue
+                if -90 <= lat <= 90 and -180 <= long <= 180:
+                    self._place(self._positions, self._cells, reading.device_id, lat, long, reading.recording_time)
+
+    def nearest(self, lat, long, k, device_ids=None, max_distance=None):
+        """
+        The `k` stations closest to (lat, long) as (distance in meters,
+        device id, station lat, station long, recording time) tuples, nearest
+        first. `device_ids` restricts the search to those devices.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            positions, cells = self._positions, self._cells
+            if device_ids is not None and len(device_ids) <= LINEAR_SCAN_LIMIT:
+                candidates = (positions[device_id] + (device_id,) for device_id in device_ids if device_id in positions)
+                found = [
+                    (haversine(lat, long, station_lat, station_long), device_id, station_lat, station_long, recorded)
+                    for station_lat, station_long, recorded, device_id in candidates
+                ]
+                found = [station for station in found if max_distance is None or station[0] <= max_distance]
+                return heapq.nsmallest(k, found)
+
+            # Search caps of doubling radius until one holds k stations
+            found = {}
+            visited = set()
+            radius = CELL_DEGREES * METERS_PER_DEGREE
+            while True:
+                if max_distance is not None:
+                    radius = min(radius, max_distance)
+                for cell in _cap_cells(lat, long, radius):
+                    if cell in visited:
+                        continue
+                    visited.add(cell)
+                    for device_id in cells.get(cell, ()):
+                        if device_ids is None or device_id in device_ids:
+                            station_lat, station_long, recorded = positions[device_id]
+                            distance = haversine(lat, long, station_lat, station_long)
+                            found[device_id] = (distance, device_id, station_lat, station_long, recorded)
+                within = [station for station in found.values() if station[0] <= radius]
+                if len(within) >= k or radius == max_distance or radius >= math.pi * EARTH_RADIUS_M:
+                    return heapq.nsmallest(k, within)
+                radius *= 2
+
+
+station_index = StationIndex()
@@ -0,0 +1,135 @@
+from datetime import timedelta, timezone
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from .models import WeatherStation, WeatherStationRollup
+
+MEASUREMENTS = WeatherStation.MEASUREMENTS
+TRUNCATE = {
+    WeatherStationRollup.HOUR: TruncHour,
+    WeatherStationRollup.DAY: TruncDay,
+}
+
+
+def bucket_start(recording_time, resolution):
+    """Start of the UTC hour or day `recording_time` falls into."""
+    if recording_time.tzinfo is None:
+        recording_time = recording_time.replace(tzinfo=timezone.utc)
+    start = recording_time.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if resolution == WeatherStationRollup.DAY:
+        start = start.replace(hour=0)
+    return start
+
+
+def _fold(rollup, partial):
+    rollup.readings += partial['readings']
+    for measurement in MEASUREMENTS:
+        count = partial[f'{measurement}_count']
+        if not count:
+            continue
+        for suffix, pick in (('min', min), ('max', max)):
+            current = getattr(rollup, f'{measurement}_{suffix}')
+            value = partial[f'{measurement}_{suffix}']
+            setattr(rollup, f'{measurement}_{suffix}', value if current is None else pick(current, value))
+        setattr(rollup, f'{measurement}_sum', getattr(rollup, f'{measurement}_sum') + partial[f'{measurement}_sum'])
+        setattr(rollup, f'{measurement}_count', getattr(rollup, f'{measurement}_count') + count)
+
+
+def record_readings(readings):
+    """
+    Fold newly stored readings into the hourly and daily rollups.
+
+    Readings are first combined per (device, bucket) in Python, so a batch
+    costs one locked read and one write per touched bucket.
+    """
+    partials = {}
+    for reading in readings:
+        if reading.device_id is None or reading.recording_time is None:
+            continue
+        for resolution in TRUNCATE:
+            key = (reading.device_id, resolution, bucket_start(reading.recording_time, resolution))
+            partial = partials.get(key)
+            if partial is None:
+                partial = partials[key] = {'readings': 0}
+                for measurement in MEASUREMENTS:
+                    partial[f'{measurement}_min'] = None
+                    partial[f'{measurement}_max'] = None
+                    partial[f'{measurement}_sum'] = 0.0
+                    partial[f'{measurement}_count'] = 0
+            partial['readings'] += 1
+            for measurement in MEASUREMENTS:
+                value = getattr(reading, measurement)
+                if value is None:
+                    continue
+                value = float(value)
+                if partial[f'{measurement}_count']:
+                    partial[f'{measurement}_min'] = min(partial[f'{measurement}_min'], value)
+                    partial[f'{measurement}_max'] = max(partial[f'{measurement}_max'], value)
+                else:
+                    partial[f'{measurement}_min'] = partial[f'{measurement}_max'] = value
+                partial[f'{measurement}_sum'] += value
+                partial[f'{measurement}_count'] += 1
+
+    with transaction.atomic():
+        for (device_id, resolution, start), partial in sorted(partials.items(), key=lambda item: item[0]):
+            rollup, _ = WeatherStationRollup.objects.select_for_update().get_or_create(
+                device_id=device_id, resolution=resolution, bucket_start=start,
+            )
+            _fold(rollup, partial)
+            rollup.save()
+
+
+def rebuild_rollups(device_id, since=None, until=None, batch_size=1000):
+    """
+    Recompute the rollups of one device from the raw readings.
+
+    The range is widened to whole UTC days so hourly and daily buckets are
+    always rebuilt completely. Returns the number of rollup rows written.
+    """
+    readings = WeatherStation.objects.filter(device_id=device_id)
+    rollups = WeatherStationRollup.objects.filter(device_id=device_id)
+    if since is not None:
+        since = bucket_start(since, WeatherStationRollup.DAY)
+        readings = readings.filter(recording_time__gte=since)
+        rollups = rollups.filter(bucket_start__gte=since)
+    if until is not None:
+        until = bucket_start(until, WeatherStationRollup.DAY) + timedelta(days=1)
+        readings = readings.filter(recording_time__lt=until)
+        rollups = rollups.filter(bucket_start__lt=until)
+
+    aggregates = {'readings': Count('id')}
+    for measurement in MEASUREMENTS:
+        aggregates[f'{measurement}_min'] = Min(measurement)
+        aggregates[f'{measurement}_max'] = Max(measurement)
+        aggregates[f'{measurement}_sum'] = Sum(measurement)
+        aggregates[f'{measurement}_count'] = Count(measurement)
+
+    written = 0
+    with transaction.atomic():
+        rollups.delete()
+        for resolution, truncate in TRUNCATE.items():
+            rows = (
+                readings.annotate(bucket=truncate('recording_time', tzinfo=timezone.utc))
+                .values('bucket')
+                .annotate(**aggregates)
+                .order_by('bucket')
+            )
+            batch = []
+            for row in rows.iterator():
+                bucket = row.pop('bucket')
+                for measurement in MEASUREMENTS:
+                    row[f'{measurement}_sum'] = row[f'{measurement}_sum'] or 0.0
+                batch.append(WeatherStationRollup(device_id=device_id, resolution=resolution, bucket_start=bucket, **row))
+                if len(batch) >= batch_size:
+                    WeatherStationRollup.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            WeatherStationRollup.objects.bulk_create(batch)
+            written += len(batch)
+    return written
+
+
+def refresh_reading_buckets(device_id, recording_time):
+    """Rebuild the buckets a single reading contributes to, e.g. after it was edited or deleted."""
+    if device_id is not None and recording_time is not None:
+        rebuild_rollups(device_id, since=recording_time, until=recording_time)
@@ -1,7 +1,31 @@
+import re
 from rest_framework import serializers
-from .models import WeatherStation
+from .models import WeatherStation, WeatherStationRollup
+
+MEASUREMENT_RE = re.compile(r'^\s*([-+]?(?:\d+(?:[.,]\d*)?|[.,]\d+)(?:[eE][-+]?\d+)?)\s*[^\d\s]*\s*$')
+
+
+class MeasurementField(serializers.FloatField):
+    """
+    Float field that also accepts the string values stations used to send
+    while measurements were stored as text, e.g. "23.5", "23,5" or "23.5 C".
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            match = MEASUREMENT_RE.match(data)
+            if match:
+                data = match.group(1).replace(',', '.')
+        return super().to_internal_value(data)
+
 
 class WeatherStationSerializer(serializers.ModelSerializer):
+    wind_speed = MeasurementField(allow_null=True, required=False)
+    rainfall = MeasurementField(allow_null=True, required=False)
+    sunshine = MeasurementField(allow_null=True, required=False)
+    temperature = MeasurementField(allow_null=True, required=False)
+    humidity = MeasurementField(allow_null=True, required=False)
+
     class Meta:
         model = WeatherStation
         fields = [
@@ -17,3 +41,40 @@ class WeatherStationSerializer(serializers.ModelSerializer):
             'recording_time', 
             'device'
         ]
+
+
+class WeatherStationBulkSerializer(WeatherStationSerializer):
+    # Devices are resolved once for the whole batch instead of once per reading
+    device = serializers.IntegerField()
+
+
+class RollupMeanField(serializers.Field):
+    """Mean of one measurement over a rollup bucket, derived from its sum and count."""
+
+    def __init__(self, measurement, **kwargs):
+        self.measurement = measurement
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, rollup):
+        count = getattr(rollup, f'{self.measurement}_count')
+        return getattr(rollup, f'{self.measurement}_sum') / count if count else None
+
+
+class WeatherStationRollupSerializer(serializers.ModelSerializer):
+    wind_speed_mean = RollupMeanField('wind_speed')
+    rainfall_mean = RollupMeanField('rainfall')
+    sunshine_mean = RollupMeanField('sunshine')
+    temperature_mean = RollupMeanField('temperature')
+    humidity_mean = RollupMeanField('humidity')
+
+    class Meta:
+        model = WeatherStationRollup
+        # Rollups are listed by the reading viewset but are not readings
+        resource_name = 'WeatherStationRollup'
+        fields = ['id', 'device', 'resolution', 'bucket_start', 'readings'] + [
+            f'{measurement}_{aggregate}'
+            for measurement in WeatherStation.MEASUREMENTS
+            for aggregate in ('min', 'max', 'mean', 'sum', 'count')
+        ]
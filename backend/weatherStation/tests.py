@@ -1,3 +1,336 @@
-from django.test import TestCase
+import contextlib
+import io
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from devices.access import device_access_cache
+from devices.models import Device
+from users.authentication import api_key_cache
+from users.models import ApiKey, CustomUser
+from utils.ingest import flush_all, write_behind_buffer
+from utils.utils import DeviceType
+from .models import WeatherStation, WeatherStationRollup
+from .nearest import station_index
 
-# Create your tests here.
+
+class ApiKeyReadingTests(TestCase):
+    def setUp(self):
+        api_key_cache.clear()
+        device_access_cache.clear()
+        user = CustomUser.objects.create_user(username='farmer', email='farmer@example.org', password='password')
+        neighbour = CustomUser.objects.create_user(username='neighbour', email='neighbour@example.org', password='password')
+        self.station = Device.objects.create(name='own', location='field', address='own', type_id=DeviceType.WEATHER_STATION.value)
+        self.station.users.add(user)
+        self.foreign = Device.objects.create(name='foreign', location='field', address='foreign', type_id=DeviceType.WEATHER_STATION.value)
+        self.foreign.users.add(neighbour)
+        self.key = ApiKey.objects.create(user=user)
+        self.client = APIClient()
+
+    def reading(self, device):
+        return {'device': device.id, 'temperature': 21, 'recording_time': '2024-01-01T00:00:00Z'}
+
+    def post(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json', HTTP_API_KEY=str(self.key.key))
+
+    def test_foreign_device_reading_is_rejected(self):
+        response = self.post('/wstations-edge/', self.reading(self.foreign))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(WeatherStation.objects.filter(device=self.foreign).exists())
+
+    def test_edits_are_limited_to_the_key_devices(self):
+        foreign_reading = WeatherStation.objects.create(device=self.foreign, temperature=10, recording_time=timezone.now())
+        own_reading = WeatherStation.objects.create(device=self.station, temperature=10, recording_time=timezone.now())
+        change = json.dumps({'temperature': 30})
+
+        self.assertEqual(self.client.patch(f'/wstations-edge/{own_reading.id}/', change, content_type='application/json').status_code, 404)
+        response = self.client.patch(f'/wstations-edge/{foreign_reading.id}/', change, content_type='application/json', HTTP_API_KEY=str(self.key.key))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.patch(
+            f'/wstations-edge/{own_reading.id}/', json.dumps({'device': self.foreign.id}),
+            content_type='application/json', HTTP_API_KEY=str(self.key.key),
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.delete(f'/wstations-edge/{foreign_reading.id}/', HTTP_API_KEY=str(self.key.key)).status_code, 404)
+        self.assertTrue(WeatherStation.objects.filter(pk=foreign_reading.pk, temperature=10).exists())
+
+    def test_bulk_reports_rows_per_index(self):
+        mobile = Device.objects.create(name='mobile', location='field', address='mobile', type_id=DeviceType.MOBILE.value)
+        readings = [self.reading(self.station), self.reading(mobile), {'device': 999999}, 5]
+
+        response = self.post('/wstations-edge/bulk/', readings)
+
+        self.assertEqual(response.status_code, 201)
+        result = response.json()['data']
+        self.assertEqual((result['accepted'], result['rejected']), (1, 3))
+        self.assertEqual([reading['status'] for reading in result['readings']], ['accepted', 'rejected', 'rejected', 'rejected'])
+        self.assertEqual(WeatherStation.objects.count(), 1)
+
+    def test_bulk_requires_api_key(self):
+        response = self.client.post('/wstations-edge/bulk/', json.dumps([self.reading(self.station)]), content_type='application/json')
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_bulk_rejects_foreign_device_rows(self):
+        response = self.post('/wstations-edge/bulk/', [self.reading(self.station), self.reading(self.foreign)])
+
+        self.assertEqual(response.status_code, 201)
+        result = response.json()['data']
+        self.assertEqual((result['accepted'], result['rejected']), (1, 1))
+        self.assertEqual(result['readings'][1]['errors'], {'device': ['Device is not associated with the API key']})
+        self.assertFalse(WeatherStation.objects.filter(device=self.foreign).exists())
+
+
+@override_settings(INGEST_WRITE_BEHIND=True, INGEST_FLUSH_INTERVAL=3600)
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        device_access_cache.clear()
+        self.user = CustomUser.objects.create_user(username='farmer', email='farmer@example.org', password='password')
+        self.admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.org', password='password')
+        self.station = Device.objects.create(name='own', location='field', address='own', type_id=DeviceType.WEATHER_STATION.value)
+        self.station.users.add(self.user)
+        self.client = APIClient()
+        self.addCleanup(flush_all)
+
+    def test_create_is_buffered_until_flush(self):
+        self.client.force_authenticate(self.user)
+        reading = {'device': self.station.id, 'temperature': 21, 'recording_time': '2024-01-01T00:00:00Z'}
+
+        response = self.client.post('/wstations/', json.dumps(reading), content_type='application/json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(WeatherStation.objects.exists())
+        flush_all()
+        self.assertEqual(WeatherStation.objects.filter(device=self.station).count(), 1)
+
+    def test_stats_report_backlog_to_admins(self):
+        write_behind_buffer(WeatherStation).append(
+            {'device_id': self.station.id, 'temperature': 21, 'recording_time': timezone.now()}
+        )
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/ingest/stats/').status_code, 403)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/ingest/stats/')
+
+        self.assertEqual(response.status_code, 200)
+        buffers = {stats['model']: stats for stats in response.json()['data']['buffers']}
+        self.assertEqual(buffers['WeatherStation']['pending'], 1)
+
+
+class NumericMeasurementMigrationTests(TransactionTestCase):
+    before = [('weatherStation', '0001_initial')]
+    after = [('weatherStation', '0002_numeric_measurements')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        # The data migration reports what it could not convert on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_unparsed_values_are_kept(self):
+        apps = self.migrate(self.before)
+        LegacyReading = apps.get_model('weatherStation', 'WeatherStation')
+        reading = LegacyReading.objects.create(temperature='21,5 °C', humidity='n/a', rainfall='', recording_time=timezone.now())
+
+        apps = self.migrate(self.after)
+
+        converted = apps.get_model('weatherStation', 'WeatherStation').objects.get(pk=reading.pk)
+        self.assertEqual((converted.temperature, converted.humidity, converted.rainfall), (21.5, None, None))
+        unparsed = apps.get_model('weatherStation', 'UnparsedMeasurement').objects.values_list('reading_id', 'field', 'raw_value')
+        self.assertEqual(list(unparsed), [(reading.pk, 'humidity', 'n/a')])
+
+        apps = self.migrate(self.before)
+        restored = apps.get_model('weatherStation', 'WeatherStation').objects.get(pk=reading.pk)
+        self.assertEqual((restored.temperature, restored.humidity), ('21.5', 'n/a'))
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        api_key_cache.clear()
+        device_access_cache.clear()
+        self.user = CustomUser.objects.create_user(username='farmer', email='farmer@example.org', password='password')
+        self.station = Device.objects.create(name='own', location='field', address='own', type_id=DeviceType.WEATHER_STATION.value)
+        self.station.users.add(self.user)
+        self.key = ApiKey.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, temperature, recording_time):
+        reading = {'device': self.station.id, 'temperature': temperature, 'recording_time': recording_time}
+        response = self.client.post('/wstations/', json.dumps(reading), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['data']['id']
+
+    def hour(self):
+        return WeatherStationRollup.objects.get(device=self.station, resolution=WeatherStationRollup.HOUR)
+
+    def test_creates_fold_into_rollups(self):
+        self.create(20, '2024-01-01T10:05:00Z')
+        self.create(24, '2024-01-01T10:55:00Z')
+
+        rollup = self.hour()
+        self.assertEqual((rollup.readings, rollup.temperature_min, rollup.temperature_max, rollup.temperature_sum), (2, 20, 24, 44))
+
+    def test_rollups_render_as_their_own_resource(self):
+        self.create(20, '2024-01-01T10:05:00Z')
+
+        response = self.client.get(f'/wstations/by-device/?device_id={self.station.id}&resolution=hour')
+
+        self.assertEqual(response.status_code, 200)
+        (rollup,) = response.json()['data']
+        self.assertEqual(rollup['type'], 'WeatherStationRollup')
+        self.assertEqual(rollup['attributes']['temperature_mean'], 20)
+
+    def test_edge_edits_and_deletes_refresh_rollups(self):
+        reading_id = self.create(20, '2024-01-01T10:05:00Z')
+        self.create(24, '2024-01-01T10:55:00Z')
+        edge = APIClient()
+
+        response = edge.patch(
+            f'/wstations-edge/{reading_id}/', json.dumps({'temperature': 30}),
+            content_type='application/json', HTTP_API_KEY=str(self.key.key),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.hour().temperature_min, self.hour().temperature_max), (24, 30))
+
+        response = edge.delete(f'/wstations-edge/{reading_id}/', HTTP_API_KEY=str(self.key.key))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual((self.hour().readings, self.hour().temperature_sum), (1, 24))
+
+
+class NearestStationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='farmer', email='farmer@example.org', password='password')
+        self.own = Device.objects.create(name='own', location='field', address='own', type_id=DeviceType.WEATHER_STATION.value)
+        self.own.users.add(self.user)
+        self.foreign = Device.objects.create(name='foreign', location='field', address='foreign', type_id=DeviceType.WEATHER_STATION.value)
+        WeatherStation.objects.create(device=self.own, geo_location_lat=40.01, geo_location_long=22.0, recording_time=timezone.now())
+        WeatherStation.objects.create(device=self.foreign, geo_location_lat=40.0, geo_location_long=22.0, recording_time=timezone.now())
+        station_index.rebuild()
+        self.client = APIClient()
+
+    def nearest(self):
+        response = self.client.get('/wstations/nearest/?lat=40&long=22&k=5')
+        self.assertEqual(response.status_code, 200)
+        return [(station['device'], station['distance_m']) for station in response.json()['data']['stations']]
+
+    def test_nearest_is_limited_to_mapped_stations(self):
+        self.client.force_authenticate(self.user)
+
+        self.assertEqual(self.nearest(), [(self.own.id, 1112.0)])
+
+    def test_nearest_uses_claimed_devices_without_mapping_query(self):
+        # As set by users.authentication.DeviceClaimsJWTAuthentication
+        self.user.claimed_device_ids = frozenset([self.foreign.id])
+        self.client.force_authenticate(self.user)
+
+        # Only the station names are read
+        with self.assertNumQueries(1):
+            self.assertEqual(self.nearest(), [(self.foreign.id, 0.0)])
+
+
+class ReadingQueryTests(TestCase):
+    def setUp(self):
+        device_access_cache.clear()
+        self.user = CustomUser.objects.create_user(username='farmer', email='farmer@example.org', password='password')
+        self.station = Device.objects.create(name='own', location='field', address='own', type_id=DeviceType.WEATHER_STATION.value)
+        self.station.users.add(self.user)
+        foreign = Device.objects.create(name='foreign', location='field', address='foreign', type_id=DeviceType.WEATHER_STATION.value)
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        self.readings = [
+            WeatherStation.objects.create(
+                device=self.station, temperature=float(hour), geo_location_lat=40 + hour / 100, geo_location_long=22,
+                recording_time=start + timedelta(hours=hour),
+            )
+            for hour in range(5)
+        ]
+        self.foreign_reading = WeatherStation.objects.create(device=foreign, temperature=99, geo_location_lat=40, geo_location_long=22, recording_time=start)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']
+
+    def test_readings_of_foreign_devices_are_hidden(self):
+        self.assertEqual(len(self.get('/wstations/')), 5)
+        url = f'/wstations/{self.foreign_reading.id}/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.put(url, json.dumps({'temperature': 1}), content_type='application/json').status_code, 404)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertTrue(WeatherStation.objects.filter(pk=self.foreign_reading.pk, temperature=99).exists())
+
+    def test_stats_aggregate_per_bucket(self):
+        stats = self.get('/wstations/stats/?bucket=day&metrics=temperature&aggregates=avg,max,p50,count')
+
+        (bucket,) = stats['buckets']
+        self.assertEqual(bucket['readings'], 5)
+        self.assertEqual(bucket['temperature'], {'avg': 2.0, 'max': 4.0, 'p50': 2.0, 'count': 5})
+
+    def test_stats_cap_percentile_rows(self):
+        with override_settings(STATS_PERCENTILE_MAX_ROWS=4):
+            self.assertEqual(self.client.get('/wstations/stats/?aggregates=p50').status_code, 400)
+            self.assertEqual(self.client.get('/wstations/stats/?aggregates=avg').status_code, 200)
+
+    def test_keyset_pages_walk_every_reading_once(self):
+        seen, url = [], '/wstations/mapped-to-user/?page[size]=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['data']), 2)
+            seen += [int(reading['id']) for reading in page['data']]
+            url = page['links']['next']
+
+        self.assertEqual(seen, [reading.id for reading in self.readings])
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.client.get('/wstations/mapped-to-user/?page[cursor]=nonsense').status_code, 404)
+
+    def test_since_is_inclusive_and_until_exclusive(self):
+        readings = self.get('/wstations/mapped-to-user/?since=2024-01-01T01:00:00Z&until=2024-01-01T03:00:00Z')
+
+        self.assertEqual([int(reading['id']) for reading in readings], [reading.id for reading in self.readings[1:3]])
+
+    def test_invalid_since_is_rejected(self):
+        self.assertEqual(self.client.get('/wstations/mapped-to-user/?since=yesterday').status_code, 400)
+
+    def test_ndjson_streams_every_reading(self):
+        response = self.client.get('/wstations/mapped-to-user/?format=ndjson&page[size]=2')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [reading.id for reading in self.readings])
+
+    def test_export_writes_typed_columns(self):
+        response = self.client.get('/wstations/export/?since=2024-01-01T01:00:00Z')
+
+        self.assertEqual(response.status_code, 200)
+        arrays = np.load(io.BytesIO(response.content))
+        self.assertEqual(arrays['id'].tolist(), [reading.id for reading in self.readings[1:]])
+        self.assertEqual(arrays['temperature'].dtype, np.float32)
+        self.assertEqual(arrays['temperature'].tolist(), [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(arrays['recording_time'][0], int(self.readings[1].recording_time.timestamp() * 1000))
+
+    def test_by_location_bbox_and_radius(self):
+        inside = self.get('/wstations/by-location/?bbox=21.9,40.015,22.1,40.035')
+        self.assertEqual([int(reading['id']) for reading in inside], [reading.id for reading in self.readings[2:4]])
+
+        # 0.01 degrees of latitude are about 1112 m
+        near = self.get('/wstations/by-location/?near=40,22&radius_m=1500')
+        self.assertEqual([int(reading['id']) for reading in near], [reading.id for reading in self.readings[:2]])
+
+        self.assertEqual(self.client.get('/wstations/by-location/?near=40,22').status_code, 400)
@@ -1,80 +1,162 @@
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from .models import WeatherStation, Device
-from .serializers import WeatherStationSerializer
+from .models import WeatherStation, WeatherStationRollup, Device
+from .serializers import WeatherStationSerializer, WeatherStationBulkSerializer, WeatherStationRollupSerializer
+from .rollups import record_readings, refresh_reading_buckets
+from .nearest import station_index
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAdminUser
-from users.models import ApiKey
+from users.authentication import ApiKeyAuthentication, ApiKeyCredentials, DeviceClaimsJWTAuthentication
 from rest_framework.permissions import AllowAny
 from utils.utils import DeviceType
+from devices.access import get_device_access, scope_to_user_devices
+from devices.permissions import DeviceScopedQuerysetMixin
+from utils.geo import assign_geo_cells, filter_location
+from utils.ingest import write_behind_buffer
+from utils.views import ReadingExportMixin, ReadingListMixin, ReadingStatsMixin
+from utils.pagination import KeysetPagination, RecordingTimePagination
 
-class WeatherStationViewSet(viewsets.ModelViewSet):
+class RollupPagination(KeysetPagination):
+    ordering = ('bucket_start', 'id')
+
+
+def update_reading(serializer):
+    """Save an edited reading and rebuild the rollup buckets it left and joined."""
+    previous_bucket = (serializer.instance.device_id, serializer.instance.recording_time)
+    with transaction.atomic():
+        reading = serializer.save()
+        refresh_reading_buckets(*previous_bucket)
+        if previous_bucket != (reading.device_id, reading.recording_time):
+            refresh_reading_buckets(reading.device_id, reading.recording_time)
+    station_index.observe([reading])
+    return reading
+
+
+def destroy_reading(reading):
+    """Delete a reading and rebuild the rollup buckets it contributed to."""
+    bucket = (reading.device_id, reading.recording_time)
+    with transaction.atomic():
+        reading.delete()
+        refresh_reading_buckets(*bucket)
+
+
+class WeatherStationViewSet(DeviceScopedQuerysetMixin, ReadingListMixin, ReadingStatsMixin, ReadingExportMixin, viewsets.ModelViewSet):
     queryset = WeatherStation.objects.all()
     serializer_class = WeatherStationSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [DeviceClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecordingTimePagination
+    stats_metrics = WeatherStation.MEASUREMENTS
+    export_columns = {
+        'id': 'int64',
+        'device': 'int32',
+        'recording_time': 'int64',
+        'geo_location_lat': 'float64',
+        'geo_location_long': 'float64',
+        **{measurement: 'float32' for measurement in WeatherStation.MEASUREMENTS},
+    }
+    export_name = 'weather-stations'
 
     def create(self, request, *args, **kwargs):
         # Extract the device ID and check its type and ownership
         device_id = request.data.get('device')
-        try:
-            device = Device.objects.get(id=device_id)
-        except Device.DoesNotExist:
+        access = get_device_access(request, device_id)
+        if access is None:
             return Response({'error': 'Device not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        if device.type.id != DeviceType.WEATHER_STATION.value:
+        if access.type_id != DeviceType.WEATHER_STATION.value:
             return Response({'error': 'Device is not of type WEATHER_STATION'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if not request.user.is_superuser and request.user not in device.users.all():
+        if not access.allows(request.user):
             return Response({'error': 'Device is not associated with the authenticated user'}, status=status.HTTP_403_FORBIDDEN)
         
         # Serialize the data
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            if settings.INGEST_WRITE_BEHIND:
+                reading = write_behind_buffer(WeatherStation).append(serializer.validated_data)
+                return Response(self.get_serializer(reading).data, status=status.HTTP_202_ACCEPTED)
+            # A reading is never stored without its rollup counts
+            with transaction.atomic():
+                reading = serializer.save()
+                record_readings([reading])
+            station_index.observe([reading])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=False, methods=['get'], url_path='by-location')
-    def by_location(self, request):
-        lat = request.query_params.get('lat')
-        long = request.query_params.get('long')
+    def rollup_response(self, request, rollups):
+        resolution = request.query_params.get('resolution')
+        if resolution not in dict(WeatherStationRollup.RESOLUTIONS):
+            return Response({'error': 'Resolution must be one of: hour, day'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not lat or not long:
-            return Response({'error': 'Latitude and longitude are required'}, status=status.HTTP_400_BAD_REQUEST)
+        rollups = rollups.filter(resolution=resolution)
+        # The JSON:API renderer types the response by the view's resource name
+        self.resource_name = WeatherStationRollupSerializer.Meta.resource_name
+        return self.reading_response(request, rollups, WeatherStationRollupSerializer, RollupPagination, time_field='bucket_start')
 
-        try:
-            lat = float(lat)
-            long = float(long)
-        except ValueError:
-            return Response({'error': 'Invalid latitude or longitude'}, status=status.HTTP_400_BAD_REQUEST)
+    def perform_destroy(self, instance):
+        destroy_reading(instance)
 
-        weather_stations = WeatherStation.objects.filter(geo_location_lat=lat, geo_location_long=long, device__users=request.user)
+    @action(detail=False, methods=['get'], url_path='by-location')
+    def by_location(self, request):
+        weather_stations = filter_location(scope_to_user_devices(WeatherStation.objects.all(), request.user), request)
 
-        serializer = WeatherStationSerializer(weather_stations, many=True)
-        return Response(serializer.data)
+        return self.reading_response(request, weather_stations)
 
     @action(detail=False, methods=['get'], url_path='by-location/admin', permission_classes=[IsAdminUser])
     def by_location_admin(self, request):
-        lat = request.query_params.get('lat')
-        long = request.query_params.get('long')
-
-        if not lat or not long:
-            return Response({'error': 'Latitude and longitude are required'}, status=status.HTTP_400_BAD_REQUEST)
+        weather_stations = filter_location(WeatherStation.objects.all(), request)
 
+        return self.reading_response(request, weather_stations)
+    
+    @action(detail=False, methods=['get'])
+    def nearest(self, request):
         try:
-            lat = float(lat)
-            long = float(long)
+            lat = float(request.query_params['lat'])
+            long = float(request.query_params['long'])
+            k = int(request.query_params.get('k', 5))
+            max_distance = request.query_params.get('max_distance_m')
+            max_distance = float(max_distance) if max_distance else None
+        except KeyError:
+            return Response({'error': 'Latitude and longitude are required'}, status=status.HTTP_400_BAD_REQUEST)
         except ValueError:
-            return Response({'error': 'Invalid latitude or longitude'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'error': 'Invalid latitude, longitude, k or max_distance_m'}, status=status.HTTP_400_BAD_REQUEST)
 
-        weather_stations = WeatherStation.objects.filter(geo_location_lat=lat, geo_location_long=long)
+        if not (-90 <= lat <= 90 and -180 <= long <= 180):
+            return Response({'error': 'Latitude must be within ±90 and longitude within ±180'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= k <= settings.NEAREST_MAX_K:
+            return Response({'error': f'k must be between 1 and {settings.NEAREST_MAX_K}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        device_ids = None
+        if not request.user.is_superuser:
+            # The index only holds weather stations; claimed ids cost no query
+            device_ids = getattr(request.user, 'claimed_device_ids', None)
+            if device_ids is None:
+                device_ids = set(scope_to_user_devices(Device.objects.all(), request.user, device_lookup='').values_list('id', flat=True))
+
+        stations = station_index.nearest(lat, long, k, device_ids=device_ids, max_distance=max_distance)
+        names = dict(Device.objects.filter(id__in=[station[1] for station in stations]).values_list('id', 'name'))
+        return Response({
+            'lat': lat,
+            'long': long,
+            'stations': [
+                {
+                    'device': device_id,
+                    'name': names.get(device_id),
+                    'geo_location_lat': station_lat,
+                    'geo_location_long': station_long,
+                    'recording_time': recording_time,
+                    'distance_m': round(distance, 1),
+                }
+                for distance, device_id, station_lat, station_long, recording_time in stations
+            ],
+        })
 
-        serializer = WeatherStationSerializer(weather_stations, many=True)
-        return Response(serializer.data)
-    
     @action(detail=False, methods=['get'], url_path='by-device')
     def by_device(self, request):
         device_id = request.query_params.get('device_id')
@@ -82,25 +164,28 @@ class WeatherStationViewSet(viewsets.ModelViewSet):
         if not device_id:
             return Response({'error': 'Device ID is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            device = Device.objects.get(id=device_id)
-        except Device.DoesNotExist:
+        access = get_device_access(request, device_id)
+        if access is None:
             return Response({'error': 'Device not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        if not request.user.is_superuser and request.user not in device.users.all():
+        if not access.allows(request.user):
             return Response({'error': 'Device is not associated with the authenticated user'}, status=status.HTTP_403_FORBIDDEN)
 
-        weather_stations = WeatherStation.objects.filter(device=device)
+        if request.query_params.get('resolution'):
+            return self.rollup_response(request, WeatherStationRollup.objects.filter(device_id=access.device_id))
 
-        serializer = WeatherStationSerializer(weather_stations, many=True)
-        return Response(serializer.data)
+        weather_stations = WeatherStation.objects.filter(device_id=access.device_id)
+
+        return self.reading_response(request, weather_stations)
     
     @action(detail=False, methods=['get'], url_path='mapped-to-user')
     def mapped_to_user(self, request):
-        weather_stations = WeatherStation.objects.filter(device__users=request.user)
+        if request.query_params.get('resolution'):
+            return self.rollup_response(request, scope_to_user_devices(WeatherStationRollup.objects.all(), request.user))
+
+        weather_stations = scope_to_user_devices(WeatherStation.objects.all(), request.user)
 
-        serializer = WeatherStationSerializer(weather_stations, many=True)
-        return Response(serializer.data)
+        return self.reading_response(request, weather_stations)
     
     @action(detail=False, methods=['get'], url_path='mapped-to-user/admin', permission_classes=[IsAdminUser])
     def mapped_to_any_user(self, request):
@@ -113,26 +198,28 @@ class WeatherStationViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Only admin users can access this endpoint'}, status=status.HTTP_403_FORBIDDEN)
 
         weather_stations = WeatherStation.objects.filter(device__users__id=user_id)
-        serializer = WeatherStationSerializer(weather_stations, many=True)
-        return Response(serializer.data)
+        return self.reading_response(request, weather_stations)
 
     def update(self, request, pk=None):
         try:
             weather_station = self.get_object()
-            device = weather_station.device
+            access = get_device_access(request, weather_station.device_id)
+            if access is None:
+                return Response({'error': 'Device not found'}, status=status.HTTP_404_NOT_FOUND)
 
-            if device.type.id != DeviceType.WEATHER_STATION.value:
+            if access.type_id != DeviceType.WEATHER_STATION.value:
                 return Response({'error': 'Device is not of type WEATHER_STATION'}, status=status.HTTP_400_BAD_REQUEST)
 
-            if not request.user.is_superuser and request.user not in device.users.all():
+            if not access.allows(request.user):
                 return Response({'error': 'Device is not associated with the authenticated user'}, status=status.HTTP_403_FORBIDDEN)
 
+            previous_bucket = (weather_station.device_id, weather_station.recording_time)
             serializer = self.get_serializer(weather_station, data=request.data, partial=True)
             if serializer.is_valid():
-                serializer.save()
+                update_reading(serializer)
                 return Response(serializer.data)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        except WeatherStation.DoesNotExist:
+        except (WeatherStation.DoesNotExist, Http404):
             return Response({'error': 'Weather Station data not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -141,20 +228,34 @@ class WeatherStationViewSet(viewsets.ModelViewSet):
 class WeatherStationAPIkeyViewSet(viewsets.ModelViewSet):
     queryset = WeatherStation.objects.all()
     serializer_class = WeatherStationSerializer
+    authentication_classes = [ApiKeyAuthentication]
     permission_classes = [AllowAny]
+    pagination_class = RecordingTimePagination
 
-    def create(self, request, *args, **kwargs):
-        api_key = request.headers.get('Api-Key')
-        if not api_key:
+    def check_api_key(self, request):
+        if not isinstance(request.auth, ApiKeyCredentials):
             return Response({'error': 'API key is required'}, status=status.HTTP_401_UNAUTHORIZED)
-        
-        # Check if the API key exists in the database
-        try:
-            api_key_obj = ApiKey.objects.get(key=api_key)
-        except ApiKey.DoesNotExist:
-            return Response({'error': 'Invalid API key'}, status=status.HTTP_401_UNAUTHORIZED)
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return None
+
+    def get_queryset(self):
+        # Reads and edits only reach the readings of the key's devices
+        if not isinstance(self.request.auth, ApiKeyCredentials):
+            return WeatherStation.objects.none()
+        return WeatherStation.objects.filter(device_id__in=self.request.auth.device_ids)
+
+    def perform_update(self, serializer):
+        device = serializer.validated_data.get('device')
+        if device is not None and device.id not in self.request.auth.device_ids:
+            raise PermissionDenied('Device is not associated with the API key')
+        update_reading(serializer)
+
+    def perform_destroy(self, instance):
+        destroy_reading(instance)
+
+    def create(self, request, *args, **kwargs):
+        error = self.check_api_key(request)
+        if error:
+            return error
 
         # Extract the device ID from the request data
         device_id = request.data.get('device')
@@ -162,21 +263,84 @@ class WeatherStationAPIkeyViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Device ID is required'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Your remaining logic to create the weather station
-        try:
-            device = Device.objects.get(id=device_id)
-        except Device.DoesNotExist:
+        access = get_device_access(request, device_id)
+        if access is None:
             return Response({'error': 'Device not found'}, status=status.HTTP_404_NOT_FOUND)
 
         # Check device type and ownership
-        if device.type.id != DeviceType.WEATHER_STATION.value:
+        if access.type_id != DeviceType.WEATHER_STATION.value:
             return Response({'error': 'Device is not of type WEATHER_STATION'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # if not device.users.all():
-        #     return Response({'error': 'Device is not associated with any user'}, status=status.HTTP_403_FORBIDDEN)
+
+        if access.device_id not in request.auth.device_ids:
+            return Response({'error': 'Device is not associated with the API key'}, status=status.HTTP_403_FORBIDDEN)
         
         # Serialize the data
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            if settings.INGEST_WRITE_BEHIND:
+                reading = write_behind_buffer(WeatherStation).append(serializer.validated_data)
+                return Response(self.get_serializer(reading).data, status=status.HTTP_202_ACCEPTED)
+            # A reading is never stored without its rollup counts
+            with transaction.atomic():
+                reading = serializer.save()
+                record_readings([reading])
+            station_index.observe([reading])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        error = self.check_api_key(request)
+        if error:
+            return error
+
+        readings = request.data
+        if isinstance(readings, dict):
+            readings = readings.get('readings')
+        if not isinstance(readings, list) or not readings:
+            return Response({'error': 'A non-empty list of readings is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(readings) > settings.EDGE_BULK_MAX_READINGS:
+            return Response({'error': f'At most {settings.EDGE_BULK_MAX_READINGS} readings are accepted per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate every reading first so the devices can be fetched in one query
+        results = []
+        validated = []
+        for index, reading in enumerate(readings):
+            if not isinstance(reading, dict):
+                results.append({'index': index, 'status': 'rejected', 'errors': {'non_field_errors': ['Reading must be an object']}})
+                continue
+            serializer = WeatherStationBulkSerializer(data=reading)
+            if serializer.is_valid():
+                validated.append((index, serializer.validated_data))
+            else:
+                results.append({'index': index, 'status': 'rejected', 'errors': serializer.errors})
+
+        device_types = dict(
+            Device.objects.filter(id__in={data['device'] for _, data in validated}).values_list('id', 'type_id')
+        )
+
+        weather_stations = []
+        for index, data in validated:
+            device_id = data.pop('device')
+            if device_id not in device_types:
+                results.append({'index': index, 'status': 'rejected', 'errors': {'device': ['Device not found']}})
+            elif device_types[device_id] != DeviceType.WEATHER_STATION.value:
+                results.append({'index': index, 'status': 'rejected', 'errors': {'device': ['Device is not of type WEATHER_STATION']}})
+            elif device_id not in request.auth.device_ids:
+                results.append({'index': index, 'status': 'rejected', 'errors': {'device': ['Device is not associated with the API key']}})
+            else:
+                weather_stations.append(WeatherStation(device_id=device_id, **data))
+                results.append({'index': index, 'status': 'accepted'})
+
+        with transaction.atomic():
+            WeatherStation.objects.bulk_create(assign_geo_cells(weather_stations), batch_size=settings.EDGE_BULK_BATCH_SIZE)
+            record_readings(weather_stations)
+        station_index.observe(weather_stations)
+
+        results.sort(key=lambda result: result['index'])
+        response_status = status.HTTP_201_CREATED if weather_stations else status.HTTP_400_BAD_REQUEST
+        return Response({
+            'accepted': len(weather_stations),
+            'rejected': len(readings) - len(weather_stations),
+            'readings': results,
+        }, status=response_status)